@@ -0,0 +1,207 @@
+""" tryb wsadowy Gemini Batch API: wszystkie wybrane strony wysyłane jako jedno zadanie,
+    wyniki odbierane po jego zakończeniu (niższa cena, kolejkowanie po stronie serwera)
+"""
+import os
+import json
+import asyncio
+from datetime import datetime
+from google.genai import types
+from gemini_engine import TRANSCRIPTION_MODEL, transcription_config
+from batch_journal import atomic_write_text
+from scan_files import metadata_path, save_metadata
+
+
+# zadanie w toku zapisywane w katalogu skanów (wznowienie oczekiwania po ponownym uruchomieniu)
+BATCH_JOB_FILE = "batch_api_job.json"
+BATCH_REQUESTS_FILE = "batch_api_requests.jsonl"
+
+POLL_INTERVAL = 60
+# ceny Batch API względem zwykłych wywołań
+BATCH_PRICE_FACTOR = 0.5
+
+JOB_SUCCEEDED = "JOB_STATE_SUCCEEDED"
+JOB_PARTIALLY_SUCCEEDED = "JOB_STATE_PARTIALLY_SUCCEEDED"
+FINAL_STATES = {
+    JOB_SUCCEEDED,
+    JOB_PARTIALLY_SUCCEEDED,
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+# pola GenerateContentConfig przesyłane w zapytaniu jako generation_config
+GENERATION_FIELDS = ("temperature", "top_p", "top_k", "max_output_tokens", "thinking_config",
+                     "media_resolution", "response_mime_type", "response_schema")
+
+
+def load_job(folder):
+    """ zapisane zadanie Batch API dla katalogu lub None """
+    path = os.path.join(folder, BATCH_JOB_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Błąd odczytu zadania Batch API: {e}")
+        return None
+
+
+def save_job(folder, record):
+    """ zapis danych zadania Batch API """
+    atomic_write_text(os.path.join(folder, BATCH_JOB_FILE),
+                      json.dumps(record, ensure_ascii=False, indent=2))
+
+
+def remove_job(folder):
+    """ usunięcie danych zakończonego zadania i pliku z zapytaniami """
+    for file_name in (BATCH_JOB_FILE, BATCH_REQUESTS_FILE):
+        try:
+            os.remove(os.path.join(folder, file_name))
+        except FileNotFoundError:
+            pass
+
+
+def state_name(job):
+    """ stan zadania jako tekst (JOB_STATE_...) """
+    state = getattr(job, "state", None)
+    return getattr(state, "value", None) or str(state)
+
+
+def request_line(key, contents, config):
+    """ wiersz pliku JSONL: klucz strony i zapytanie generateContent """
+    generation_config = config.model_dump(mode="json", exclude_none=True)
+    request = {
+        "contents": [content.model_dump(mode="json", exclude_none=True) for content in contents],
+        "generation_config": {k: v for k, v in generation_config.items() if k in GENERATION_FIELDS},
+    }
+    return json.dumps({"key": key, "request": request}, ensure_ascii=False)
+
+
+def parse_result_line(line):
+    """ wiersz pliku wyników: (klucz, odpowiedź GenerateContentResponse lub None, błąd lub None) """
+    entry = json.loads(line)
+    key = entry.get("key")
+    if entry.get("error") or entry.get("status"):
+        return key, None, entry.get("error") or entry.get("status")
+    response = types.GenerateContentResponse.model_validate(entry.get("response") or {})
+    return key, response, None
+
+
+class BatchApiRunner:
+    """ wysłanie zadania Batch API, oczekiwanie na wynik i zapis transkrypcji do plików txt """
+    def __init__(self, engine, model=TRANSCRIPTION_MODEL, poll_interval=POLL_INTERVAL):
+        self.engine = engine
+        self.model = model
+        self.poll_interval = poll_interval
+
+
+    async def submit(self, folder, pairs, prompt_text, prompt_name=None, model=None):
+        """ przygotowanie pliku z zapytaniami, przesłanie go i utworzenie zadania,
+            zwraca dane zadania zapisane w katalogu skanów (model - model zadania,
+            domyślnie model ustawiony dla Batch API)
+        """
+        engine = self.engine
+        model = model or self.model
+        requests_path = os.path.join(folder, BATCH_REQUESTS_FILE)
+        pages = {}
+        with open(requests_path, 'w', encoding='utf-8') as f:
+            for pair in pairs:
+                contents, key = await engine.batch_transcription_request(pair['img'], prompt_text, model)
+                f.write(request_line(pair['name'], contents, transcription_config()) + "\n")
+                pages[pair['name']] = {
+                    "txt": os.path.basename(pair['txt']),
+                    "cache_key": key,
+                }
+
+        # zadanie należy do projektu klucza głównego, przy nim pozostaje do pobrania wyników
+        key = engine.client_manager.primary_key_name
+        client = engine.client_manager.get_client(key)
+        display_name = f"scans-{os.path.basename(os.path.abspath(folder))}-{datetime.now():%Y%m%d-%H%M%S}"
+        uploaded = await client.aio.files.upload(
+            file=requests_path,
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl")
+        )
+        job = await client.aio.batches.create(
+            model=model,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=display_name)
+        )
+
+        record = {
+            "name": job.name,
+            "model": model,
+            "file": uploaded.name,
+            "prompt": prompt_name,
+            "key": key,
+            "submitted": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "pages": pages,
+        }
+        save_job(folder, record)
+        return record
+
+
+    async def wait(self, record, on_state=None, should_stop=None):
+        """ okresowe sprawdzanie stanu zadania do jego zakończenia; zwraca zadanie
+            lub None, jeśli oczekiwanie przerwano (zadanie trwa dalej po stronie serwera)
+        """
+        client = self.engine.client_manager.get_client(record.get("key"))
+        while True:
+            try:
+                job = await client.aio.batches.get(name=record["name"])
+                state = state_name(job)
+                if state in FINAL_STATES:
+                    return job
+                if on_state:
+                    on_state(state)
+            except Exception as e:
+                # błąd sieci nie przerywa oczekiwania, stan zostanie sprawdzony ponownie
+                print(f"Batch API: błąd sprawdzania stanu zadania {record['name']}: {e}")
+
+            # sprawdzanie przerwania co sekundę, stanu zadania co poll_interval
+            for _ in range(max(1, int(self.poll_interval))):
+                if should_stop and should_stop():
+                    return None
+                await asyncio.sleep(1)
+
+
+    async def collect(self, folder, record, job, journal=None, usage_callback=None):
+        """ zapis wyników zakończonego zadania do plików txt, zwraca (gotowe, błędy) """
+        pages = record["pages"]
+        results = {}
+
+        file_name = getattr(job.dest, "file_name", None) if job.dest else None
+        if file_name:
+            client = self.engine.client_manager.get_client(record.get("key"))
+            data = await client.aio.files.download(file=file_name)
+            for line in data.decode('utf-8').splitlines():
+                if line.strip():
+                    key, response, error = parse_result_line(line)
+                    results[key] = (response, error)
+
+        done = errors = 0
+        for name, page in pages.items():
+            response, error = results.get(name, (None, None))
+            text = response.text if response is not None else None
+            if not text:
+                error = error or job.error or state_name(job)
+                errors += 1
+                if journal:
+                    journal.mark_failed(name, error)
+                print(f"Batch API: {name}: {error}")
+                continue
+
+            txt_path = os.path.join(folder, page["txt"])
+            atomic_write_text(txt_path, text + '\n')
+            save_metadata(metadata_path(txt_path), model=record["model"])
+            if self.engine.cache is not None and page.get("cache_key"):
+                self.engine.cache.put(page["cache_key"], text)
+            self.engine.report_usage(record["model"], response.usage_metadata, usage_callback, batch=True,
+                                     key=record.get("key"))
+            if journal:
+                journal.mark_done(name)
+            done += 1
+
+        remove_job(folder)
+        return done, errors
+
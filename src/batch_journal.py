@@ -0,0 +1,184 @@
+""" dziennik zadań przetwarzania seryjnego zapisywany w katalogu skanów """
+import os
+import json
+import threading
+from datetime import datetime
+
+
+JOURNAL_FILE = "batch_journal.jsonl"
+
+QUEUED = "queued"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+# przyrostowy zapis transkrypcji w trakcie strumieniowania
+PARTIAL_SUFFIX = ".partial"
+
+
+def atomic_write_text(path, text):
+    """ zapis pliku tekstowego przez plik tymczasowy i zamianę nazwy - przerwany zapis
+        nie zostawia częściowej transkrypcji pod docelową nazwą
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PartialTextFile:
+    """ przyrostowy zapis tekstu do pliku .partial, który po zakończeniu zastępuje
+        plik docelowy; po błędzie plik .partial zostaje z otrzymaną częścią tekstu
+    """
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.length = 0
+        self._file = open(self.partial_path, 'w', encoding='utf-8')
+
+
+    def write(self, text):
+        """ dopisanie fragmentu tekstu """
+        self._file.write(text)
+        self._file.flush()
+        self.length += len(text)
+
+
+    def commit(self, suffix=""):
+        """ zamknięcie pliku i zamiana na plik docelowy """
+        self._file.write(suffix)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+
+
+    def close(self):
+        """ zamknięcie pliku bez zamiany (przerwany zapis, pusty plik jest usuwany) """
+        if not self._file.closed:
+            self._file.close()
+            if self.length == 0:
+                os.remove(self.partial_path)
+
+
+class BatchJournal:
+    """ dziennik stanu stron serii (w kolejce, w trakcie, gotowe, błąd) z liczbą prób i błędami,
+        zapisywany jako plik JSONL, do którego dopisywana jest każda zmiana stanu
+    """
+    def __init__(self, folder):
+        self.path = os.path.join(folder, JOURNAL_FILE)
+        self.pages = {}
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self):
+        """ odtworzenie stanu z pliku dziennika (ostatni wpis dla strony jest obowiązujący) """
+        self.pages = {}
+        if not os.path.exists(self.path):
+            return
+
+        line_count = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line_count += 1
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # niedokończony wpis po awarii
+                    continue
+                name = entry.pop("name", None)
+                if name:
+                    self.pages[name] = entry
+
+        # zagęszczenie pliku, gdy zawiera wiele nieaktualnych wpisów
+        if line_count > 2 * len(self.pages) + 100:
+            self._rewrite()
+
+
+    def _rewrite(self):
+        """ zapis bieżącego stanu jako nowy plik dziennika """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for name, entry in self.pages.items():
+                f.write(json.dumps(dict(name=name, **entry), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+    def _update(self, name, **fields):
+        """ zmiana stanu strony i dopisanie wpisu do pliku """
+        with self._lock:
+            entry = self.pages.setdefault(name, {"status": QUEUED, "attempts": 0})
+            entry.update(fields)
+            entry["time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(dict(name=name, **entry), ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"Błąd zapisu dziennika serii: {e}")
+
+
+    def queue(self, names, prompt=None):
+        """ dodanie stron do kolejki serii """
+        for name in names:
+            self._update(name, status=QUEUED, error=None, prompt=prompt, job=None)
+
+
+    def mark_in_flight(self, name, job=None):
+        """ strona wysłana do modelu (job - nazwa zadania Batch API) """
+        attempts = self.pages.get(name, {}).get("attempts", 0) + 1
+        self._update(name, status=IN_FLIGHT, attempts=attempts, job=job)
+
+
+    def mark_done(self, name, **stats):
+        """ transkrypcja strony zapisana na dysku (stats - np. czas do pierwszego tokenu) """
+        stats.setdefault("copied_from", None)
+        self._update(name, status=DONE, error=None, job=None, **stats)
+
+
+    def mark_interrupted(self, name):
+        """ przetwarzanie strony przerwane przez użytkownika - strona wraca do kolejki """
+        self._update(name, status=QUEUED, job=None)
+
+
+    def mark_failed(self, name, error):
+        """ błąd przetwarzania strony """
+        self._update(name, status=FAILED, error=str(error), job=None)
+
+
+    def status(self, name):
+        """ stan strony lub None, jeśli strona nie była przetwarzana w serii """
+        return self.pages.get(name, {}).get("status")
+
+
+    def error(self, name):
+        """ ostatni błąd strony """
+        return self.pages.get(name, {}).get("error")
+
+
+    def ttft(self, name):
+        """ czas do pierwszego tokenu (s) ostatniej transkrypcji strony """
+        return self.pages.get(name, {}).get("ttft")
+
+
+    def copied_from(self, name):
+        """ strona, z której skopiowano transkrypcję duplikatu skanu """
+        return self.pages.get(name, {}).get("copied_from")
+
+
+    def job(self, name):
+        """ zadanie Batch API, w którym strona oczekuje na wynik """
+        return self.pages.get(name, {}).get("job")
+
+
+    def pending(self):
+        """ strony niedokończone: w kolejce lub przerwane w trakcie przetwarzania """
+        return [name for name, entry in self.pages.items()
+                if entry.get("status") in (QUEUED, IN_FLIGHT)]
+
+
+    def failed(self):
+        """ strony zakończone błędem """
+        return [name for name, entry in self.pages.items() if entry.get("status") == FAILED]
@@ -0,0 +1,100 @@
+""" transkrypcja dwuetapowa: najpierw szybki i tańszy model, strony z niepewnym odczytem
+    (znaczniki [nieczytelne], [słowo?], [skreślenie] albo tekst wyraźnie krótszy niż tekst
+    widoczny na skanie) są transkrybowane ponownie dokładniejszym modelem
+"""
+import os
+import re
+import asyncio
+from batch_journal import atomic_write_text
+from gemini_engine import TRANSCRIPTION_MODEL
+from model_routing import scan_layout
+from pipeline import transcribe_page, EMPTY_RESPONSE
+from scan_files import read_text, metadata_path
+
+
+# model pierwszego etapu
+DEFAULT_CASCADE_MODEL = "gemini-3-flash-preview"
+# maksymalna liczba znaczników niepewności na słowo tekstu po pierwszym etapie
+DEFAULT_MARKER_DENSITY = 0.02
+# minimalny stosunek liczby wierszy transkrypcji do liczby wierszy tekstu wykrytych na skanie
+# (prompty wymagają zachowania podziału wierszy oryginału)
+DEFAULT_MIN_LINE_RATIO = 0.5
+# mniejsza liczba wierszy wykrytych na skanie nie pozwala ocenić długości tekstu
+MIN_SCAN_LINES = 5
+
+# znaczniki niepewności z promptów: [nieczytelne], [skreślenie], [słowo?], słow[o?]
+UNCERTAINTY_MARKERS = re.compile(r"\[nieczytelne\]|\[skreślenie\]|\[[^\[\]\n]{0,40}\?\]", re.IGNORECASE)
+
+
+def marker_density(text):
+    """ (liczba znaczników niepewności, liczba znaczników na słowo tekstu) """
+    markers = len(UNCERTAINTY_MARKERS.findall(text))
+    words = len(text.split())
+    return markers, (markers / words if words else 0.0)
+
+
+def escalation_reason(text, scan_lines=None, max_marker_density=DEFAULT_MARKER_DENSITY,
+                      min_line_ratio=DEFAULT_MIN_LINE_RATIO):
+    """ powód ponownej transkrypcji dokładniejszym modelem lub None (odczyt pewny):
+        'markers' - dużo znaczników niepewności, 'length' - za mało wierszy względem skanu
+    """
+    markers, density = marker_density(text)
+    if markers and density > max_marker_density:
+        return "markers"
+    if scan_lines and scan_lines >= MIN_SCAN_LINES and min_line_ratio:
+        text_lines = sum(1 for line in text.splitlines() if line.strip())
+        if text_lines < scan_lines * min_line_ratio:
+            return "length"
+    return None
+
+
+def page_files(pair):
+    """ treść plików txt i json strony: ścieżka -> tekst lub None, gdy pliku nie ma """
+    return {path: read_text(path) if os.path.exists(path) else None
+            for path in (pair['txt'], metadata_path(pair['txt']))}
+
+
+def restore_page_files(files):
+    """ przywrócenie plików strony zapisanych przez page_files """
+    for path, content in files.items():
+        if content is not None:
+            atomic_write_text(path, content)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+async def cascade_page(engine, pair, prompt_text, model=TRANSCRIPTION_MODEL, first_model=DEFAULT_CASCADE_MODEL,
+                       on_chunk=None, usage_callback=None, empty_message=EMPTY_RESPONSE, tile_min_pixels=None,
+                       max_marker_density=DEFAULT_MARKER_DENSITY, min_line_ratio=DEFAULT_MIN_LINE_RATIO):
+    """ transkrypcja strony modelem first_model, a przy niepewnym odczycie ponownie modelem
+        'model' (plik txt i metadane zawierają wynik ostatniego etapu); zwraca statystyki
+        strony z powodem ponownej transkrypcji w polu 'escalated'; przed drugim etapem
+        strona wraca do stanu sprzed transkrypcji, więc po jego błędzie lub przerwaniu
+        nie zostaje plik txt z niesprawdzonym odczytem pierwszego etapu
+    """
+    if first_model != model:
+        before = await asyncio.to_thread(page_files, pair)
+    stats = await transcribe_page(engine, pair, prompt_text, model=first_model, on_chunk=on_chunk,
+                                  usage_callback=usage_callback, empty_message=empty_message,
+                                  tile_min_pixels=tile_min_pixels)
+    if first_model == model:
+        return {**stats, "escalated": None}
+
+    text = read_text(pair['txt'])
+    reason = escalation_reason(text, None, max_marker_density, min_line_ratio)
+    if reason is None and min_line_ratio:
+        # analiza obrazu tylko dla stron bez nadmiaru znaczników
+        try:
+            layout = await engine.images.run(scan_layout, pair['img'])
+            reason = escalation_reason(text, layout["lines"], max_marker_density, min_line_ratio)
+        except Exception as e:
+            print(f"{pair['name']}: {e}")
+    if reason is None:
+        return {**stats, "escalated": None}
+
+    # seria pomija strony z plikiem txt - niepewny odczyt nie może wyglądać na gotową transkrypcję
+    await asyncio.to_thread(restore_page_files, before)
+    stats = await transcribe_page(engine, pair, prompt_text, model=model, on_chunk=on_chunk,
+                                  usage_callback=usage_callback, empty_message=empty_message,
+                                  tile_min_pixels=tile_min_pixels)
+    return {**stats, "escalated": reason}
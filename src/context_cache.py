@@ -0,0 +1,97 @@
+""" pamięć kontekstu Gemini API (cached content) dla długich promptów wspólnych
+    dla wszystkich stron serii - stała część zapytania jest wysyłana i rozliczana raz
+"""
+import asyncio
+import hashlib
+import time
+from google.genai import types, errors
+from rate_control import estimate_request_tokens
+
+
+DEFAULT_CONTEXT_TTL = 3600     # czas życia wpisu w API (s)
+REFRESH_MARGIN = 120           # wpis jest tworzony ponownie na tyle sekund przed wygaśnięciem
+MIN_CONTEXT_TOKENS = 1024      # minimalna liczba tokenów wpisu akceptowana przez API
+
+
+class ContextCache:
+    """ wpisy cached content tworzone przy pierwszym użyciu promptu z danym modelem
+        i współdzielone przez kolejne zapytania; krótkie prompty i prompty odrzucone
+        przez API są wysyłane w zwykły sposób
+    """
+    def __init__(self, client_manager, ttl=DEFAULT_CONTEXT_TTL, min_tokens=MIN_CONTEXT_TOKENS,
+                 enabled=True):
+        self.client_manager = client_manager
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.enabled = enabled
+        # (model, skrót promptu) -> {"name", "expires", "text"}
+        self._entries = {}
+        # prompty odrzucone przez API (np. za krótkie dla modelu)
+        self._rejected = set()
+        self._locks = {}
+
+
+    @staticmethod
+    def _key(model, text):
+        return model, hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+    async def get(self, model, text):
+        """ nazwa wpisu cached content dla promptu lub None (prompt trzeba wysłać w zapytaniu) """
+        if not self.enabled or estimate_request_tokens(text) < self.min_tokens:
+            return None
+
+        key = self._key(model, text)
+        if key in self._rejected:
+            return None
+
+        # jeden wpis dla promptu, także przy wielu równoległych zapytaniach serii
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._entries.get(key)
+            if entry and entry["expires"] - REFRESH_MARGIN > time.time():
+                return entry["name"]
+
+            client = self.client_manager.get_client()
+            try:
+                cached = await client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[types.Content(role="user", parts=[types.Part.from_text(text=text)])],
+                        ttl=f"{self.ttl}s",
+                        display_name="scans_transcripts"
+                    )
+                )
+            except errors.ClientError as e:
+                self._rejected.add(key)
+                print(f"Cached content ({model}): {e}")
+                return None
+            except Exception as e:
+                # błąd przejściowy - kolejne zapytanie spróbuje ponownie
+                print(f"Cached content ({model}): {e}")
+                return None
+
+            self._entries[key] = {"name": cached.name, "expires": time.time() + self.ttl, "text": text}
+            return cached.name
+
+
+    def forget(self, model, text):
+        """ usunięcie wpisu z pamięci (np. po wygaśnięciu lub usunięciu po stronie API) """
+        self._entries.pop(self._key(model, text), None)
+
+
+    async def invalidate(self, prompt_text=None):
+        """ usunięcie wpisów zawierających prompt (lub wszystkich) także po stronie API,
+            np. po zmianie treści promptu lub przy zamykaniu aplikacji
+        """
+        keys = [key for key, entry in self._entries.items()
+                if prompt_text is None or entry["text"].startswith(prompt_text)]
+        if not keys:
+            return
+
+        client = self.client_manager.get_client()
+        for key in keys:
+            entry = self._entries.pop(key)
+            try:
+                await client.aio.caches.delete(name=entry["name"])
+            except Exception as e:
+                print(f"Cached content {entry['name']}: {e}")
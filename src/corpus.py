@@ -0,0 +1,112 @@
+""" przetwarzanie korpusu: drzewo katalogów ze skanami i wspólna kolejka stron,
+    wydawanych kolejno z każdego katalogu (duży katalog nie blokuje pozostałych)
+"""
+import os
+import asyncio
+from collections import deque
+from scan_files import IMAGE_EXTENSIONS, list_file_pairs
+from batch_journal import BatchJournal, QUEUED, IN_FLIGHT, FAILED
+
+
+# katalogi pomijane przy przeszukiwaniu drzewa
+SKIPPED_FOLDERS = {"cache", "__pycache__"}
+
+
+def find_scan_folders(root):
+    """ katalogi drzewa 'root' (łącznie z nim) zawierające skany, w kolejności alfabetycznej """
+    folders = []
+    for current, dirs, files in os.walk(root):
+        # ukryte i techniczne podkatalogi nie są przeszukiwane
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d not in SKIPPED_FOLDERS)
+        if any(f.lower().endswith(IMAGE_EXTENSIONS) for f in files):
+            folders.append(current)
+    return folders
+
+
+def needs_transcription(pair, journal, force=False):
+    """ strona bez transkrypcji, z pustym plikiem lub niedokończona w poprzedniej serii
+        (strony oczekujące na wynik zadania Batch API są pomijane)
+    """
+    if journal.job(pair['name']):
+        return False
+    if force or journal.status(pair['name']) in (QUEUED, IN_FLIGHT, FAILED):
+        return True
+    return not os.path.exists(pair['txt']) or os.path.getsize(pair['txt']) == 0
+
+
+class CorpusQueue:
+    """ wspólna kolejka stron wielu katalogów: kolejne strony są pobierane po jednej
+        z każdego katalogu (round-robin), licznik pozostałych stron pozwala wykryć
+        zakończenie katalogu
+    """
+    def __init__(self):
+        self._folders = deque()
+        self._remaining = {}
+
+
+    def add(self, folder, items):
+        """ dodanie stron katalogu do kolejki """
+        items = list(items)
+        if not items:
+            return
+        self._folders.append((folder, deque(items)))
+        self._remaining[folder] = self._remaining.get(folder, 0) + len(items)
+
+
+    def next(self):
+        """ następna strona: (katalog, element) lub None, gdy kolejka jest pusta """
+        while self._folders:
+            folder, items = self._folders.popleft()
+            if not items:
+                continue
+            item = items.popleft()
+            if items:
+                self._folders.append((folder, items))
+            return folder, item
+        return None
+
+
+    def task_done(self, folder):
+        """ zakończenie strony katalogu; True, gdy była to ostatnia strona katalogu """
+        self._remaining[folder] -= 1
+        if self._remaining[folder] == 0:
+            del self._remaining[folder]
+            return True
+        return False
+
+
+    def __len__(self):
+        return sum(len(items) for _, items in self._folders)
+
+
+def scan_corpus(root, force=False):
+    """ strony do transkrypcji w drzewie katalogów: {katalog: (dziennik serii, lista stron)},
+        tylko katalogi, w których jest coś do zrobienia
+    """
+    corpus = {}
+    for folder in find_scan_folders(root):
+        journal = BatchJournal(folder)
+        pairs = [pair for pair in list_file_pairs(folder) if needs_transcription(pair, journal, force)]
+        if pairs:
+            corpus[folder] = (journal, pairs)
+    return corpus
+
+
+async def run_corpus(queue, worker, concurrency, should_stop=None, on_folder_done=None):
+    """ przetwarzanie kolejki przez 'concurrency' równoległych zadań (wspólny limit dla
+        całego korpusu); worker(folder, item) - przetwarzanie jednej strony,
+        on_folder_done(folder) - po zakończeniu ostatniej strony katalogu
+    """
+    async def _worker():
+        while not (should_stop and should_stop()):
+            entry = queue.next()
+            if entry is None:
+                return
+            folder, item = entry
+            try:
+                await worker(folder, item)
+            finally:
+                if queue.task_done(folder) and on_folder_done:
+                    await on_folder_done(folder)
+
+    await asyncio.gather(*(_worker() for _ in range(max(1, concurrency))))
@@ -0,0 +1,163 @@
+""" szacowanie liczby tokenów i kosztu serii przed jej uruchomieniem (na podstawie
+    wcześniejszych wpisów tokens.log i wymiarów skanów) oraz limit kosztu serii
+"""
+import os
+import math
+import statistics
+from PIL import Image
+from rate_control import IMAGE_TOKENS, estimate_request_tokens
+from usage_log import USAGE_LOG_FILE, usage_cost
+from scan_files import read_text
+
+
+# liczba tokenów odpowiedzi, gdy brak historii i istniejących transkrypcji w katalogu
+DEFAULT_OUTPUT_TOKENS = 1000
+# liczba transkrypcji katalogu odczytywanych do oszacowania długości odpowiedzi
+SAMPLE_TEXTS = 50
+
+# modele starszych generacji liczą obraz w kafelkach 768x768 (małe obrazy - jeden kafelek)
+TILE_SIDE = 768
+TILE_TOKENS = 258
+SMALL_IMAGE_SIDE = 384
+
+
+def transcription_tag(prompt_name, combined=False):
+    """ oznaczenie wpisów tokens.log z transkrypcją serii (nazwa promptu, tryb łączony z NER) """
+    if not prompt_name:
+        return ""
+    return f"{prompt_name}+ner" if combined else prompt_name
+
+
+def usage_history(folder):
+    """ wpisy tokens.log katalogu: lista słowników {model, input, output, cached, tag} """
+    log_path = os.path.join(folder, USAGE_LOG_FILE)
+    if not os.path.exists(log_path):
+        return []
+
+    history = []
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split(";")
+            if len(parts) < 5:
+                continue
+            try:
+                history.append({
+                    "model": parts[1],
+                    "input": int(parts[2]),
+                    "output": int(parts[3]),
+                    "cached": int(parts[5]) if len(parts) > 5 and parts[5] else 0,
+                    # starsze wpisy nie mają oznaczenia promptu
+                    "tag": parts[6] if len(parts) > 6 else ""
+                })
+            except ValueError:
+                continue
+    return history
+
+
+def image_tokens(image_path, model, max_side=None):
+    """ szacunkowa liczba tokenów obrazu: dla modeli Gemini 3 przy MEDIA_RESOLUTION_HIGH
+        wartość stała, dla starszych zależna od wymiarów obrazu (po zmniejszeniu do max_side)
+    """
+    if model.startswith("gemini-3"):
+        return IMAGE_TOKENS
+
+    try:
+        # odczyt samego nagłówka pliku, bez dekodowania obrazu
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return IMAGE_TOKENS
+
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = int(width * scale), int(height * scale)
+
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return TILE_TOKENS
+    return math.ceil(width / TILE_SIDE) * math.ceil(height / TILE_SIDE) * TILE_TOKENS
+
+
+def _text_tokens(file_pairs):
+    """ mediana liczby tokenów istniejących transkrypcji katalogu lub None """
+    tokens = []
+    for pair in file_pairs:
+        if len(tokens) >= SAMPLE_TEXTS:
+            break
+        if os.path.exists(pair['txt']) and os.path.getsize(pair['txt']) > 0:
+            tokens.append(estimate_request_tokens(read_text(pair['txt']).strip()))
+    return statistics.median(tokens) if tokens else None
+
+
+class CostEstimator:
+    """ szacowanie tokenów wejściowych i wyjściowych strony: mediana wcześniejszych wywołań
+        tego samego modelu z tym samym promptem (tokens.log), a przy braku historii -
+        długość promptu, wymiary skanu i długość istniejących transkrypcji katalogu
+    """
+    def __init__(self, folder, file_pairs, model, prompt_text, tag, max_side=None):
+        self.model = model
+        self.max_side = max_side
+        self.prompt_tokens = estimate_request_tokens(prompt_text)
+
+        rows = [row for row in usage_history(folder) if row["model"] == model and row["tag"] == tag]
+        self.history_pages = len(rows)
+        self.history_input = statistics.median(row["input"] for row in rows) if rows else None
+        self.history_output = statistics.median(row["output"] for row in rows) if rows else None
+        self.history_cached = statistics.median(row["cached"] for row in rows) if rows else 0
+
+        self.fallback_output = _text_tokens(file_pairs) or DEFAULT_OUTPUT_TOKENS
+        self._pages = {}
+
+
+    def page(self, pair):
+        """ (tokeny wejściowe, tokeny wyjściowe) dla strony """
+        if pair['img'] not in self._pages:
+            if self.history_input is not None:
+                in_tokens = self.history_input
+            else:
+                in_tokens = self.prompt_tokens + image_tokens(pair['img'], self.model, self.max_side)
+            out_tokens = self.history_output if self.history_output is not None else self.fallback_output
+            self._pages[pair['img']] = (int(in_tokens), int(out_tokens))
+        return self._pages[pair['img']]
+
+
+    def estimate(self, pairs, batch=False):
+        """ prognoza dla listy stron: {pages, input, output, cost} (batch - cena Batch API) """
+        in_tokens = out_tokens = 0
+        for pair in pairs:
+            page_in, page_out = self.page(pair)
+            in_tokens += page_in
+            out_tokens += page_out
+        cached = int(self.history_cached) * len(pairs)
+        return {
+            "pages": len(pairs),
+            "input": in_tokens,
+            "output": out_tokens,
+            "cost": usage_cost(self.model, in_tokens, out_tokens, batch, cached)
+        }
+
+
+class BudgetGuard:
+    """ limit kosztu serii w USD: suma kosztów zapisanych wywołań serii, po osiągnięciu
+        limitu kolejne strony nie są zlecane (limit None lub 0 - bez ograniczenia)
+    """
+    def __init__(self, limit=None):
+        self.limit = limit or None
+        self.spent = 0.0
+
+
+    @property
+    def exceeded(self):
+        return self.limit is not None and self.spent >= self.limit
+
+
+    def track(self, usage_callback):
+        """ funkcja zapisu zużycia (usage_callback) doliczająca koszt wywołania do limitu """
+        def _track(model_name, usage_metadata, batch=False, key=None):
+            usage_callback(model_name, usage_metadata, batch=batch, key=key)
+            if usage_metadata:
+                self.spent += usage_cost(model_name,
+                                         usage_metadata.prompt_token_count or 0,
+                                         usage_metadata.candidates_token_count or 0,
+                                         batch,
+                                         usage_metadata.cached_content_token_count or 0)
+        return _track
@@ -0,0 +1,197 @@
+""" eksport transkrypcji katalogu: TXT, DOCX, TEI-XML i lista nazw własnych CSV """
+import os
+import re
+import csv
+import json
+import xml.sax.saxutils as saxutils
+from scan_files import metadata_path
+
+
+def merge_texts(file_pairs):
+    """ wszystkie transkrypcje katalogu połączone w jeden tekst """
+    merged_content = []
+
+    for pair in file_pairs:
+        txt_path = pair['txt']
+        if os.path.exists(txt_path):
+            with open(txt_path, 'r', encoding='utf-8') as f:
+                text_content = f.read().strip()
+                if text_content:
+                    merged_content.append(text_content)
+
+    return "\n\n".join(merged_content)
+
+
+def export_txt(file_pairs, target_path):
+    """ eksport wszystkich transkrypcji do jednego pliku txt """
+    with open(target_path, 'w', encoding='utf-8') as f:
+        f.write(merge_texts(file_pairs))
+
+
+def export_docx(file_pairs, target_path):
+    """ eksport do pliku docx z łączeniem wyrazów """
+    from docx import Document
+
+    doc = Document()
+
+    for pair in file_pairs:
+        if os.path.exists(pair['txt']):
+            all_lines = []
+            with open(pair['txt'], 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+                all_lines.extend([line.strip() for line in lines])
+
+            full_text = ""
+            for line in all_lines:
+                if not line:
+                    full_text += '\n\n'
+
+                if full_text == "":
+                    full_text = line
+                else:
+                    if full_text.endswith("-"):
+                        full_text = full_text[:-1] + line
+                    else:
+                        full_text += " " + line
+
+            doc.add_paragraph(full_text)
+
+    doc.save(target_path)
+
+
+def prepare_text_for_tei(text):
+    """ łączenie podzielonych słów i wierszy w logiczne akapity """
+    lines = text.splitlines()
+    joined_text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            joined_text += "\n\n" # nowy akapit
+        elif joined_text.endswith("-"):
+            joined_text = joined_text[:-1] + line
+        else:
+            joined_text += (" " if joined_text and not joined_text.endswith("\n\n") else "") + line
+    return joined_text
+
+
+def tag_entities_tei(text, entities):
+    """ otaczanie nazw własnych tagami TEI (persName, placeName, orgName) """
+    tag_map = {
+        "PERS": "persName",
+        "LOC": "placeName",
+        "ORG": "orgName"
+    }
+
+    escaped_text = saxutils.escape(text)
+
+    all_names = []
+    for cat, names in entities.items():
+        if cat in tag_map:
+            for name in names:
+                all_names.append((name, tag_map[cat]))
+
+    all_names.sort(key=lambda x: len(x[0]), reverse=True)
+
+    for name, tag in all_names:
+        escaped_name = saxutils.escape(name)
+        pattern = re.compile(rf'\b{re.escape(escaped_name)}\b', re.IGNORECASE)
+        escaped_text = pattern.sub(f'<{tag}>{escaped_name}</{tag}>', escaped_text)
+
+    return escaped_text
+
+
+def build_tei(file_pairs):
+    """ dokument TEI-XML z transkrypcjami katalogu i tagowaniem NER (jeżeli jest) """
+    tei_content = []
+
+    # prosty nagłówek TEI
+    tei_content.append('<?xml version="1.0" encoding="UTF-8"?>')
+    tei_content.append('<TEI xmlns="http://www.tei-c.org/ns/1.0">')
+    tei_content.append('  <teiHeader>')
+    tei_content.append('    <fileDesc>')
+    tei_content.append('      <titleStmt><title>Eksport z ScansAndTranscriptions</title></titleStmt>')
+    tei_content.append('      <publicationStmt><p>Wygenerowano automatycznie</p></publicationStmt>')
+    tei_content.append('      <sourceDesc><p>Transkrypcje skanów</p></sourceDesc>')
+    tei_content.append('    </fileDesc>')
+    tei_content.append('  </teiHeader>')
+    tei_content.append('  <text>')
+    tei_content.append('    <body>')
+
+    for pair in file_pairs:
+        if not os.path.exists(pair['txt']):
+            continue
+
+        # wczytanie tekstu i metadanych NER
+        with open(pair['txt'], 'r', encoding='utf-8') as f:
+            raw_text = f.read()
+
+        entities = {}
+        json_path = metadata_path(pair['txt'])
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                entities = json.load(f).get("entities", {})
+
+        # przygotowanie tekstu: sklejanie wierszy i słów
+        processed_text = prepare_text_for_tei(raw_text)
+
+        # tagowanie nazw własnych
+        tagged_text = tag_entities_tei(processed_text, entities)
+
+        # dodanie strony jako akapitu lub sekcji
+        tei_content.append(f'      <div type="page" n="{pair["name"]}">')
+        for paragraph in tagged_text.split('\n\n'):
+            if paragraph.strip():
+                tei_content.append(f'        <p>{paragraph.strip()}</p>')
+        tei_content.append('      </div>')
+
+    tei_content.append('    </body>')
+    tei_content.append('  </text>')
+    tei_content.append('</TEI>')
+    return '\n'.join(tei_content)
+
+
+def export_tei(file_pairs, target_path):
+    """ eksport transkrypcji do pliku TEI-XML """
+    with open(target_path, 'w', encoding='utf-8') as f:
+        f.write(build_tei(file_pairs))
+
+
+def collect_ner_records(file_pairs):
+    """ nazwy własne z metadanych wszystkich stron: (rekordy, zbiór unikalnych nazw, błędy) """
+    records = []
+    unique_names = set()
+    errors = []
+
+    for pair in file_pairs:
+        json_path = metadata_path(pair['txt'])
+        txt_path = pair['txt']
+
+        if os.path.exists(json_path) and os.path.exists(txt_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    entities = json.load(f).get("entities", {})
+
+                for cat, names in entities.items():
+                    for name in names:
+                        records.append({
+                            'orig': name,
+                            'cat': cat,
+                            'file': os.path.basename(pair['img']),
+                        })
+                        unique_names.add(name)
+            except Exception as e:
+                errors.append((pair['name'], e))
+
+    return records, unique_names, errors
+
+
+def write_ner_csv(nominative_map, records, target_path, header):
+    """ zapis 4 kolumn do CSV: nazwa oryginalna, mianownik, kategoria, plik """
+    # zapis do CSV (separator średnik)
+    with open(target_path, 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(header)
+
+        for rec in records:
+            base_name = nominative_map.get(rec['orig'], rec['orig'])
+            writer.writerow([rec['orig'], base_name, rec['cat'], rec['file']])
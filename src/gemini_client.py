@@ -0,0 +1,136 @@
+""" współdzielony klient Gemini API """
+import threading
+import importlib.util
+import httpx
+from google import genai
+from google.genai import types
+
+
+# google-genai używa transportu aiohttp zamiast httpx, gdy pakiet aiohttp jest zainstalowany
+# (parametry puli połączeń httpx nie są wtedy przyjmowane)
+HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+
+
+def key_name(api_key):
+    """ nazwa klucza API w dzienniku kosztów i komunikatach (bez ujawniania klucza) """
+    return "*" + (api_key or "")[-4:]
+
+
+def parse_api_keys(config_keys=None, env_keys=None):
+    """ pula kluczy API: lista par (nazwa, klucz) z config.json ('api_keys': lista kluczy lub
+        słowników {"key": ..., "name": ...}) i zmiennej GEMINI_API_KEYS (klucze rozdzielone przecinkami)
+    """
+    entries = list(config_keys or [])
+    entries += [key.strip() for key in (env_keys or "").split(",")]
+    pool = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            api_key, name = entry.get("key"), entry.get("name")
+        else:
+            api_key, name = entry, None
+        if api_key and all(api_key != known for _, known in pool):
+            pool.append((name or key_name(api_key), api_key))
+    return pool
+
+
+class GeminiClientManager:
+    """ długo żyjący klient genai.Client (jeden dla każdego klucza API z puli) współdzielony przez
+        wszystkie wątki aplikacji, utrzymuje otwarte połączenia HTTP (keep-alive) i jest odtwarzany
+        tylko po zmianie klucza API; api_keys - dodatkowe klucze [(nazwa, klucz)], między które
+        rozkładane są zapytania do modeli (patrz RateController)
+    """
+    def __init__(self, api_key=None, max_connections=32, keepalive_expiry=120, base_url=None, api_keys=None):
+        self._lock = threading.Lock()
+        self._api_key = api_key
+        self._extra_keys = list(api_keys or [])
+        self._clients = {}
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        # alternatywny adres API (np. lokalny serwer testowy)
+        self.base_url = base_url
+
+
+    @property
+    def api_key(self):
+        """ aktualny klucz API (klucz główny puli) """
+        return self._api_key or (self._extra_keys[0][1] if self._extra_keys else None)
+
+
+    @property
+    def keys(self):
+        """ pula kluczy: lista par (nazwa, klucz), pierwszy jest klucz główny """
+        names = {key: name for name, key in self._extra_keys}
+        pool = [(names.get(self._api_key) or key_name(self._api_key), self._api_key)] if self._api_key else []
+        pool += [(name, key) for name, key in self._extra_keys if key != self._api_key]
+        return pool
+
+
+    @property
+    def key_names(self):
+        """ nazwy kluczy puli (klucz główny pierwszy) """
+        return [name for name, _ in self.keys] or [None]
+
+
+    @property
+    def primary_key_name(self):
+        """ nazwa klucza głównego (pamięć kontekstu API i Batch API) """
+        return self.key_names[0]
+
+
+    def set_api_key(self, api_key):
+        """ zmiana klucza API - klient zostanie utworzony ponownie przy następnym użyciu """
+        with self._lock:
+            if api_key != self._api_key:
+                self._api_key = api_key
+                # zapytania w toku kończą się na starym kliencie, nowe trafią już do nowego
+                self._clients = {}
+
+
+    def get_client(self, name=None):
+        """ zwraca współdzielonego klienta dla klucza o podanej nazwie (domyślnie klucza
+            głównego), tworząc go przy pierwszym użyciu
+        """
+        with self._lock:
+            keys = dict(self.keys)
+            if name not in keys:
+                name = next(iter(keys), None)
+            if name not in self._clients:
+                self._clients[name] = genai.Client(api_key=keys.get(name),
+                                                   http_options=self._http_options())
+            return self._clients[name]
+
+
+    def _http_options(self):
+        """ pula połączeń dopasowana do równoległych zapytań serii (dla klienta asynchronicznego
+            tylko przy transporcie httpx)
+        """
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections,
+                              keepalive_expiry=self.keepalive_expiry)
+        return types.HttpOptions(base_url=self.base_url,
+                                 client_args={"limits": limits},
+                                 async_client_args=None if HAS_AIOHTTP else {"limits": limits})
+
+
+    async def aclose(self):
+        """ zamknięcie połączeń klientów asynchronicznych (w pętli silnika, przed close) """
+        with self._lock:
+            clients = list(self._clients.values())
+        for client in clients:
+            try:
+                await client.aio.aclose()
+            except Exception as e:
+                print(e)
+
+
+    def close(self):
+        """ zamknięcie klientów (przy zamykaniu aplikacji) """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            if hasattr(client, "close"):
+                try:
+                    client.close()
+                except Exception as e:
+                    print(e)
@@ -0,0 +1,992 @@
+""" silnik zapytań asyncio do modeli Gemini """
+import asyncio
+import json
+import re
+import threading
+import time
+from google.genai import types, errors
+from rate_control import (RateController, LatencyTracker, estimate_request_tokens, error_code, wait_with_timeout,
+                          is_failover_error)
+from image_prep import ImagePreprocessor
+from response_cache import cache_key, file_digest
+from tiling import merge_tile_texts
+
+
+TRANSCRIPTION_MODEL = "gemini-3-pro-preview"
+VERIFY_MODEL = "gemini-3-pro-preview"
+NER_MODEL = "gemini-3-pro-preview"          # lub gemini-3-flash-preview
+BOX_MODEL = "gemini-3-pro-image-preview"
+TTS_MODEL = "gemini-2.5-flash-preview-tts"  # lub gemini-2.5-pro-preview-tts
+NOMINATIVE_MODEL = "gemini-flash-latest"    # lub gemini-3-flash-preview
+
+
+VERIFY_PROMPT = """
+Otrzymasz skan dokumentu oraz jego wstępną transkrypcję.
+
+Twoim zadaniem jest zweryfikować tekst z obrazem i poprawić wszelkie błędy:
+1. Popraw literówki i błędnie odczytane słowa.
+2. Uzupełnij pominięte słowa.
+3. Zachowaj oryginalny układ wierszy.
+4. Nie dodawaj własnych komentarzy, zwróć TYLKO poprawiony tekst.
+
+Pamiętaj o zasadach oznaczania niepewności:
+- Jeśli fragment (słowo lub litera) jest całkowicie nieczytelny (plama, zniszczenie), oznacz go jako: [nieczytelne].
+- Jeśli odczyt jest wątpliwy, ale masz przypuszczenie, zapisz je i dodaj znak zapytania w nawiasie, np.: [słowo?] lub słow[o?].
+- Jeśli w tekście występuje skreślenie, oznacz je jako: [skreślenie].
+"""
+
+
+# zasady klasyfikacji nazw własnych (wspólne dla NER i transkrypcji z nazwami własnymi)
+NER_RULES = """Zasady klasyfikacji:
+1. PERS (Osoby): Wyodrębnij nazwy osób, mogą to być pełne imiona i nazwiska, ale także zapisy
+   samych nazwisk lub imion, zapisy inicjałów np. A. T., zapisy nazw stosowane w średniowieczu
+   np. Jan z Dąbrówki, uwzględnij także nazwy narodów lub plemion. DOŁĄCZ do nazwy towarzyszące im
+   tytuły szlacheckie (np. hr., margrabia), stopnie wojskowe (np. kpt., gen.),
+   funkcje urzędowe (np. rządzca, wójt) oraz zwroty grzecznościowe (np. JW Pan, Ob.),
+   jeśli występują bezpośrednio przy nazwisku.
+2. LOC (Geografia): Wyodrębnij nazwy miast, wsi, krajów, państw, folwarków, majątków ziemskich, rzek,
+   jezior, guberni oraz konkretne nazwy ulic i placów.
+3. ORG (Organizacje): Wyodrębnij nazwy urzędów, instytucji, pułków wojskowych, parafii, komitetów, stowarzyszeń,
+   fabryk i towarzystw (np. "Towarzystwo Kredytowe Ziemskie").
+
+Instrukcje techniczne:
+- Rekonstrukcja: Jeśli nazwa jest podzielona między wiersze (np. "Krak-" i "ów"),
+  połącz ją w jedno słowo bez dywizu ("Kraków").
+- Normalizacja: Zwróć nazwy w takiej formie (deklinacji), w jakiej występują w tekście, ale usuń
+  znaki podziału wiersza.
+- Czystość: Ignoruj nazwy pospolite, chyba że są częścią nazwy własnej.
+
+"""
+
+
+NER_PROMPT = """
+Jesteś ekspertem w dziedzinie historii i paleografii XVIII, XIX oraz XX wieku. Twoim zadaniem
+jest ekstrakcja nazw własnych z transkrypcji dokumentów historycznych.
+
+""" + NER_RULES + """Zwróć wynik WYŁĄCZNIE jako JSON w formacie:
+{
+  "PERS": ["nazwa1", ...],
+  "LOC": ["nazwa1", ...],
+  "ORG": ["nazwa1", ...]
+}
+"""
+
+
+TRANSCRIPTION_NER_PROMPT = """
+Po wykonaniu transkrypcji wyodrębnij z niej nazwy własne.
+
+""" + NER_RULES + """Zwróć wynik WYŁĄCZNIE jako JSON: pełną transkrypcję w polu "text" (z zachowaniem układu wierszy)
+oraz listy nazw własnych w polach "PERS", "LOC" i "ORG".
+"""
+
+
+# dopisywane do promptu transkrypcji dla każdego pasa dużego skanu
+TILE_PROMPT = """
+Obraz jest fragmentem {index}/{count} dużego skanu: poziomym pasem strony (kolejne pasy
+od góry do dołu zachodzą na siebie). Przepisz tylko tekst widoczny na tym fragmencie,
+łącznie z wierszami przeciętymi przez górną lub dolną krawędź, bez uzupełniania brakującej treści.
+"""
+
+
+# dopisywane do promptu transkrypcji przy wysyłaniu kilku małych skanów w jednym zapytaniu
+PACK_PROMPT = """
+W zapytaniu jest kilka osobnych, niezwiązanych ze sobą skanów (np. fiszek), każdy poprzedzony
+etykietą "Obraz N". Wykonaj transkrypcję każdego skanu osobno, zgodnie z powyższymi zasadami,
+bez przenoszenia tekstu między skanami.
+Zwróć wynik WYŁĄCZNIE jako JSON: listę obiektów z numerem obrazu w polu "image"
+i pełną transkrypcją tego obrazu w polu "text".
+"""
+
+
+BOX_PROMPT = """
+Na załączonym obrazie znajdź lokalizację następujących nazw,
+(podanych w formie listy par: nazwa_do_wyszukania, kategoria_nazwy, każda para w osobnym wierszu np.
+Felicjan Słomkowski, PERS
+Gniezno, LOC):
+
+{entities}.
+
+Uwzględnij tylko i wyłącznie nazwy z listy, inne zignoruj.
+Dla każdej nazwy podaj współrzędne ramki w formacie:
+
+nazwa, nazwa_kategorii [ymin, xmin, ymax, xmax]
+
+na przykład:
+Krakowa, LOC [ymin, xmin, ymax, xmax]
+Henryk Walezy, PERS [ymin, xmin, ymax, xmax]
+...
+
+Wszystkie współrzędne w skali 0-1000.
+Zwróć tylko listę tych danych bez żadnych dodatkowych komentarzy.
+"""
+
+
+TTS_PROMPT = """Przeczytaj uważnie podany dalej tekst. Odczytuj dokładnie,
+oddając oryginalne brzmienie także słów archaicznych.
+Tekst:
+"""
+
+
+NOMINATIVE_PROMPT = (
+    "Dla podanej listy nazw własnych z dokumentów historycznych, "
+    "podaj ich formę w mianowniku, nie zmieniaj rodzaju nazw (męski, żeński, nijaki). "
+    "Zwróć WYŁĄCZNIE czysty JSON: {\"oryginał\": \"mianownik\", ...}. "
+    "Lista: "
+)
+
+
+def parse_json_response(text):
+    """ odpowiedź modelu w formacie JSON, bez znaczników bloku kodu """
+    json_str = text.replace("```json", "").replace("```", "").strip()
+    return json.loads(json_str)
+
+
+def parse_coordinates_response(text):
+    """ wyodrębnia nazwy i współrzędne [y1, x1, y2, x2] z odpowiedzi modelu """
+    results = []
+    # wyszukiwanie wzorca: nazwa, nazwa_kategorii [ymin, xmin, ymax, xmax]
+    pattern = r"(.*?)\s*,(.*?)\s*\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]"
+    matches = re.findall(pattern, text)
+
+    for m in matches:
+        results.append({
+            'name': m[0].strip(),
+            'category': m[1].strip(),
+            'coords': [int(x) for x in m[2:]]
+        })
+    return results
+
+
+def transcription_config():
+    """ konfiguracja generowania dla transkrypcji i weryfikacji skanu """
+    return types.GenerateContentConfig(
+        temperature=0,
+        thinkingConfig=types.ThinkingConfig(thinking_level=types.ThinkingLevel.LOW),
+        media_resolution=types.MediaResolution.MEDIA_RESOLUTION_HIGH,
+        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+    )
+
+
+def model_config(model, config):
+    """ konfiguracja zapytania dostosowana do modelu zastępczego: poziom rozumowania
+        (thinking_level) tylko dla modeli Gemini 3, parametry obrazu tylko dla modeli obrazowych
+    """
+    update = {}
+    thinking = config.thinking_config
+    if thinking is not None and thinking.thinking_level is not None and not model.startswith("gemini-3"):
+        update["thinking_config"] = None
+    if config.image_config is not None and "image" not in model:
+        update["image_config"] = None
+    return config.model_copy(update=update) if update else config
+
+
+# schemat odpowiedzi łączonej: transkrypcja i nazwy własne
+TRANSCRIPTION_NER_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "text": types.Schema(type=types.Type.STRING),
+        "PERS": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+        "LOC": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+        "ORG": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+    },
+    required=["text", "PERS", "LOC", "ORG"],
+    property_ordering=["text", "PERS", "LOC", "ORG"]
+)
+
+
+# schemat odpowiedzi dla kilku skanów w jednym zapytaniu
+PACK_SCHEMA = types.Schema(
+    type=types.Type.ARRAY,
+    items=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "image": types.Schema(type=types.Type.INTEGER),
+            "text": types.Schema(type=types.Type.STRING),
+        },
+        required=["image", "text"],
+        property_ordering=["image", "text"]
+    )
+)
+
+
+def pack_config():
+    """ konfiguracja generowania dla kilku skanów w jednym zapytaniu (odpowiedź JSON według schematu) """
+    return transcription_config().model_copy(update={
+        "response_mime_type": "application/json",
+        "response_schema": PACK_SCHEMA
+    })
+
+
+def split_usage(usage_metadata, weights):
+    """ podział zużycia tokenów jednego zapytania między strony: tokeny wejściowe po równo,
+        tokeny odpowiedzi proporcjonalnie do wag (np. długości transkrypcji)
+    """
+    def _split(total, shares):
+        total = total or 0
+        amount = sum(shares)
+        if amount <= 0:
+            shares, amount = [1] * len(shares), len(shares)
+        values = [total * share // amount for share in shares]
+        # reszta z dzielenia dla pierwszych stron
+        for index in range(total - sum(values)):
+            values[index % len(values)] += 1
+        return values
+
+    count = len(weights)
+    prompt = _split(usage_metadata.prompt_token_count, [1] * count)
+    output = _split(usage_metadata.candidates_token_count, weights)
+    cached = _split(usage_metadata.cached_content_token_count, [1] * count)
+    return [types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt[index],
+                candidates_token_count=output[index],
+                cached_content_token_count=cached[index],
+                total_token_count=prompt[index] + output[index])
+            for index in range(count)]
+
+
+def transcription_ner_config():
+    """ konfiguracja generowania dla transkrypcji z nazwami własnymi (odpowiedź JSON według schematu) """
+    return transcription_config().model_copy(update={
+        "response_mime_type": "application/json",
+        "response_schema": TRANSCRIPTION_NER_SCHEMA
+    })
+
+
+async def close_stream(stream):
+    """ zamknięcie strumienia odpowiedzi (zwolnienie połączenia HTTP); błędy zamykania są pomijane """
+    aclose = getattr(stream, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception:
+        pass
+
+
+class GeminiEngine:
+    """ asynchroniczny silnik zapytań do Gemini działający w osobnym wątku z pętlą zdarzeń,
+        wyniki są przekazywane do wywołującego przez jeden punkt (dispatcher)
+    """
+    def __init__(self, client_manager, dispatcher=None, usage_callback=None, rate_controller=None,
+                 image_preprocessor=None, response_cache=None, context_cache=None, latency_tracker=None):
+        self.client_manager = client_manager
+        # limity zapytań, ponawianie i adaptacyjna równoległość
+        self.rate = rate_controller or RateController()
+        # czasy do pierwszego fragmentu odpowiedzi (opóźnienie zapytań zapasowych)
+        self.latency = latency_tracker or LatencyTracker()
+        # przygotowanie obrazów przed wysłaniem (pula procesów)
+        self.images = image_preprocessor or ImagePreprocessor()
+        # pamięć podręczna odpowiedzi (None - wyłączona)
+        self.cache = response_cache
+        # pamięć kontekstu API dla długich promptów (None - wyłączona)
+        self.context = context_cache
+        # dispatcher(callback, *args) - np. root.after(0, ...) w aplikacji Tk
+        self.dispatcher = dispatcher or (lambda callback, *args: callback(*args))
+        # usage_callback(model, usage_metadata) - zapis kosztów wywołań
+        self.usage_callback = usage_callback
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="gemini-engine", daemon=True)
+        self._thread.start()
+
+
+    def _run_loop(self):
+        """ pętla zdarzeń silnika (osobny wątek) """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+    def submit(self, coro, on_success=None, on_error=None, on_finally=None, on_cancel=None):
+        """ zleca korutynę do wykonania w pętli silnika, zwraca concurrent.futures.Future
+            (future.cancel() przerywa zadanie wraz z bieżącym zapytaniem do API);
+            callbacki wywoływane są przez dispatcher
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+        def _done(fut):
+            if fut.cancelled():
+                if on_cancel:
+                    self.dispatcher(on_cancel)
+            elif fut.exception() is not None:
+                if on_error:
+                    self.dispatcher(on_error, fut.exception())
+            elif on_success:
+                self.dispatcher(on_success, fut.result())
+            if on_finally:
+                self.dispatcher(on_finally)
+
+        future.add_done_callback(_done)
+        return future
+
+
+    def run(self, coro, timeout=None):
+        """ wykonanie korutyny i oczekiwanie na wynik (poza wątkiem silnika) """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+    def cancel_tasks(self, tasks):
+        """ anulowanie zadań asyncio pętli silnika z innego wątku (np. stron serii),
+            bieżące zapytania HTTP i strumienie są przerywane natychmiast
+        """
+        self.loop.call_soon_threadsafe(lambda: [task.cancel() for task in list(tasks)])
+
+
+    def dispatch(self, callback, *args):
+        """ przekazanie wywołania do wątku wywołującego (np. aktualizacja GUI) """
+        self.dispatcher(callback, *args)
+
+
+    def shutdown(self):
+        """ zatrzymanie pętli zdarzeń silnika """
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.images.shutdown()
+
+
+    def report_usage(self, model, usage_metadata, usage_callback=None, batch=False, key=None):
+        """ przekazanie informacji o zużyciu tokenów (batch - wywołanie przez Batch API,
+            key - nazwa klucza API z puli, który obsłużył zapytanie)
+        """
+        callback = usage_callback or self.usage_callback
+        if callback and usage_metadata:
+            if batch:
+                callback(model, usage_metadata, batch=True, key=key)
+            else:
+                callback(model, usage_metadata, key=key)
+
+
+    def _model_chain(self, model, operation):
+        """ [(model, czy ma model zastępczy)] - kolejne modele łańcucha dla zapytania """
+        chain = self.rate.model_chain(model, operation)
+        return [(name, index < len(chain) - 1) for index, name in enumerate(chain)]
+
+
+    def _failed_over(self, chain, index, error):
+        """ True, jeśli zapytanie do modelu chain[index] przejmuje kolejny model łańcucha """
+        model, failover = chain[index]
+        if not (failover and is_failover_error(error)):
+            return False
+        self.rate.mark_overloaded(model, error, chain[index + 1][0])
+        return True
+
+
+    @staticmethod
+    def _record_model(stats, requested, model):
+        """ zapis modelu, który odpowiedział, w stats['model'] (przy kilku zapytaniach jednej
+            strony, np. pasach skanu, zostaje model zastępczy)
+        """
+        if stats is not None and (model != requested or "model" not in stats):
+            stats["model"] = model
+
+
+    async def generate(self, model, contents, config, usage_callback=None, operation=None, keys=None,
+                       stats=None):
+        """ pojedyncze wywołanie generate_content przez klienta asynchronicznego,
+            z kontrolą limitów i ponawianiem po błędach 429/503; operation - rodzaj operacji
+            wyznaczający limit czasu odpowiedzi (patrz DEFAULT_REQUEST_TIMEOUTS) i łańcuch
+            modeli zastępczych (patrz DEFAULT_MODEL_FALLBACKS), keys - klucze API, które mogą
+            obsłużyć zapytanie (domyślnie cała pula); stats (słownik) - uzupełniany o nazwę
+            modelu, który odpowiedział ('model')
+        """
+        chain = self._model_chain(model, operation)
+        for index, (candidate, failover) in enumerate(chain):
+            try:
+                response = await self._generate(candidate, contents, model_config(candidate, config),
+                                                usage_callback, operation, keys, failover)
+            except Exception as e:
+                if not self._failed_over(chain, index, e):
+                    raise
+                continue
+            self._record_model(stats, model, candidate)
+            return response
+
+
+    async def _generate(self, model, contents, config, usage_callback=None, operation=None, keys=None,
+                        failover=False):
+        """ wywołanie generate_content dla jednego modelu (failover - patrz RateController.call) """
+        tokens = estimate_request_tokens(contents)
+        response, key = await self.rate.call(
+            model,
+            lambda key: self.client_manager.get_client(key).aio.models.generate_content(
+                model=model,
+                contents=contents,
+                config=config
+            ),
+            tokens,
+            self.rate.timeout(operation),
+            keys or self.client_manager.key_names,
+            failover
+        )
+        self.rate.record_usage(model, tokens, response.usage_metadata, key)
+        self.report_usage(model, response.usage_metadata, usage_callback, key=key)
+        return response
+
+
+    async def generate_stream(self, model, contents, config, usage_callback=None, stats=None, operation=None,
+                              keys=None, failover=False):
+        """ wywołanie strumieniowe, zwraca kolejne fragmenty odpowiedzi; zapytanie jest
+            ponawiane tylko wtedy, gdy błąd wystąpił przed otrzymaniem pierwszego fragmentu;
+            stats (słownik) - uzupełniany o czas do pierwszego fragmentu ('ttft', s),
+            liczbę tokenów odpowiedzi ('output_tokens'), nazwę klucza API ('key') i modelu
+            ('model'); limit czasu rodzaju operacji dotyczy oczekiwania na każdy kolejny
+            fragment; failover - patrz RateController.call
+        """
+        keys = keys or self.client_manager.key_names
+        tokens = estimate_request_tokens(contents)
+        timeout = self.rate.timeout(operation)
+        usage_metadata = None
+        attempt = 0
+        while True:
+            key = await self.rate.acquire(model, tokens, keys)
+            client = self.client_manager.get_client(key)
+            received = False
+            try:
+                async with self.rate.limiter:
+                    started = time.monotonic()
+                    if stats is not None:
+                        stats["sent"] = True
+                        stats["key"] = key
+                        stats["model"] = model
+                    stream = await wait_with_timeout(client.aio.models.generate_content_stream(
+                        model=model,
+                        contents=contents,
+                        config=config
+                    ), model, timeout)
+                    chunks = aiter(stream)
+                    try:
+                        while True:
+                            try:
+                                chunk = await wait_with_timeout(anext(chunks), model, timeout)
+                            except StopAsyncIteration:
+                                break
+                            if not received:
+                                ttft = time.monotonic() - started
+                                self.latency.record(model, ttft)
+                                if stats is not None:
+                                    stats["ttft"] = ttft
+                            received = True
+                            if chunk.usage_metadata:
+                                usage_metadata = chunk.usage_metadata
+                                if stats is not None and usage_metadata.candidates_token_count:
+                                    stats["output_tokens"] = usage_metadata.candidates_token_count
+                            yield chunk
+                    finally:
+                        # strumień przerwany (limit czasu, błąd, ponowienie) nie może trzymać połączenia
+                        await close_stream(chunks)
+                self.rate.limiter.on_success()
+                break
+            except Exception as e:
+                delay = None if received else self.rate.retry_delay(model, e, attempt, key, keys, failover)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        self.rate.record_usage(model, tokens, usage_metadata, key)
+        self.report_usage(model, usage_metadata, usage_callback, key=key)
+
+
+    async def _image_part(self, image_path):
+        """ obraz skanu przygotowany do wysłania (rozmiar, typ MIME) """
+        data, mime_type = await self.images.prepare(image_path)
+        return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+    async def _image_key(self, image_path):
+        """ identyfikator obrazu dla pamięci podręcznej: skrót pliku i parametry przygotowania """
+        return [await asyncio.to_thread(file_digest, image_path), self.images.settings()]
+
+
+    def _cache_lookup(self, key, use_cache):
+        """ odpowiedź z pamięci podręcznej lub None """
+        if self.cache is None or not use_cache:
+            return None
+        return self.cache.get(key)
+
+
+    def _cache_store(self, key, value, use_cache, model=None, stats=None):
+        """ zapis odpowiedzi w pamięci podręcznej (puste odpowiedzi są pomijane, podobnie
+            jak odpowiedzi modelu zastępczego - stats['model'] różny od modelu zapytania)
+        """
+        if stats and stats.get("model", model) != model:
+            return
+        if self.cache is not None and use_cache and value:
+            self.cache.put(key, value)
+
+
+    @staticmethod
+    def _prompt_contents(prompt_text, parts):
+        """ treść zapytania: prompt i pozostałe części (obraz, tekst) """
+        return [types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)] + parts)]
+
+
+    async def _context_config(self, model, prompt_text, config):
+        """ konfiguracja z wpisem pamięci kontekstu API dla promptu lub None, gdy prompt
+            trzeba wysłać w zapytaniu
+        """
+        if self.context is None:
+            return None
+        # wpis pamięci kontekstu należy do projektu klucza głównego
+        if not self.rate.usable_keys([self.client_manager.primary_key_name]):
+            return None
+        name = await self.context.get(model, prompt_text)
+        if name is None:
+            return None
+        return config.model_copy(update={"cached_content": name})
+
+
+    def _context_failed(self, model, prompt_text, error):
+        """ True, jeśli błąd dotyczy wpisu pamięci kontekstu (wygasł lub został usunięty
+            po stronie API) - zapytanie jest wtedy powtarzane z pełnym promptem
+        """
+        if not isinstance(error, errors.ClientError) or error_code(error) == 429:
+            return False
+        print(f"Cached content ({model}): {error}")
+        self.context.forget(model, prompt_text)
+        return True
+
+
+    async def generate_with_prompt(self, model, prompt_text, parts, config, usage_callback=None, operation=None,
+                                   stats=None):
+        """ wywołanie, w którym stały prompt jest pobierany z pamięci kontekstu API
+            (jeśli jest dostępna), a w zapytaniu wysyłane są tylko pozostałe części;
+            przy przeciążeniu modelu zapytanie przejmuje model zastępczy (patrz generate)
+        """
+        chain = self._model_chain(model, operation)
+        for index, (candidate, failover) in enumerate(chain):
+            try:
+                response = await self._generate_with_prompt(candidate, prompt_text, parts,
+                                                            model_config(candidate, config),
+                                                            usage_callback, operation, failover)
+            except Exception as e:
+                if not self._failed_over(chain, index, e):
+                    raise
+                continue
+            self._record_model(stats, model, candidate)
+            return response
+
+
+    async def _generate_with_prompt(self, model, prompt_text, parts, config, usage_callback, operation,
+                                    failover):
+        """ generate_with_prompt dla jednego modelu """
+        context_config = await self._context_config(model, prompt_text, config)
+        if context_config is not None:
+            try:
+                return await self._generate(model, [types.Content(role="user", parts=parts)],
+                                            context_config, usage_callback, operation,
+                                            [self.client_manager.primary_key_name], failover)
+            except Exception as e:
+                if not self._context_failed(model, prompt_text, e):
+                    raise
+        return await self._generate(model, self._prompt_contents(prompt_text, parts), config, usage_callback,
+                                    operation, None, failover)
+
+
+    async def stream_with_prompt(self, model, prompt_text, parts, config, usage_callback=None, stats=None,
+                                 operation=None):
+        """ wywołanie strumieniowe z promptem z pamięci kontekstu API (patrz generate_with_prompt);
+            model zastępczy przejmuje zapytanie tylko przed otrzymaniem pierwszego fragmentu
+        """
+        chain = self._model_chain(model, operation)
+        for index, (candidate, failover) in enumerate(chain):
+            received = False
+            try:
+                async for chunk in self._stream_with_prompt(candidate, prompt_text, parts,
+                                                            model_config(candidate, config),
+                                                            usage_callback, stats, operation, failover):
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received or not self._failed_over(chain, index, e):
+                    raise
+
+
+    async def _stream_with_prompt(self, model, prompt_text, parts, config, usage_callback, stats, operation,
+                                  failover):
+        """ stream_with_prompt dla jednego modelu """
+        context_config = await self._context_config(model, prompt_text, config)
+        if context_config is not None:
+            received = False
+            try:
+                async for chunk in self.generate_stream(model, [types.Content(role="user", parts=parts)],
+                                                        context_config, usage_callback, stats, operation,
+                                                        [self.client_manager.primary_key_name], failover):
+                    received = True
+                    yield chunk
+                return
+            except Exception as e:
+                if received or not self._context_failed(model, prompt_text, e):
+                    raise
+        async for chunk in self.generate_stream(model, self._prompt_contents(prompt_text, parts), config,
+                                                usage_callback, stats, operation, None, failover):
+            yield chunk
+
+
+    async def hedged_stream(self, model, prompt_text, parts, config, usage_callback=None, stats=None,
+                            hedge_usage_callback=None, operation=None):
+        """ wywołanie strumieniowe z zapytaniem zapasowym: jeśli pierwszy fragment odpowiedzi nie
+            nadejdzie w czasie typowym dla ostatnich zapytań modelu (self.latency), wysyłane jest
+            drugie, identyczne zapytanie; odpowiedź daje strumień, który pierwszy zwróci fragment,
+            drugi jest przerywany, a jego zużycie (lub szacunek tokenów wejściowych) przekazywane
+            do hedge_usage_callback jako osobny wpis kosztów
+        """
+        queue = asyncio.Queue()
+        streams = []
+
+        async def _run(index):
+            stream = streams[index]
+
+            def _usage(_model, usage_metadata, key=None):
+                stream["usage"] = usage_metadata
+            chunks = self.stream_with_prompt(model, prompt_text, parts, config, _usage, stream["stats"], operation)
+            try:
+                async for chunk in chunks:
+                    if chunk.usage_metadata:
+                        stream["partial"] = chunk.usage_metadata
+                    await queue.put((index, chunk, None))
+                await queue.put((index, None, None))
+            except Exception as e:
+                stream["error"] = e
+                await queue.put((index, None, e))
+            finally:
+                # przerwany strumień zapytania, które przegrało, zwalnia połączenie HTTP
+                await close_stream(chunks)
+
+        def _start():
+            streams.append({"usage": None, "partial": None, "error": None, "stats": {}})
+            streams[-1]["task"] = asyncio.create_task(_run(len(streams) - 1))
+
+        _start()
+        winner = None
+        finished = set()
+        try:
+            while True:
+                # zapytanie zapasowe tylko jedno, wysyłane przed pierwszym fragmentem
+                timeout = self.latency.threshold(model) if winner is None and len(streams) == 1 else None
+                try:
+                    index, chunk, error = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    _start()
+                    continue
+
+                if winner is None:
+                    if chunk is None:
+                        # strumień zakończony przed pierwszym fragmentem - odpowiedź da drugi
+                        finished.add(index)
+                        if len(finished) < len(streams):
+                            continue
+                        if error is not None:
+                            raise error
+                        winner = index
+                        break
+                    winner = index
+                    for other, stream in enumerate(streams):
+                        if other != winner:
+                            stream["task"].cancel()
+                elif index != winner:
+                    continue
+
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            for stream in streams:
+                stream["task"].cancel()
+            await asyncio.gather(*(stream["task"] for stream in streams), return_exceptions=True)
+
+            for index, stream in enumerate(streams):
+                if index == winner:
+                    if stats is not None:
+                        stats.update(stream["stats"])
+                    self.report_usage(stream["stats"].get("model", model), stream["usage"] or stream["partial"],
+                                      usage_callback, key=stream["stats"].get("key"))
+                elif stream["stats"].get("sent") and stream["error"] is None:
+                    # przerwane zapytanie: zużycie z ostatniego fragmentu lub szacunek tokenów wejściowych
+                    usage_metadata = stream["usage"] or stream["partial"] or types.GenerateContentResponseUsageMetadata(
+                        prompt_token_count=estimate_request_tokens(self._prompt_contents(prompt_text, parts)),
+                        candidates_token_count=0)
+                    self.report_usage(stream["stats"].get("model", model), usage_metadata,
+                                      hedge_usage_callback or usage_callback, key=stream["stats"].get("key"))
+
+
+    async def _transcription_key(self, image_path, prompt_text, model):
+        """ klucz pamięci podręcznej transkrypcji (wspólny dla wywołań zwykłych i strumieniowych) """
+        return cache_key("transcription", model, transcription_config().model_dump_json(exclude_none=True),
+                         prompt_text, await self._image_key(image_path))
+
+
+    async def batch_transcription_request(self, image_path, prompt_text, model):
+        """ treść zapytania transkrypcji dla Batch API i klucz pamięci podręcznej, pod którym
+            zostanie zapisany wynik (jak dla wywołań zwykłych i strumieniowych)
+        """
+        contents = self._prompt_contents(prompt_text, [await self._image_part(image_path)])
+        return contents, await self._transcription_key(image_path, prompt_text, model)
+
+
+    async def transcribe(self, image_path, prompt_text, model=TRANSCRIPTION_MODEL, usage_callback=None,
+                         use_cache=True, stats=None):
+        """ transkrypcja skanu, zwraca tekst (stats - patrz generate) """
+        key = await self._transcription_key(image_path, prompt_text, model)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        stats = {} if stats is None else stats
+        parts = [await self._image_part(image_path)]
+        response = await self.generate_with_prompt(model, prompt_text, parts, transcription_config(),
+                                                   usage_callback, "transcription", stats)
+        self._cache_store(key, response.text, use_cache, model, stats)
+        return response.text
+
+
+    async def stream_transcription(self, image_path, prompt_text, model=TRANSCRIPTION_MODEL,
+                                   usage_callback=None, use_cache=True, stats=None, hedge=False,
+                                   hedge_usage_callback=None):
+        """ transkrypcja skanu ze strumieniowaniem, zwraca kolejne fragmenty tekstu
+            (stats - patrz generate_stream, hedge - zapytanie zapasowe przy opóźnionej
+            odpowiedzi, patrz hedged_stream)
+        """
+        key = await self._transcription_key(image_path, prompt_text, model)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            yield cached
+            return
+
+        stats = {} if stats is None else stats
+        image_parts = [await self._image_part(image_path)]
+        parts = []
+        if hedge:
+            stream = self.hedged_stream(model, prompt_text, image_parts, transcription_config(),
+                                        usage_callback, stats, hedge_usage_callback, "transcription")
+        else:
+            stream = self.stream_with_prompt(model, prompt_text, image_parts, transcription_config(),
+                                             usage_callback, stats, "transcription")
+        async for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+        # zapis tylko pełnej odpowiedzi (strumień zakończony bez błędu)
+        self._cache_store(key, "".join(parts), use_cache, model, stats)
+
+
+    async def transcribe_tiles(self, image_path, prompt_text, layout, model=TRANSCRIPTION_MODEL,
+                               usage_callback=None, use_cache=True, stats=None):
+        """ transkrypcja dużego skanu w częściach: pasy z układu 'layout' transkrybowane
+            równolegle, tekst łączony z usunięciem wierszy powtórzonych na zakładkach
+            (stats - patrz generate)
+        """
+        config = transcription_config()
+        key = cache_key("transcription_tiles", model, config.model_dump_json(exclude_none=True),
+                        prompt_text, await self._image_key(image_path), layout)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        stats = {} if stats is None else stats
+
+        async def _tile(index, box):
+            data, mime_type = await self.images.prepare(image_path, box)
+            parts = [types.Part.from_text(text=TILE_PROMPT.format(index=index + 1, count=len(layout))),
+                     types.Part.from_bytes(data=data, mime_type=mime_type)]
+            response = await self.generate_with_prompt(model, prompt_text, parts, config, usage_callback,
+                                                       "transcription", stats)
+            return response.text or ""
+
+        texts = await asyncio.gather(*(_tile(index, box) for index, box in enumerate(layout)))
+        text = merge_tile_texts(texts)
+        self._cache_store(key, text, use_cache, model, stats)
+        return text
+
+
+    async def transcribe_packed(self, image_paths, prompt_text, model=TRANSCRIPTION_MODEL,
+                                usage_callback=None, use_cache=True, stats=None):
+        """ transkrypcja kilku małych skanów w jednym zapytaniu (stały prompt wysyłany raz),
+            zwraca listę tekstów w kolejności obrazów (None - brak obrazu w odpowiedzi);
+            zużycie tokenów jest przekazywane osobno dla każdego skanu (stats - patrz generate)
+        """
+        config = pack_config()
+        full_prompt = prompt_text + "\n" + PACK_PROMPT
+        image_keys = [await self._image_key(path) for path in image_paths]
+        key = cache_key("transcription_pack", model, config.model_dump_json(exclude_none=True),
+                        full_prompt, image_keys)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        parts = []
+        for index, path in enumerate(image_paths):
+            parts.append(types.Part.from_text(text=f"\nObraz {index + 1}:"))
+            parts.append(await self._image_part(path))
+
+        usage = []
+        stats = {} if stats is None else stats
+
+        def _usage(used_model, usage_metadata, key=None):
+            usage.append((used_model, usage_metadata, key))
+
+        response = await self.generate_with_prompt(model, full_prompt, parts, config, _usage, "transcription",
+                                                   stats)
+        texts = [None] * len(image_paths)
+        if response.text:
+            for item in parse_json_response(response.text):
+                index = item.get("image")
+                if isinstance(index, int) and 1 <= index <= len(texts) and item.get("text"):
+                    texts[index - 1] = item["text"]
+
+        # zużycie przypisane stronom proporcjonalnie do długości ich transkrypcji
+        if usage:
+            used_model, usage_metadata, usage_key = usage[0]
+            for share in split_usage(usage_metadata, [len(text or "") for text in texts]):
+                self.report_usage(used_model, share, usage_callback, key=usage_key)
+
+        if all(texts):
+            self._cache_store(key, texts, use_cache, model, stats)
+        return texts
+
+
+    async def transcribe_with_entities(self, image_path, prompt_text, model=TRANSCRIPTION_MODEL,
+                                       usage_callback=None, use_cache=True, stats=None):
+        """ transkrypcja skanu i ekstrakcja nazw własnych w jednym zapytaniu,
+            zwraca (tekst, słownik nazw własnych) (stats - patrz generate)
+        """
+        config = transcription_ner_config()
+        full_prompt = prompt_text + "\n" + TRANSCRIPTION_NER_PROMPT
+        key = cache_key("transcription_ner", model, config.model_dump_json(exclude_none=True),
+                        full_prompt, await self._image_key(image_path))
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached["text"], cached["entities"]
+
+        stats = {} if stats is None else stats
+        parts = [await self._image_part(image_path)]
+        response = await self.generate_with_prompt(model, full_prompt, parts, config, usage_callback,
+                                                   "transcription", stats)
+        if not response.text:
+            return None, None
+
+        data = parse_json_response(response.text)
+        result = {
+            "text": data.get("text") or "",
+            "entities": {cat: data.get(cat) or [] for cat in ("PERS", "LOC", "ORG")}
+        }
+        self._cache_store(key, result, use_cache, model, stats)
+        return result["text"], result["entities"]
+
+
+    async def verify_transcription(self, image_path, text, model=VERIFY_MODEL, usage_callback=None,
+                                   use_cache=True):
+        """ weryfikacja transkrypcji z obrazem, zwraca poprawiony tekst """
+        config = transcription_config()
+        key = cache_key("verify", model, config.model_dump_json(exclude_none=True),
+                        VERIFY_PROMPT, text, await self._image_key(image_path))
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        parts = [
+            types.Part.from_text(text="\nTranskrypcja: " + text),
+            await self._image_part(image_path)
+        ]
+        stats = {}
+        response = await self.generate_with_prompt(model, VERIFY_PROMPT, parts, config, usage_callback, "verify",
+                                                   stats)
+        result = response.text.strip() if response.text else None
+        self._cache_store(key, result, use_cache, model, stats)
+        return result
+
+
+    async def extract_entities(self, text, model=NER_MODEL, usage_callback=None, use_cache=True):
+        """ ekstrakcja nazw własnych (PERS, LOC, ORG), zwraca słownik """
+        config = types.GenerateContentConfig(
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+        )
+        key = cache_key("ner", model, config.model_dump_json(exclude_none=True), NER_PROMPT, text)
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        parts = [types.Part.from_text(text="\nTekst: " + text)]
+        stats = {}
+        response = await self.generate_with_prompt(model, NER_PROMPT, parts, config, usage_callback, "ner", stats)
+        if not response.text:
+            return None
+        result = parse_json_response(response.text)
+        self._cache_store(key, result, use_cache, model, stats)
+        return result
+
+
+    async def locate_entities(self, image_path, entities, model=BOX_MODEL, usage_callback=None,
+                              use_cache=True):
+        """ lokalizacja nazw własnych na skanie, zwraca listę ramek """
+        entities_str = ""
+        for cat, names in entities.items():
+            for name in names:
+                entities_str += f"{name},{cat}\n"
+
+        config = types.GenerateContentConfig(
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+            image_config=types.ImageConfig(
+                image_size="1K",
+            ),
+            response_modalities=[
+                "TEXT"
+            ]
+        )
+
+        prompt = BOX_PROMPT.format(entities=entities_str)
+        key = cache_key("box", model, config.model_dump_json(exclude_none=True), prompt,
+                        await self._image_key(image_path))
+        cached = self._cache_lookup(key, use_cache)
+        if cached is not None:
+            return cached
+
+        contents = [
+            types.Part.from_text(text=prompt),
+            await self._image_part(image_path)
+        ]
+        stats = {}
+        response = await self.generate(model, contents, config, usage_callback, "box", stats=stats)
+        if not response.text:
+            return None
+        result = parse_coordinates_response(response.text)
+        self._cache_store(key, result, use_cache, model, stats)
+        return result
+
+
+    async def synthesize_speech(self, text, model=TTS_MODEL, voice_name='Enceladus', usage_callback=None):
+        """ synteza mowy, zwraca surowe dane PCM (24 kHz, 16 bit, mono) """
+        config = types.GenerateContentConfig(
+            response_modalities=["AUDIO"],
+            speech_config=types.SpeechConfig(
+                voice_config=types.VoiceConfig(
+                    prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                        voice_name=voice_name,
+                    )
+                )
+            ),
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+        )
+        response = await self.generate(model, TTS_PROMPT + text, config, usage_callback, "tts")
+        return response.candidates[0].content.parts[0].inline_data.data
+
+
+    async def nominative_forms(self, names, model=NOMINATIVE_MODEL, chunk_size=50, usage_callback=None):
+        """ formy mianownika dla listy nazw, paczki po chunk_size nazw przetwarzane równolegle """
+        config = types.GenerateContentConfig(
+            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
+        )
+
+        async def _chunk(batch):
+            response = await self.generate(model, NOMINATIVE_PROMPT + ', '.join(batch), config, usage_callback,
+                                           "nominative")
+            return parse_json_response(response.text) if response.text else {}
+
+        results = await asyncio.gather(*(_chunk(names[i:i + chunk_size])
+                                         for i in range(0, len(names), chunk_size)))
+        nominative_map = {}
+        for result in results:
+            nominative_map.update(result)
+        return nominative_map
@@ -0,0 +1,123 @@
+""" przygotowanie obrazów skanów przed wysłaniem do modelu """
+import io
+import os
+import asyncio
+import mimetypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+# dłuższy bok obrazu: przy MEDIA_RESOLUTION_HIGH model i tak zmniejsza obraz,
+# wysyłanie większej rozdzielczości wydłuża tylko przesyłanie
+DEFAULT_MAX_SIDE = 3072
+DEFAULT_QUALITY = 90
+# pliki większe od tej wartości są kodowane ponownie nawet bez zmniejszania
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+# formaty przyjmowane przez API bez konwersji
+SUPPORTED_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+def read_file_bytes(path):
+    """ odczyt zawartości pliku (wywoływany poza pętlą zdarzeń) """
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def guess_mime_type(path):
+    """ typ MIME na podstawie rozszerzenia pliku """
+    mime_type, _ = mimetypes.guess_type(path)
+    return mime_type or "image/jpeg"
+
+
+def prepare_image(path, max_side=DEFAULT_MAX_SIDE, grayscale=False, quality=DEFAULT_QUALITY,
+                  max_bytes=DEFAULT_MAX_BYTES, box=None):
+    """ obraz gotowy do wysłania: (dane, typ MIME), wykonywane w procesie roboczym;
+        obraz jest zmniejszany do max_side, opcjonalnie konwertowany do skali szarości
+        i kodowany jako JPEG, w pozostałych przypadkach wysyłany bez zmian;
+        box - wycinany fragment skanu [lewo, góra, prawo, dół]
+    """
+    from PIL import Image
+
+    raw = read_file_bytes(path)
+
+    with Image.open(io.BytesIO(raw)) as img:
+        image_format = img.format
+        if box:
+            img = img.crop(tuple(box))
+        needs_resize = max_side and max(img.size) > max_side
+        needs_encoding = (needs_resize or grayscale or box or len(raw) > max_bytes
+                          or image_format not in SUPPORTED_FORMATS)
+
+        if not needs_encoding:
+            return raw, SUPPORTED_FORMATS[image_format]
+
+        if needs_resize:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        img = img.convert("L" if grayscale else "RGB")
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
+
+
+class ImagePreprocessor:
+    """ przygotowanie obrazów w puli procesów (bez blokowania GIL przez równoległą serię) """
+    def __init__(self, enabled=True, max_side=DEFAULT_MAX_SIDE, grayscale=False,
+                 quality=DEFAULT_QUALITY, workers=None):
+        self.enabled = enabled
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.quality = quality
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self._pool = None
+
+
+    def _get_pool(self):
+        # 'spawn' - proces główny ma już wątki (Tk, pętla silnika), fork nie jest bezpieczny
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+
+    def settings(self):
+        """ parametry przygotowania obrazu (część klucza pamięci podręcznej odpowiedzi) """
+        if not self.enabled:
+            return None
+        return [self.max_side, self.grayscale, self.quality]
+
+
+    async def prepare(self, path, box=None):
+        """ (dane, typ MIME) obrazu do wysłania (box - fragment skanu, wycinany zawsze,
+            także przy wyłączonym przygotowaniu obrazów)
+        """
+        loop = asyncio.get_running_loop()
+        if not self.enabled:
+            if box:
+                return await loop.run_in_executor(self._get_pool(), prepare_image, path,
+                                                  None, False, DEFAULT_QUALITY, DEFAULT_MAX_BYTES, box)
+            data = await asyncio.to_thread(read_file_bytes, path)
+            return data, guess_mime_type(path)
+
+        return await loop.run_in_executor(self._get_pool(), prepare_image, path,
+                                          self.max_side, self.grayscale, self.quality,
+                                          DEFAULT_MAX_BYTES, box)
+
+
+    async def run(self, func, *args):
+        """ wywołanie funkcji przetwarzającej obraz w puli procesów (np. skrót obrazu) """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), func, *args)
+
+
+    def shutdown(self):
+        """ zamknięcie puli procesów """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
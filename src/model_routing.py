@@ -0,0 +1,177 @@
+""" wybór modelu transkrypcji dla strony według tabeli reguł (config.json: model_routes):
+    reguła może dotyczyć nazwy promptu, katalogu skanów lub rodzaju pisma na skanie
+    (druk/maszynopis albo rękopis, rozpoznawany prostą analizą obrazu)
+"""
+import os
+import asyncio
+import fnmatch
+import statistics
+from gemini_engine import TRANSCRIPTION_MODEL
+from scan_files import metadata_path, load_metadata, save_metadata
+
+
+SCAN_PRINTED = "printed"
+SCAN_HANDWRITTEN = "handwritten"
+
+# domyślna tabela: maszynopisy i druki z promptem dla maszynopisu - tańszy model flash
+DEFAULT_ROUTES = [
+    {"prompt": "prompt_typescript*", "model": "gemini-3-flash-preview"},
+]
+
+# rozmiar obrazu analizowanego przy rozpoznawaniu rodzaju pisma (dłuższy bok)
+CLASSIFY_SIDE = 1600
+# margines pomijany przy analizie (ramki i krawędzie skanu), część wymiaru
+CLASSIFY_MARGIN = 0.04
+# liczba osobnych śladów pisma w wierszu na wysokość wiersza: litery druku i maszynopisu
+# są rozdzielone, pismo ręczne łączy litery w wyrazy
+PRINTED_DENSITY = 1.2
+# minimalna liczba wierszy tekstu potrzebna do rozpoznania
+MIN_LINES = 3
+
+
+def _otsu_threshold(histogram):
+    """ próg binaryzacji obrazu w skali szarości (metoda Otsu) """
+    total = sum(histogram)
+    sum_all = sum(index * count for index, count in enumerate(histogram))
+    weight_bg = sum_bg = 0
+    best, threshold = 0, 128
+    for value, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += value * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best:
+            best, threshold = variance, value
+    return threshold
+
+
+def scan_layout(image_path, side=CLASSIFY_SIDE):
+    """ układ tekstu na skanie: {"lines": liczba wierszy tekstu, "density": mediana liczby
+        osobnych śladów pisma w wierszu na wysokość wiersza lub None}; wiersze wyznaczane
+        z profilu poziomego, ślady pisma rozdzielają kolumny bez tuszu; wykonywane w procesie roboczym
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        img.draft("L", (side * 2, side * 2))
+        gray = img.convert("L")
+    gray.thumbnail((side, side))
+    margin_x, margin_y = int(gray.width * CLASSIFY_MARGIN), int(gray.height * CLASSIFY_MARGIN)
+    gray = ImageOps.autocontrast(gray.crop((margin_x, margin_y, gray.width - margin_x, gray.height - margin_y)),
+                                 cutoff=1)
+
+    width, height = gray.size
+    threshold = _otsu_threshold(gray.histogram())
+    data = gray.point(lambda p: 1 if p < threshold else 0).tobytes()
+    rows = [data[y * width:(y + 1) * width] for y in range(height)]
+    profile = [sum(row) for row in rows]
+    peak = max(profile) or 1
+
+    # wiersze tekstu: pasy o zawartości tuszu powyżej 10% maksimum
+    lines = []
+    start = None
+    for y, value in enumerate(profile + [0]):
+        if value > 0.1 * peak:
+            if start is None:
+                start = y
+        elif start is not None:
+            if y - start >= 4:
+                lines.append((start, y))
+            start = None
+
+    densities = []
+    for top, bottom in lines:
+        columns = bytes(any(rows[y][x] for y in range(top, bottom)) for x in range(width))
+        ink = sum(columns)
+        if ink < (bottom - top) * 4:
+            continue
+        runs = sum(1 for x in range(1, width) if columns[x] and not columns[x - 1])
+        densities.append(runs * (bottom - top) / ink)
+
+    return {"lines": len(lines), "density": statistics.median(densities) if densities else None}
+
+
+def classify_scan(image_path, side=CLASSIFY_SIDE):
+    """ rodzaj pisma na skanie: SCAN_PRINTED, SCAN_HANDWRITTEN lub None (za mało tekstu);
+        litery druku i maszynopisu są rozdzielone, pismo ręczne łączy je w wyrazy
+    """
+    layout = scan_layout(image_path, side)
+    if layout["lines"] < MIN_LINES or layout["density"] is None:
+        return None
+    return SCAN_PRINTED if layout["density"] >= PRINTED_DENSITY else SCAN_HANDWRITTEN
+
+
+def _matches(pattern, value):
+    return bool(value) and fnmatch.fnmatch(value.lower(), pattern.lower())
+
+
+class ModelRouter:
+    """ tabela reguł wyboru modelu: pierwsza reguła, której wszystkie warunki są spełnione,
+        wyznacza model strony; warunki: 'prompt' (wzorzec nazwy pliku promptu), 'folder'
+        (wzorzec ścieżki lub nazwy katalogu skanów), 'scan' (printed/handwritten);
+        bez pasującej reguły - model domyślny
+    """
+    def __init__(self, routes=None, default=TRANSCRIPTION_MODEL):
+        self.routes = [rule for rule in (DEFAULT_ROUTES if routes is None else routes)
+                       if isinstance(rule, dict) and rule.get("model")]
+        self.default = default
+
+
+    @property
+    def uses_scan_type(self):
+        """ czy reguły wymagają rozpoznania rodzaju pisma na skanach """
+        return any("scan" in rule for rule in self.routes)
+
+
+    def choose(self, prompt_name="", folder="", scan_type=None):
+        """ model dla strony o podanych cechach """
+        for rule in self.routes:
+            if "prompt" in rule and not _matches(rule["prompt"], prompt_name):
+                continue
+            if "folder" in rule and not (_matches(rule["folder"], folder)
+                                         or _matches(rule["folder"], os.path.basename(folder or ""))):
+                continue
+            if "scan" in rule and rule["scan"] != scan_type:
+                continue
+            return rule["model"]
+        return self.default
+
+
+    def known_model(self, pair, prompt_name=""):
+        """ model strony bez analizy obrazu (rodzaj pisma tylko zapisany wcześniej w metadanych),
+            np. do szacowania kosztu serii
+        """
+        scan_type = None
+        if self.uses_scan_type:
+            try:
+                scan_type = load_metadata(metadata_path(pair['txt'])).get("scan_type")
+            except Exception:
+                scan_type = None
+        return self.choose(prompt_name, os.path.dirname(pair['img']), scan_type)
+
+
+    async def page_model(self, pair, prompt_name, images):
+        """ model strony; rodzaj pisma rozpoznawany w puli procesów przygotowania obrazów
+            (images) przy pierwszej potrzebie i zapisywany w metadanych strony
+        """
+        scan_type = None
+        if self.uses_scan_type:
+            json_path = metadata_path(pair['txt'])
+            try:
+                scan_type = load_metadata(json_path).get("scan_type")
+            except Exception:
+                scan_type = None
+            if scan_type is None:
+                try:
+                    scan_type = await images.run(classify_scan, pair['img'])
+                except Exception as e:
+                    print(f"{pair['name']}: {e}")
+                if scan_type:
+                    await asyncio.to_thread(save_metadata, json_path, scan_type=scan_type)
+        return self.choose(prompt_name, os.path.dirname(pair['img']), scan_type)
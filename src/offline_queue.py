@@ -0,0 +1,234 @@
+""" kolejka operacji AI zleconych bez połączenia z siecią (transkrypcja, NER, BOX, FIX, TTS):
+    operacje są zapisywane na dysku razem z kopią danych wejściowych i wykonywane
+    w kolejności zlecenia, gdy połączenie z API wróci
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+import httpx
+from batch_journal import atomic_write_text
+from scan_files import read_text, calculate_checksum, metadata_path, save_metadata
+from pipeline import transcribe_page, transcribe_ner_page, synthesize_audio
+from gemini_engine import TRANSCRIPTION_MODEL
+from rate_control import is_offline_error
+
+
+OFFLINE_QUEUE_FILE = "offline_queue.jsonl"
+
+OP_TRANSCRIPTION = "transcription"
+OP_NER = "ner"
+OP_BOX = "box"
+OP_VERIFY = "verify"
+OP_TTS = "tts"
+
+# domyślny adres API sprawdzany przed opróżnieniem kolejki
+DEFAULT_API_URL = "https://generativelanguage.googleapis.com"
+# odstęp między kolejnymi próbami połączenia (s)
+DEFAULT_PROBE_INTERVAL = 30
+PROBE_TIMEOUT = 5
+# maksymalna liczba operacji z kolejki wykonywanych w ciągu minuty
+DEFAULT_FLUSH_RATE = 10
+
+
+class PageChanged(Exception):
+    """ tekst strony zmienił się od zlecenia operacji - wynik byłby nieaktualny """
+
+
+async def api_reachable(base_url=None, timeout=PROBE_TIMEOUT):
+    """ czy serwer API odpowiada (każda odpowiedź HTTP oznacza działające połączenie) """
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            await client.head(base_url or DEFAULT_API_URL)
+        return True
+    except httpx.HTTPError:
+        return False
+
+
+def page_checksum(pair):
+    """ suma kontrolna zapisanego tekstu strony (pusty tekst, gdy brak pliku) """
+    return calculate_checksum(read_text(pair['txt']).strip() if os.path.exists(pair['txt']) else "")
+
+
+class OfflineQueue:
+    """ trwała kolejka operacji na stronach zapisywana jako plik JSONL (dopisywane są nowe
+        operacje i oznaczenia operacji zakończonych); wynik operacji jest zapisywany
+        na dysku strony tylko wtedy, gdy tekst strony nie zmienił się od zlecenia
+    """
+    def __init__(self, path, flush_rate=DEFAULT_FLUSH_RATE, probe_interval=DEFAULT_PROBE_INTERVAL):
+        self.path = path
+        self.flush_rate = flush_rate
+        self.probe_interval = probe_interval
+        self.entries = []
+        # True po błędzie połączenia, do chwili ponownego połączenia z API
+        self.offline = False
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self):
+        """ odtworzenie kolejki z pliku (operacje bez oznaczenia zakończenia) """
+        self.entries = []
+        if not os.path.exists(self.path):
+            return
+
+        entries = {}
+        line_count = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line_count += 1
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # niedokończony wpis po awarii
+                    continue
+                if entry.get("done"):
+                    entries.pop(entry.get("id"), None)
+                elif entry.get("id"):
+                    entries[entry["id"]] = entry
+        self.entries = list(entries.values())
+
+        if line_count > len(self.entries):
+            self._rewrite()
+
+
+    def _rewrite(self):
+        """ zapis samych oczekujących operacji jako nowy plik kolejki """
+        atomic_write_text(self.path, "".join(json.dumps(entry, ensure_ascii=False) + "\n"
+                                             for entry in self.entries))
+
+
+    def _append(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def add(self, operation, pair, **inputs):
+        """ zapis operacji na stronie z kopią danych wejściowych (tekst, prompt, nazwy własne)
+            i sumą kontrolną tekstu, dla którego wynik będzie aktualny (kopii tekstu lub
+            zapisanego tekstu strony)
+        """
+        entry = {
+            "id": uuid.uuid4().hex,
+            "operation": operation,
+            "img": pair['img'],
+            "txt": pair['txt'],
+            "name": pair['name'],
+            "checksum": calculate_checksum(inputs["text"]) if "text" in inputs else page_checksum(pair),
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **inputs
+        }
+        with self._lock:
+            self._append(entry)
+            self.entries.append(entry)
+        return entry
+
+
+    def remove(self, entry):
+        """ oznaczenie operacji jako zakończonej (wykonanej lub pominiętej) """
+        with self._lock:
+            self._append({"id": entry["id"], "done": True})
+            self.entries = [item for item in self.entries if item["id"] != entry["id"]]
+            if not self.entries:
+                self._rewrite()
+
+
+    def outdated(self, entry):
+        """ czy tekst strony zmienił się od zlecenia operacji (wynik byłby nieaktualny) """
+        pair = {"txt": entry["txt"]}
+        return page_checksum(pair) != entry["checksum"]
+
+
+    async def flush(self, run, on_done=None):
+        """ wykonanie operacji w kolejności zlecenia, nie więcej niż flush_rate na minutę;
+            run(wpis) - korutyna wykonująca operację, on_done(wpis, wynik lub wyjątek, np. PageChanged
+            dla operacji pominiętej); zwraca False, gdy połączenie zostało ponownie utracone
+        """
+        interval = 60 / self.flush_rate if self.flush_rate else 0
+        while self.entries:
+            entry = self.entries[0]
+            started = time.monotonic()
+            try:
+                if self.outdated(entry):
+                    raise PageChanged(f"{entry['name']}: tekst strony zmienił się od zlecenia operacji")
+                result = await run(entry)
+            except Exception as e:
+                if is_offline_error(e):
+                    self.offline = True
+                    return False
+                result = e
+            self.remove(entry)
+            if on_done:
+                on_done(entry, result)
+            if self.entries:
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+        return True
+
+
+    async def process(self, run, on_done=None, base_url=None):
+        """ opróżnianie kolejki: sprawdzanie połączenia z API co probe_interval s
+            i wykonywanie zapisanych operacji, gdy połączenie jest dostępne
+        """
+        while self.entries:
+            if await api_reachable(base_url):
+                self.offline = False
+                if await self.flush(run, on_done):
+                    break
+            else:
+                self.offline = True
+            await asyncio.sleep(self.probe_interval)
+
+
+async def run_entry(engine, entry, usage_callback=None, model=TRANSCRIPTION_MODEL, tile_min_pixels=None):
+    """ wykonanie operacji z kolejki i zapis wyniku na dysku strony; zwraca wynik operacji
+        (statystyki transkrypcji, nazwy własne, ramki, poprawiony tekst, ścieżka MP3);
+        model - model transkrypcji wybrany dla strony
+    """
+    pair = {"img": entry["img"], "txt": entry["txt"], "name": entry["name"]}
+    operation = entry["operation"]
+    json_path = metadata_path(pair['txt'])
+
+    if operation == OP_TRANSCRIPTION:
+        if entry.get("combined"):
+            return await transcribe_ner_page(engine, pair, entry["prompt_text"], model=model,
+                                             usage_callback=usage_callback, tile_min_pixels=tile_min_pixels)
+        return await transcribe_page(engine, pair, entry["prompt_text"], model=model,
+                                     usage_callback=usage_callback, tile_min_pixels=tile_min_pixels)
+
+    text = entry["text"]
+    checksum = calculate_checksum(text)
+    if operation == OP_NER:
+        entities = await engine.extract_entities(text, usage_callback=usage_callback)
+        if entities:
+            # nowe nazwy własne oznaczają konieczność wyszukania nowych ramek na skanie
+            await asyncio.to_thread(save_metadata, json_path, entities=entities, coordinates=[],
+                                    checksum=checksum)
+        return entities
+
+    if operation == OP_BOX:
+        coordinates = await engine.locate_entities(pair['img'], entry["entities"], usage_callback=usage_callback)
+        if coordinates is not None:
+            await asyncio.to_thread(save_metadata, json_path, coordinates=coordinates, checksum=checksum)
+        return coordinates
+
+    if operation == OP_VERIFY:
+        fixed_text = await engine.verify_transcription(pair['img'], text, usage_callback=usage_callback)
+        if fixed_text:
+            await asyncio.to_thread(atomic_write_text, os.path.splitext(pair['txt'])[0] + ".fix", fixed_text)
+        return fixed_text
+
+    if operation == OP_TTS:
+        mp3_path, _ = await synthesize_audio(engine, text, entry["mp3_path"], json_path,
+                                             usage_callback=usage_callback)
+        return mp3_path
+
+    raise ValueError(f"Nieznana operacja: {operation}")
@@ -0,0 +1,337 @@
+""" operacje na stronach katalogu wykonywane w silniku Gemini: transkrypcja, NER, ramki
+    i audio (wspólne dla okna aplikacji i trybu wsadowego bez interfejsu)
+"""
+import os
+import asyncio
+from batch_journal import PartialTextFile, atomic_write_text
+from scan_files import (read_text, calculate_checksum, metadata_path, audio_path,
+                        load_metadata, save_metadata)
+from tts_audio import save_tts_audio
+from gemini_engine import TRANSCRIPTION_MODEL
+from tiling import image_size, tile_layout, DEFAULT_TILE_PIXELS
+
+
+EMPTY_RESPONSE = "Pusta odpowiedź modelu"
+
+# łączenie małych skanów: liczba skanów w jednym zapytaniu i maksymalny rozmiar skanu (piksele)
+DEFAULT_PACK_SIZE = 4
+DEFAULT_PACK_MAX_PIXELS = 2_000_000
+
+
+def _metadata(json_path):
+    """ metadane strony, uszkodzony plik jest traktowany jak brak metadanych """
+    try:
+        return load_metadata(json_path)
+    except Exception as e:
+        print(f"Błąd odczytu metadanych {json_path}: {e}")
+        return {}
+
+
+def page_tile_layout(pair, min_pixels=None, tile_pixels=DEFAULT_TILE_PIXELS):
+    """ układ pasów dla transkrypcji strony w częściach lub None (cały skan): układ wybrany
+        dla strony i zapisany w metadanych albo - dla skanów o liczbie pikseli co najmniej
+        min_pixels - układ wyznaczany automatycznie i zapisywany w metadanych do ponownego użycia
+    """
+    json_path = metadata_path(pair['txt'])
+    tiles = _metadata(json_path).get("tiles")
+    if tiles is False:
+        return None
+
+    width, height = image_size(pair['img'])
+    auto = bool(min_pixels) and width * height >= min_pixels
+    if isinstance(tiles, dict) and (auto or not tiles.get("auto")):
+        if tiles.get("size") == [width, height]:
+            return tiles["layout"]
+    elif not auto:
+        return None
+
+    # nowy układ (pierwsza transkrypcja dużego skanu lub skan został zmieniony)
+    explicit = isinstance(tiles, dict) and not tiles.get("auto")
+    layout = tile_layout(width, height, tile_pixels, min_tiles=2)
+    save_metadata(json_path, tiles={"size": [width, height], "layout": layout, "auto": not explicit})
+    return layout
+
+
+def set_page_tiling(pair, enabled, tile_pixels=DEFAULT_TILE_PIXELS):
+    """ wybór transkrypcji strony w częściach (enabled=False - zawsze cały skan),
+        zwraca zapisany układ pasów lub None
+    """
+    json_path = metadata_path(pair['txt'])
+    if not enabled:
+        save_metadata(json_path, tiles=False)
+        return None
+    width, height = image_size(pair['img'])
+    layout = tile_layout(width, height, tile_pixels, min_tiles=2)
+    save_metadata(json_path, tiles={"size": [width, height], "layout": layout, "auto": False})
+    return layout
+
+
+async def _transcribe_tiled(engine, pair, prompt_text, layout, model, usage_callback, empty_message, stats=None):
+    """ transkrypcja strony w częściach zapisana w pliku txt (bez strumieniowania) """
+    text = await engine.transcribe_tiles(pair['img'], prompt_text, layout, model=model,
+                                         usage_callback=usage_callback, stats=stats)
+    text = (text or "").strip()
+    if not text:
+        raise ValueError(empty_message)
+    atomic_write_text(pair['txt'], text + "\n")
+    return text
+
+
+def _with_fallback(result, model, used_model):
+    """ statystyki strony uzupełnione o model zastępczy ('fallback'), jeśli odpowiedział inny model """
+    if used_model != model:
+        result["fallback"] = used_model
+    return result
+
+
+async def transcribe_page(engine, pair, prompt_text, model=TRANSCRIPTION_MODEL, on_chunk=None,
+                          usage_callback=None, empty_message=EMPTY_RESPONSE, tile_min_pixels=None):
+    """ transkrypcja strony ze strumieniowaniem do pliku .partial, zamienianego na plik txt
+        po otrzymaniu pełnej odpowiedzi; on_chunk(stats) - po każdym fragmencie tekstu;
+        zwraca statystyki strony (czas do pierwszego tokenu, liczba tokenów); duże skany
+        i strony wybrane do podziału są transkrybowane w częściach (patrz page_tile_layout)
+    """
+    layout = await asyncio.to_thread(page_tile_layout, pair, tile_min_pixels)
+    if layout:
+        stats = {}
+        await _transcribe_tiled(engine, pair, prompt_text, layout, model, usage_callback, empty_message, stats)
+        used_model = stats.get("model", model)
+        await asyncio.to_thread(save_metadata, metadata_path(pair['txt']), model=used_model)
+        return _with_fallback({"tiles": len(layout)}, model, used_model)
+
+    stats = {"chars": 0}
+    writer = PartialTextFile(pair['txt'])
+    try:
+        async for text in engine.stream_transcription(pair['img'], prompt_text, model=model,
+                                                      usage_callback=usage_callback, stats=stats):
+            writer.write(text)
+            stats["chars"] = writer.length
+            if on_chunk:
+                on_chunk(stats)
+
+        if writer.length == 0:
+            raise ValueError(empty_message)
+
+        # plik txt powstaje dopiero po otrzymaniu całej odpowiedzi
+        writer.commit('\n')
+    finally:
+        writer.close()
+
+    # model, który wykonał transkrypcję (wybierany dla strony według reguł, przy przeciążeniu
+    # model zastępczy)
+    used_model = stats.get("model", model)
+    await asyncio.to_thread(save_metadata, metadata_path(pair['txt']), model=used_model)
+    result = _with_fallback({}, model, used_model)
+    if stats.get("output_tokens"):
+        result["output_tokens"] = stats["output_tokens"]
+    if stats.get("ttft") is not None:
+        result["ttft"] = round(stats["ttft"], 2)
+    return result
+
+
+def is_small_scan(pair, max_pixels):
+    """ skan o liczbie pikseli nie większej niż max_pixels (kandydat do wysłania razem z innymi
+        małymi skanami); strony wybrane do transkrypcji w częściach są pomijane
+    """
+    if not max_pixels or _metadata(metadata_path(pair['txt'])).get("tiles"):
+        return False
+    try:
+        width, height = image_size(pair['img'])
+    except Exception as e:
+        print(f"{pair['name']}: {e}")
+        return False
+    return width * height <= max_pixels
+
+
+def pack_small_pages(pairs, max_pixels, pack_size, key=None):
+    """ podział stron na zadania: małe skany łączone po 'pack_size' w jednym zapytaniu,
+        pozostałe pojedynczo; zwraca listę list stron w kolejności pierwszej strony zadania
+        (key(strona) - np. model strony, razem łączone są tylko strony o tej samej wartości)
+    """
+    units = []
+    packs = {}
+    for pair in pairs:
+        if pack_size < 2 or not is_small_scan(pair, max_pixels):
+            units.append([pair])
+            continue
+        group = key(pair) if key else None
+        pack = packs.get(group)
+        if pack is None:
+            pack = packs[group] = []
+            units.append(pack)
+        pack.append(pair)
+        if len(pack) >= pack_size:
+            del packs[group]
+    return units
+
+
+async def transcribe_pack(engine, pairs, prompt_text, model=TRANSCRIPTION_MODEL, usage_callback=None,
+                          empty_message=EMPTY_RESPONSE):
+    """ transkrypcja kilku małych skanów w jednym zapytaniu, tekst zapisywany w osobnych plikach txt;
+        zwraca {nazwa strony: statystyki strony lub wyjątek} (strona bez tekstu w odpowiedzi - błąd)
+    """
+    stats = {}
+    texts = await engine.transcribe_packed([pair['img'] for pair in pairs], prompt_text, model=model,
+                                           usage_callback=usage_callback, stats=stats)
+    used_model = stats.get("model", model)
+    results = {}
+    for pair, text in zip(pairs, texts):
+        text = (text or "").strip()
+        if not text:
+            results[pair['name']] = ValueError(empty_message)
+            continue
+        atomic_write_text(pair['txt'], text + "\n")
+        save_metadata(metadata_path(pair['txt']), model=used_model)
+        results[pair['name']] = _with_fallback({"packed": len(pairs)}, model, used_model)
+    return results
+
+
+async def transcribe_ner_page(engine, pair, prompt_text, model=TRANSCRIPTION_MODEL, usage_callback=None,
+                              empty_message=EMPTY_RESPONSE, tile_min_pixels=None):
+    """ transkrypcja i nazwy własne strony w jednym zapytaniu: zapis pliku txt oraz metadanych
+        z sumą kontrolną tekstu (późniejsze NER dla tego tekstu nie wymaga wywołania modelu);
+        strona transkrybowana w częściach wymaga osobnego zapytania NER dla całego tekstu
+    """
+    stats = {}
+    layout = await asyncio.to_thread(page_tile_layout, pair, tile_min_pixels)
+    if layout:
+        text = await _transcribe_tiled(engine, pair, prompt_text, layout, model, usage_callback,
+                                       empty_message, stats)
+        entities = await engine.extract_entities(text, usage_callback=usage_callback) or {}
+    else:
+        text, entities = await engine.transcribe_with_entities(pair['img'], prompt_text, model=model,
+                                                               usage_callback=usage_callback, stats=stats)
+        text = (text or "").strip()
+        if not text:
+            raise ValueError(empty_message)
+        atomic_write_text(pair['txt'], text + "\n")
+
+    # nowe nazwy własne oznaczają konieczność wyszukania nowych ramek na skanie
+    used_model = stats.get("model", model)
+    save_metadata(metadata_path(pair['txt']), entities=entities, coordinates=[],
+                  checksum=calculate_checksum(text), model=used_model)
+    return _with_fallback({"entities": sum(len(names) for names in entities.values())}, model, used_model)
+
+
+def copy_transcription(pair, source_pair):
+    """ transkrypcja duplikatu skanu skopiowana ze strony źródłowej bez wywołania modelu;
+        zwraca statystyki strony lub None, gdy strona źródłowa nie ma tekstu
+    """
+    text = read_text(source_pair['txt']).strip()
+    if not text:
+        return None
+    atomic_write_text(pair['txt'], text + "\n")
+    return {"copied_from": source_pair['name']}
+
+
+class DuplicatePages:
+    """ duplikaty skanów w serii ({nazwa: nazwa strony źródłowej}): transkrypcja jest kopiowana
+        ze strony źródłowej, a gdy źródło jest w tej samej serii - po jego zakończeniu
+    """
+    def __init__(self, file_pairs, duplicates, batch_names=()):
+        self.duplicates = duplicates or {}
+        self._pairs = {pair['name']: pair for pair in file_pairs}
+        batch_names = set(batch_names)
+        self._events = {}
+        self._failed = set()
+        for source in set(self.duplicates.values()):
+            event = asyncio.Event()
+            if source not in batch_names:
+                # źródło z transkrypcją sprzed serii
+                event.set()
+            self._events[source] = event
+
+
+    def source_done(self, name, success=True):
+        """ zakończenie przetwarzania strony (także nieudane lub pominięte) """
+        event = self._events.get(name)
+        if event is not None:
+            if not success:
+                self._failed.add(name)
+            event.set()
+
+
+    async def copy(self, pair):
+        """ kopia transkrypcji dla duplikatu; None - strona nie jest duplikatem albo strona
+            źródłowa nie ma transkrypcji (strona jest wtedy wysyłana do modelu)
+        """
+        source = self.duplicates.get(pair['name'])
+        if source is None:
+            return None
+        await self._events[source].wait()
+        if source in self._failed:
+            return None
+        return copy_transcription(pair, self._pairs[source])
+
+
+async def ner_page(engine, pair, force=False, usage_callback=None):
+    """ nazwy własne strony zapisane w metadanych (wywołanie modelu tylko wtedy,
+        gdy tekst zmienił się od poprzedniej analizy lub force=True)
+    """
+    text = read_text(pair['txt']).strip()
+    if not text:
+        return None
+
+    checksum = calculate_checksum(text)
+    json_path = metadata_path(pair['txt'])
+    metadata = _metadata(json_path)
+    if not force and metadata.get("checksum") == checksum and metadata.get("entities"):
+        return metadata["entities"]
+
+    entities = await engine.extract_entities(text, usage_callback=usage_callback)
+    if entities:
+        # nowe nazwy własne oznaczają konieczność wyszukania nowych ramek na skanie
+        save_metadata(json_path, entities=entities, coordinates=[], checksum=checksum)
+    return entities
+
+
+async def box_page(engine, pair, force=False, usage_callback=None):
+    """ ramki nazw własnych na skanie zapisane w metadanych (wymaga aktualnych wyników NER) """
+    text = read_text(pair['txt']).strip()
+    if not text:
+        return None
+
+    checksum = calculate_checksum(text)
+    json_path = metadata_path(pair['txt'])
+    metadata = _metadata(json_path)
+    if metadata.get("checksum") != checksum or not metadata.get("entities"):
+        return None
+    if not force and "coordinates" in metadata:
+        return metadata["coordinates"]
+
+    coordinates = await engine.locate_entities(pair['img'], metadata["entities"],
+                                               usage_callback=usage_callback)
+    if coordinates is not None:
+        save_metadata(json_path, coordinates=coordinates, checksum=checksum)
+    return coordinates
+
+
+async def synthesize_audio(engine, text, mp3_path, json_path, force=False, usage_callback=None,
+                           on_generate=None):
+    """ plik MP3 z odczytem tekstu; generowany tylko wtedy, gdy brak pliku lub tekst się zmienił
+        (suma kontrolna w metadanych); on_generate() - przed wywołaniem modelu
+    """
+    checksum = calculate_checksum(text)
+
+    # sprawdzanie czy plik MP3 istnieje i czy suma kontrolna się zgadza
+    if not force and os.path.exists(mp3_path) and _metadata(json_path).get("tts_checksum") == checksum:
+        return mp3_path, False
+
+    if on_generate:
+        on_generate()
+    data = await engine.synthesize_speech(text, usage_callback=usage_callback)
+    await asyncio.to_thread(save_tts_audio, data, mp3_path)
+
+    # zapis nowej sumy kontrolnej audio w JSON
+    save_metadata(json_path, tts_checksum=checksum)
+    return mp3_path, True
+
+
+async def tts_page(engine, pair, force=False, usage_callback=None):
+    """ plik MP3 z odczytem transkrypcji strony """
+    text = read_text(pair['txt']).strip()
+    if not text:
+        return None
+    mp3_path, _ = await synthesize_audio(engine, text, audio_path(pair['img']),
+                                         metadata_path(pair['txt']), force, usage_callback)
+    return mp3_path
@@ -0,0 +1,636 @@
+""" kontrola limitów zapytań do Gemini API: limity RPM/TPM, ponawianie z opóźnieniem,
+    adaptacyjna liczba równoległych zapytań i priorytety (zapytania z edytora przed serią)
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import random
+import re
+import time
+import httpx
+from collections import deque
+from google.genai import errors
+from gemini_client import HAS_AIOHTTP
+
+if HAS_AIOHTTP:
+    import aiohttp
+
+
+# domyślne limity (zapytania i tokeny wejściowe na minutę), nadpisywane przez 'rate_limits' w config.json
+DEFAULT_RATE_LIMITS = {
+    "gemini-3-pro-preview": {"rpm": 25, "tpm": 1_000_000},
+    "gemini-3-flash-preview": {"rpm": 1000, "tpm": 1_000_000},
+    "gemini-2.5-pro": {"rpm": 150, "tpm": 2_000_000},
+    "gemini-3-pro-image-preview": {"rpm": 20, "tpm": 100_000},
+    "gemini-flash-latest": {"rpm": 1000, "tpm": 1_000_000},
+    "gemini-2.5-flash-preview-tts": {"rpm": 10, "tpm": 10_000},
+}
+FALLBACK_RATE_LIMIT = {"rpm": 60, "tpm": 1_000_000}
+
+# maksymalny czas oczekiwania na odpowiedź (s) według rodzaju operacji, nadpisywany przez
+# 'request_timeouts' w config.json; w wywołaniach strumieniowych - czas oczekiwania na kolejny
+# fragment odpowiedzi; 0 - bez limitu
+DEFAULT_REQUEST_TIMEOUTS = {
+    "transcription": 600,
+    "verify": 600,
+    "ner": 300,
+    "box": 300,
+    "tts": 300,
+    "nominative": 120,
+    "default": 300,
+}
+
+# łańcuchy modeli zastępczych według rodzaju operacji, ustawiane przez 'model_fallbacks'
+# w config.json (domyślnie brak): przy utrzymującym się przeciążeniu modelu lub braku
+# odpowiedzi zapytanie przejmuje kolejny model łańcucha, np.
+# {"transcription": ["gemini-3-pro-preview", "gemini-2.5-pro"]}; łańcuch zaczyna się od modelu
+# wybranego dla zapytania, model spoza łańcucha nie ma modeli zastępczych
+DEFAULT_MODEL_FALLBACKS = {}
+
+# czas (s), przez który przeciążony model jest pomijany w łańcuchu modeli zastępczych
+FAILOVER_COOLDOWN = 60
+# liczba ponowień zapytania do wybranego modelu przed przejęciem go przez model zastępczy
+FAILOVER_AFTER_RETRIES = 1
+
+# klasy modeli według oznaczenia w nazwie; przy włączonym 'model_fallback_no_downgrade'
+# model zastępczy nie może należeć do niższej klasy niż model wybrany dla zapytania
+# (np. przez reguły modelu strony lub transkrypcję dwuetapową)
+MODEL_TIERS = (("lite", 0), ("flash", 1), ("pro", 2))
+
+# kody HTTP, po których zapytanie jest ponawiane
+THROTTLE_CODES = (429, 503)
+RETRY_CODES = (429, 500, 502, 503, 504)
+# kody HTTP przeciążenia lub awarii modelu, po których zapytanie przejmuje model zastępczy
+FAILOVER_CODES = (500, 503, 504)
+# brak połączenia z serwerem API jest ponawiany tylko raz, po krótkiej przerwie
+# (operację od razu przejmuje kolejka operacji bez połączenia)
+CONNECT_RETRIES = 1
+
+# błędy sieci obu transportów google-genai (httpx lub aiohttp, gdy jest zainstalowany):
+# wszystkie są ponawiane, błędy nawiązania połączenia tylko raz (patrz CONNECT_RETRIES)
+NETWORK_ERRORS = (httpx.TransportError,)
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# utrata połączenia (błędy sieci bez przekroczenia czasu odpowiedzi serwera)
+OFFLINE_ERRORS = (httpx.NetworkError, httpx.ConnectTimeout)
+if HAS_AIOHTTP:
+    # ClientConnectionError obejmuje ClientOSError i ServerDisconnectedError
+    NETWORK_ERRORS += (aiohttp.ClientConnectionError,)
+    CONNECT_ERRORS += (aiohttp.ClientConnectorError,)
+    if hasattr(aiohttp, "ConnectionTimeoutError"):
+        CONNECT_ERRORS += (aiohttp.ConnectionTimeoutError,)
+    OFFLINE_ERRORS += (aiohttp.ClientConnectionError,)
+CONNECT_RETRY_DELAY = 1.0
+# kody HTTP błędów klucza API (klucz nieprawidłowy, wyłączony lub bez dostępu)
+AUTH_CODES = (401, 403)
+
+# czas wstrzymania klucza, który wyczerpał dzienny limit modelu (s)
+QUOTA_QUARANTINE = 3600
+
+# szacunkowa liczba tokenów obrazu przy MEDIA_RESOLUTION_HIGH
+IMAGE_TOKENS = 1120
+
+# klasy priorytetu zapytań (mniejsza wartość - obsługa w pierwszej kolejności)
+PRIORITY_INTERACTIVE = 0   # operacje na stronie wyświetlanej w edytorze
+PRIORITY_BATCH = 1         # strony przetwarzane w tle (seria, korpus)
+
+# priorytet bieżącego zadania asyncio (dziedziczony przez zadania podrzędne)
+request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+
+def set_request_priority(priority):
+    """ ustawienie priorytetu zapytań dla bieżącego zadania i zadań przez nie tworzonych """
+    request_priority.set(priority)
+
+
+def estimate_request_tokens(contents):
+    """ przybliżona liczba tokenów wejściowych zapytania (4 znaki na token, stała wartość dla obrazu) """
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_request_tokens(item) for item in contents)
+
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return estimate_request_tokens(parts)
+
+    if getattr(contents, "inline_data", None) is not None:
+        return IMAGE_TOKENS
+    return estimate_request_tokens(getattr(contents, "text", None))
+
+
+def error_code(error):
+    """ kod HTTP błędu API (None dla błędów sieci) """
+    return getattr(error, "code", None) if isinstance(error, errors.APIError) else None
+
+
+def is_retryable(error):
+    """ czy błąd jest przejściowy (limit, przeciążenie, problem z siecią) """
+    if isinstance(error, errors.APIError):
+        return error_code(error) in RETRY_CODES
+    return isinstance(error, NETWORK_ERRORS + (asyncio.TimeoutError,))
+
+
+def is_connect_error(error):
+    """ czy nie udało się nawiązać połączenia z serwerem API (brak sieci, serwer nieosiągalny) """
+    return isinstance(error, CONNECT_ERRORS)
+
+
+def is_offline_error(error):
+    """ czy błąd oznacza brak połączenia z API (sieć niedostępna, serwer nieosiągalny,
+        zerwane połączenie); brak odpowiedzi serwera w czasie nie jest brakiem połączenia
+    """
+    if isinstance(error, CONNECT_ERRORS):
+        return True
+    if HAS_AIOHTTP and isinstance(error, aiohttp.ServerTimeoutError):
+        return False
+    return isinstance(error, OFFLINE_ERRORS)
+
+
+class RequestTimeout(asyncio.TimeoutError):
+    """ brak odpowiedzi modelu w czasie przewidzianym dla operacji (błąd przejściowy, ponawiany) """
+    def __init__(self, model, timeout):
+        super().__init__(f"{model}: brak odpowiedzi w ciągu {timeout:g} s")
+        self.model = model
+        self.timeout = timeout
+
+
+async def wait_with_timeout(awaitable, model, timeout=None):
+    """ oczekiwanie na wynik z limitem czasu (None lub 0 - bez limitu), po jego przekroczeniu
+        zapytanie jest przerywane i zgłaszany jest RequestTimeout
+    """
+    if not timeout:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise RequestTimeout(model, timeout) from None
+
+
+def is_throttle(error):
+    """ czy błąd oznacza przekroczenie limitu lub przeciążenie serwera """
+    return error_code(error) in THROTTLE_CODES
+
+
+def model_tier(model):
+    """ klasa modelu (lite < flash < pro) lub None dla nazwy bez oznaczenia klasy """
+    for marker, tier in MODEL_TIERS:
+        if marker in model:
+            return tier
+    return None
+
+
+def is_failover_error(error):
+    """ czy błąd oznacza przeciążenie modelu lub brak odpowiedzi (zapytanie przejmuje model zastępczy) """
+    return error_code(error) in FAILOVER_CODES or isinstance(error, RequestTimeout)
+
+
+def is_auth_error(error):
+    """ czy błąd dotyczy klucza API (nieprawidłowy, wyłączony, bez dostępu do API) """
+    code = error_code(error)
+    return code in AUTH_CODES or (code == 400 and "API_KEY_INVALID" in str(error))
+
+
+def is_daily_quota(error):
+    """ czy błąd 429 oznacza wyczerpanie dziennego limitu zapytań (nie minie po kilku sekundach) """
+    return error_code(error) == 429 and "PerDay" in str(error)
+
+
+def _parse_duration(value):
+    """ '17s', '1.5s' lub liczba sekund -> float """
+    if value is None:
+        return None
+    match = re.match(r"^\s*([\d.]+)\s*s?\s*$", str(value))
+    return float(match.group(1)) if match else None
+
+
+def retry_hint(error):
+    """ sugerowany przez serwer czas oczekiwania (RetryInfo.retryDelay lub nagłówek Retry-After) """
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for item in details.get("error", {}).get("details", []) or []:
+            if isinstance(item, dict) and "retryDelay" in item:
+                delay = _parse_duration(item["retryDelay"])
+                if delay is not None:
+                    return delay
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        return _parse_duration(headers.get("retry-after"))
+    return None
+
+
+class PriorityLock:
+    """ blokada przekazywana kolejnym oczekującym według priorytetu,
+        a w ramach jednego priorytetu w kolejności zgłoszeń
+    """
+    def __init__(self):
+        self._locked = False
+        self._waiters = []
+        self._counter = itertools.count()
+
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        if not self._locked and not self._waiters:
+            self._locked = True
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # blokada przekazana tuż przed anulowaniem - oddanie jej kolejnemu zadaniu
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+
+    def release(self):
+        # przekazanie blokady bez zwalniania (anulowani oczekujący są pomijani)
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._locked = False
+
+
+class TokenBucket:
+    """ wiadro tokenów uzupełniane w sposób ciągły, pojemność = limit na minutę """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def delay_for(self, amount):
+        """ czas (s) do chwili, w której będzie dostępne 'amount' tokenów """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+    def consume(self, amount):
+        """ pobranie tokenów (wartość ujemna zwraca nadpłatę, stan może być ujemny - dług) """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class LatencyTracker:
+    """ czasy do pierwszego fragmentu odpowiedzi (TTFT) ostatnich zapytań strumieniowych
+        każdego modelu, podstawa opóźnienia zapytania zapasowego (hedging)
+    """
+    def __init__(self, window=50, percentile=0.9, min_samples=5, initial_delay=30.0, min_delay=3.0):
+        self.window = window
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self._samples = {}
+
+
+    def record(self, model, ttft):
+        """ zapis czasu do pierwszego fragmentu odpowiedzi (s) """
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(ttft)
+
+
+    def threshold(self, model):
+        """ czas oczekiwania na pierwszy fragment, po którym wysyłane jest zapytanie zapasowe:
+            percentyl ostatnich pomiarów (nie mniej niż min_delay), a przy zbyt małej liczbie
+            pomiarów - initial_delay
+        """
+        samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        return max(self.min_delay, samples[index])
+
+
+class AdaptiveLimiter:
+    """ limit równoczesnych zapytań: zmniejszany o połowę przy utrzymującym się przeciążeniu,
+        zwiększany o 1 po serii udanych zapytań; zwolnione miejsce otrzymuje najpierw
+        oczekujące zapytanie o wyższym priorytecie
+    """
+    def __init__(self, limit, min_limit=1, throttle_threshold=3, throttle_window=30.0,
+                 increase_after=20):
+        self.max_limit = max(1, limit)
+        self.limit = self.max_limit
+        self.min_limit = min_limit
+        self.in_use = 0
+        self.throttle_threshold = throttle_threshold
+        self.throttle_window = throttle_window
+        self.increase_after = increase_after
+        self._throttles = []
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = None
+        # liczba oczekujących zapytań w każdej klasie priorytetu
+        self._waiting = {}
+
+
+    def _get_condition(self):
+        # warunek tworzony leniwie w pętli zdarzeń silnika
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+
+    def _can_enter(self, priority):
+        if self.in_use >= self.limit:
+            return False
+        # pierwszeństwo dla oczekujących zapytań o wyższym priorytecie
+        return not any(count for waiting, count in self._waiting.items() if waiting < priority)
+
+
+    async def __aenter__(self):
+        priority = request_priority.get()
+        condition = self._get_condition()
+        async with condition:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                await condition.wait_for(lambda: self._can_enter(priority))
+            finally:
+                self._waiting[priority] -= 1
+                # zapytania o niższym priorytecie mogą teraz zająć pozostałe miejsca
+                condition.notify_all()
+            self.in_use += 1
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        condition = self._get_condition()
+        async with condition:
+            self.in_use -= 1
+            condition.notify_all()
+
+
+    def on_success(self):
+        """ udane zapytanie - po serii sukcesów limit rośnie do wartości początkowej """
+        self._successes += 1
+        if self._successes >= self.increase_after and self.limit < self.max_limit:
+            self._successes = 0
+            self.limit += 1
+            self._notify()
+
+
+    def on_throttle(self):
+        """ odpowiedź 429/503 - przy kilku w krótkim czasie limit jest zmniejszany o połowę """
+        now = time.monotonic()
+        self._successes = 0
+        self._throttles = [t for t in self._throttles if now - t < self.throttle_window]
+        self._throttles.append(now)
+
+        if (len(self._throttles) >= self.throttle_threshold
+                and now - self._last_decrease >= self.throttle_window):
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._last_decrease = now
+            self._throttles = []
+            print(f"Gemini API: przeciążenie, limit równoległych zapytań: {self.limit}")
+
+
+    def _notify(self):
+        if self._condition is None:
+            return
+
+        async def _wake():
+            async with self._condition:
+                self._condition.notify_all()
+
+        asyncio.ensure_future(_wake())
+
+
+class RateController:
+    """ centralna kontrola zapytań: limity RPM/TPM dla każdego modelu, ponawianie
+        z wykładniczym opóźnieniem i losowym rozrzutem, adaptacyjna równoległość;
+        przy puli kluczy API limity i blokady są prowadzone osobno dla każdego klucza,
+        zapytanie trafia do klucza, który najwcześniej ma wolny limit, a klucze
+        odrzucane przez API (błąd klucza, dzienny limit) są wyłączane z puli;
+        przeciążone modele są na pewien czas pomijane w łańcuchach modeli zastępczych
+    """
+    def __init__(self, limits=None, max_concurrency=16, max_retries=5, base_delay=2.0, max_delay=60.0,
+                 timeouts=None, fallbacks=None, failover_cooldown=FAILOVER_COOLDOWN, no_downgrade=False):
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.timeouts = dict(DEFAULT_REQUEST_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.fallbacks = dict(DEFAULT_MODEL_FALLBACKS)
+        if fallbacks is not None:
+            self.fallbacks.update(fallbacks)
+        self.failover_cooldown = failover_cooldown
+        # pomijanie w łańcuchu modeli zastępczych niższej klasy niż model zapytania
+        self.no_downgrade = no_downgrade
+        # łańcuchy (model, operacja), dla których zgłoszono pominięte modele
+        self._downgrade_warned = set()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self._buckets = {}
+        self._locks = {}
+        self._blocked_until = {}
+        # klucze wyłączone z puli: nazwa -> błąd API
+        self._quarantined = {}
+        # przeciążone modele: nazwa -> czas (monotonic), do którego są pomijane
+        self._overloaded = {}
+
+
+    def _model_buckets(self, model, key=None):
+        """ wiadra RPM i TPM modelu dla klucza API """
+        if (model, key) not in self._buckets:
+            limit = self.limits.get(model, FALLBACK_RATE_LIMIT)
+            self._buckets[(model, key)] = (TokenBucket(limit.get("rpm", FALLBACK_RATE_LIMIT["rpm"])),
+                                           TokenBucket(limit.get("tpm", FALLBACK_RATE_LIMIT["tpm"])))
+        return self._buckets[(model, key)]
+
+
+    def _model_lock(self, model):
+        """ blokada kolejki zapytań do modelu (wspólna dla wszystkich kluczy) """
+        if model not in self._locks:
+            self._locks[model] = PriorityLock()
+        return self._locks[model]
+
+
+    def usable_keys(self, keys):
+        """ klucze puli, które nie zostały wyłączone po błędzie klucza API """
+        return [key for key in keys if key not in self._quarantined]
+
+
+    def timeout(self, operation=None):
+        """ limit czasu odpowiedzi dla rodzaju operacji (s) lub None - bez limitu """
+        value = self.timeouts.get(operation, self.timeouts.get("default"))
+        return float(value) if value else None
+
+
+    def model_chain(self, model, operation=None):
+        """ kolejne modele, które mogą obsłużyć zapytanie: model wybrany dla zapytania i dalsza
+            część łańcucha modeli zastępczych operacji (przy no_downgrade bez modeli niższej
+            klasy, patrz MODEL_TIERS); modele w okresie przeciążenia są pomijane (ostatni model
+            łańcucha jest używany zawsze)
+        """
+        chain = list(self.fallbacks.get(operation) or [])
+        chain = chain[chain.index(model):] if model in chain else [model]
+        if self.no_downgrade:
+            chain = self._without_downgrades(chain, operation)
+        now = time.monotonic()
+        available = [name for name in chain[:-1] if self._overloaded.get(name, 0.0) <= now]
+        return available + chain[-1:]
+
+
+    def _without_downgrades(self, chain, operation):
+        """ łańcuch bez modeli niższej klasy niż pierwszy model (modele o nieznanej klasie
+            są zachowywane); pominięte modele są zgłaszane raz dla łańcucha
+        """
+        tier = model_tier(chain[0])
+        kept = [chain[0]] + [name for name in chain[1:]
+                             if tier is None or model_tier(name) is None or model_tier(name) >= tier]
+        if len(kept) < len(chain) and (chain[0], operation) not in self._downgrade_warned:
+            self._downgrade_warned.add((chain[0], operation))
+            skipped = ", ".join(name for name in chain if name not in kept)
+            print(f"model_fallbacks ({operation}): {skipped} - niższa klasa niż {chain[0]}, "
+                  f"pominięte (model_fallback_no_downgrade)")
+        return kept
+
+
+    def mark_overloaded(self, model, error, fallback):
+        """ pominięcie przeciążonego modelu w łańcuchach modeli zastępczych przez failover_cooldown s """
+        until = time.monotonic() + self.failover_cooldown
+        if self._overloaded.get(model, 0.0) < time.monotonic():
+            print(f"Gemini API: {model} - błąd {error_code(error) or type(error).__name__}, "
+                  f"zapytania przejmuje {fallback} na {self.failover_cooldown:g} s")
+        self._overloaded[model] = until
+
+
+    def _key_delay(self, model, key, tokens):
+        """ czas (s) do chwili, w której klucz będzie mógł obsłużyć zapytanie do modelu """
+        rpm, tpm = self._model_buckets(model, key)
+        blocked = self._blocked_until.get((model, key), 0.0) - time.monotonic()
+        return max(blocked, rpm.delay_for(1), tpm.delay_for(tokens))
+
+
+    async def acquire(self, model, tokens=0, keys=(None,)):
+        """ oczekiwanie na dostępność limitu zapytań i tokenów dla modelu (kolejka do limitu
+            modelu uporządkowana według priorytetu zapytań); zwraca nazwę klucza API z puli
+            'keys', który obsłuży zapytanie - przy równym czasie oczekiwania klucz z największym
+            zapasem limitu zapytań
+        """
+        lock = self._model_lock(model)
+        await lock.acquire(request_priority.get())
+        try:
+            while True:
+                usable = self.usable_keys(keys)
+                if not usable:
+                    # wszystkie klucze odrzucone przez API - błąd ostatniego z nich
+                    raise self._quarantined[keys[-1]]
+                delays = {key: self._key_delay(model, key, tokens) for key in usable}
+                key = min(usable, key=lambda name: (delays[name], -self._model_buckets(model, name)[0].tokens))
+                if delays[key] <= 0:
+                    break
+                await asyncio.sleep(delays[key])
+            rpm, tpm = self._model_buckets(model, key)
+            rpm.consume(1)
+            tpm.consume(tokens)
+            return key
+        finally:
+            lock.release()
+
+
+    def record_usage(self, model, estimated_tokens, usage_metadata, key=None):
+        """ korekta wiadra TPM o różnicę między szacunkiem a rzeczywistym zużyciem """
+        actual = getattr(usage_metadata, "prompt_token_count", None) if usage_metadata else None
+        if actual is not None:
+            self._model_buckets(model, key)[1].consume(actual - estimated_tokens)
+
+
+    def _quarantine(self, model, key, error, keys):
+        """ wyłączenie klucza po błędzie klucza API lub wyczerpaniu dziennego limitu modelu;
+            zwraca True, jeśli w puli zostały inne klucze, do których można ponowić zapytanie
+        """
+        if is_auth_error(error):
+            self._quarantined[key] = error
+            print(f"Gemini API: klucz {key} wyłączony z puli, błąd {error_code(error)}")
+        else:
+            self._blocked_until[(model, key)] = time.monotonic() + QUOTA_QUARANTINE
+            print(f"Gemini API: klucz {key}, {model} - wyczerpany dzienny limit, "
+                  f"klucz wstrzymany na {QUOTA_QUARANTINE // 60} min")
+        return any(other != key for other in self.usable_keys(keys))
+
+
+    def retry_delay(self, model, error, attempt, key=None, keys=(None,), failover=False):
+        """ czas oczekiwania przed kolejną próbą lub None, jeśli zapytania nie należy ponawiać
+            (key - klucz API, który zwrócił błąd, keys - pula kluczy zapytania, failover - zapytanie
+            ma model zastępczy, który przejmuje je, gdy przeciążenie modelu lub brak odpowiedzi
+            powtórzy się po FAILOVER_AFTER_RETRIES ponowieniach)
+        """
+        if attempt >= self.max_retries:
+            return None
+        if failover and is_failover_error(error) and attempt >= FAILOVER_AFTER_RETRIES:
+            return None
+        if is_connect_error(error):
+            if attempt >= CONNECT_RETRIES:
+                return None
+            print(f"Gemini API: {model}, brak połączenia ({type(error).__name__}), "
+                  f"ponowienie za {CONNECT_RETRY_DELAY:g}s")
+            return CONNECT_RETRY_DELAY
+        if len(keys) > 1 and (is_auth_error(error) or is_daily_quota(error)):
+            # ponowienie od razu z innym kluczem
+            return 0.0 if self._quarantine(model, key, error, keys) else None
+        if not is_retryable(error):
+            return None
+
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+
+        hint = retry_hint(error)
+        if hint is not None:
+            delay = hint + random.uniform(0, 1.0)
+
+        if is_throttle(error):
+            self.limiter.on_throttle()
+            # wstrzymanie kolejnych zapytań do tego modelu przez ten klucz na czas wskazany
+            # przez serwer; oczekiwanie odmierza acquire, inny klucz puli może przyjąć zapytanie od razu
+            until = time.monotonic() + delay
+            self._blocked_until[(model, key)] = max(self._blocked_until.get((model, key), 0.0), until)
+
+        source = f"{model} (klucz {key})" if len(keys) > 1 else model
+        print(f"Gemini API: {source}, błąd {error_code(error) or type(error).__name__}, "
+              f"ponowienie {attempt + 1}/{self.max_retries} za {delay:.1f}s")
+        return 0.0 if is_throttle(error) else delay
+
+
+    async def call(self, model, request, tokens=0, timeout=None, keys=(None,), failover=False):
+        """ wywołanie request(klucz) (korutyna) z kontrolą limitów i ponawianiem, zwraca
+            (wynik, nazwa klucza API); timeout - limit czasu każdej próby (s), po jego
+            przekroczeniu zapytanie jest przerywane i ponawiane; keys - pula kluczy API;
+            failover - błąd przeciążenia lub brak odpowiedzi jest po FAILOVER_AFTER_RETRIES
+            ponowieniach zgłaszany bez dalszych prób (zapytanie przejmuje model zastępczy)
+        """
+        attempt = 0
+        while True:
+            key = await self.acquire(model, tokens, keys)
+            try:
+                async with self.limiter:
+                    result = await wait_with_timeout(request(key), model, timeout)
+                self.limiter.on_success()
+                return result, key
+            except Exception as e:
+                delay = self.retry_delay(model, e, attempt, key, keys, failover)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
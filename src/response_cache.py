@@ -0,0 +1,142 @@
+""" lokalna pamięć podręczna odpowiedzi modeli, adresowana skrótem danych wejściowych """
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def file_digest(path):
+    """ skrót SHA-256 zawartości pliku """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """ klucz wpisu: skrót SHA-256 wszystkich danych wejściowych zapytania
+        (operacja, model, konfiguracja, prompt, skróty obrazów, tekst)
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """ odpowiedzi zapisane jako pliki JSON nazwane kluczem, z limitem rozmiaru
+        i usuwaniem najdawniej używanych wpisów (LRU)
+    """
+    def __init__(self, folder, max_bytes=DEFAULT_CACHE_MAX_BYTES, enabled=True):
+        self.folder = str(folder)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # klucz -> rozmiar pliku, od najdawniej używanego
+        self._index = OrderedDict()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            self._load_index()
+
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".json")
+
+
+    def _load_index(self):
+        """ odtworzenie indeksu z plików (kolejność według czasu ostatniego użycia) """
+        if not os.path.isdir(self.folder):
+            return
+
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total += size
+
+
+    def get(self, key):
+        """ zapisana odpowiedź lub None """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = json.load(f)["value"]
+                # czas modyfikacji pliku = czas ostatniego użycia (po ponownym uruchomieniu)
+                os.utime(path)
+            except (OSError, ValueError, KeyError):
+                self._forget(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def put(self, key, value):
+        """ zapis odpowiedzi i usunięcie najstarszych wpisów ponad limit rozmiaru """
+        if not self.enabled or value is None:
+            return
+
+        data = json.dumps({"value": value}, ensure_ascii=False)
+        with self._lock:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                path = self._path(key)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Błąd zapisu pamięci podręcznej: {e}")
+                return
+
+            self._forget(key, remove=False)
+            size = len(data.encode('utf-8'))
+            self._index[key] = size
+            self._total += size
+            self._evict()
+
+
+    def _forget(self, key, remove=True):
+        """ usunięcie wpisu z indeksu (i opcjonalnie pliku) """
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._total -= size
+        if remove:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+    def _evict(self):
+        """ usuwanie najdawniej używanych wpisów do osiągnięcia limitu """
+        while self._total > self.max_bytes and self._index:
+            key = next(iter(self._index))
+            self._forget(key)
+
+
+    def clear(self):
+        """ usunięcie wszystkich wpisów """
+        with self._lock:
+            for key in list(self._index):
+                self._forget(key)
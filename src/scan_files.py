@@ -0,0 +1,92 @@
+""" pliki skanów, transkrypcji i metadanych w katalogu (bez zależności od interfejsu) """
+import os
+import json
+import hashlib
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_file_pairs(folder):
+    """ lista stron katalogu: skan, plik transkrypcji i nazwa (posortowane według nazwy skanu) """
+    images = [f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    images.sort()
+
+    file_pairs = []
+    for img in images:
+        base = os.path.splitext(img)[0]
+        file_pairs.append({
+            'img': os.path.join(folder, img),
+            'txt': os.path.join(folder, base + ".txt"),
+            'name': base
+        })
+    return file_pairs
+
+
+def calculate_checksum(text):
+    """ suma kontrolna SHA-256 dla tekstu transkrypcji """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def metadata_path(txt_path):
+    """ ścieżka do pliku .json z metadanymi strony (NER, ramki, audio) """
+    return os.path.splitext(txt_path)[0] + ".json"
+
+
+def audio_path(img_path):
+    """ ścieżka do pliku .mp3 z odczytem strony """
+    return os.path.splitext(img_path)[0] + ".mp3"
+
+
+def read_text(txt_path):
+    """ treść pliku transkrypcji lub pusty tekst, jeśli plik nie istnieje """
+    if not os.path.exists(txt_path):
+        return ""
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def load_metadata(json_path):
+    """ metadane strony z pliku .json (pusty słownik, jeśli plik nie istnieje) """
+    if not json_path or not os.path.exists(json_path):
+        return {}
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_metadata(json_path, entities=None, coordinates=None, checksum=None, tts_checksum=None,
+                  tiles=None, model=None, scan_type=None):
+    """ zapis wyników NER, współrzędnych i sum kontrolnych do pliku .json,
+        bez utraty pól, które nie zostały przekazane (tiles - układ pasów transkrypcji
+        dużego skanu lub False, gdy strona ma być transkrybowana w całości, model - model
+        ostatniej transkrypcji, scan_type - rozpoznany rodzaj pisma na skanie)
+    """
+    # jeśli plik istnieje jest wczytywany, aby nie stracić danych
+    cache_data = {}
+    try:
+        cache_data = load_metadata(json_path)
+    except Exception as e:
+        print(e)
+
+    # aktualizacja pól, które zostały przekazane
+    if checksum:
+        cache_data["checksum"] = checksum
+    if entities:
+        cache_data["entities"] = entities
+    if coordinates is not None:
+        # usuwanie jeżeli przekazano pustą listę (czyli odświeżono NER)
+        if coordinates == []:
+            cache_data.pop("coordinates", None)
+        else:
+            cache_data["coordinates"] = coordinates
+    if tts_checksum:
+        cache_data["tts_checksum"] = tts_checksum
+    if tiles is not None:
+        cache_data["tiles"] = tiles
+    if model:
+        cache_data["model"] = model
+    if scan_type:
+        cache_data["scan_type"] = scan_type
+
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(cache_data, f, ensure_ascii=False, indent=4)
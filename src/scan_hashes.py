@@ -0,0 +1,109 @@
+""" wykrywanie powtórzonych skanów (ponowne zdjęcie strony, wersja kolorowa i w skali szarości,
+    inne kadrowanie) na podstawie skrótu percepcyjnego obrazu (dHash)
+"""
+import os
+import json
+import asyncio
+from batch_journal import atomic_write_text
+
+
+HASH_FILE = "scan_hashes.json"
+HASH_SIZE = 8                   # skrót 8x8 = 64 bity
+DEFAULT_DUPLICATE_THRESHOLD = 6 # maksymalna liczba różnych bitów dla duplikatu
+
+
+def image_hash(path, size=HASH_SIZE):
+    """ skrót dHash obrazu (liczba szesnastkowa): kierunek zmiany jasności między sąsiednimi
+        pikselami zmniejszonego obrazu w skali szarości; wykonywany w procesie roboczym
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # dekodowanie JPEG od razu w zmniejszonej rozdzielczości
+        img.draft("L", (size * 16, size * 16))
+        small = img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{size * size // 4}x}"
+
+
+def hash_distance(hash_a, hash_b):
+    """ liczba różnych bitów dwóch skrótów """
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def _load_hashes(folder):
+    path = os.path.join(folder, HASH_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Błąd odczytu {HASH_FILE}: {e}")
+        return {}
+
+
+async def build_hash_index(folder, file_pairs, images):
+    """ skróty obrazów katalogu {nazwa: skrót}; obliczane równolegle w puli procesów
+        przygotowania obrazów, zapamiętywane w pliku katalogu i liczone ponownie tylko
+        dla plików zmienionych od poprzedniego obliczenia (czas modyfikacji, rozmiar)
+    """
+    cached = _load_hashes(folder)
+    entries = {}
+    missing = []
+    for pair in file_pairs:
+        try:
+            stat = os.stat(pair['img'])
+        except OSError:
+            continue
+        entry = cached.get(pair['name'])
+        if entry and entry.get("mtime") == stat.st_mtime and entry.get("size") == stat.st_size:
+            entries[pair['name']] = entry
+        else:
+            missing.append((pair, stat))
+
+    results = await asyncio.gather(*(images.run(image_hash, pair['img']) for pair, _ in missing),
+                                   return_exceptions=True)
+    for (pair, stat), result in zip(missing, results):
+        if isinstance(result, Exception):
+            print(f"{pair['name']}: {result}")
+            continue
+        entries[pair['name']] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": result}
+
+    if missing or len(entries) != len(cached):
+        try:
+            atomic_write_text(os.path.join(folder, HASH_FILE), json.dumps(entries, indent=1))
+        except OSError as e:
+            print(f"Błąd zapisu {HASH_FILE}: {e}")
+
+    return {name: entry["hash"] for name, entry in entries.items()}
+
+
+def find_duplicates(file_pairs, hashes, selected, threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """ duplikaty stron wybranych do transkrypcji: {nazwa: nazwa strony źródłowej};
+        źródłem jest strona z istniejącą transkrypcją lub wcześniejsza wybrana strona,
+        która sama nie jest duplikatem (jej tekst zostanie skopiowany po transkrypcji)
+    """
+    selected = set(selected)
+    sources = [pair['name'] for pair in file_pairs
+               if pair['name'] not in selected and pair['name'] in hashes
+               and os.path.exists(pair['txt']) and os.path.getsize(pair['txt']) > 0]
+
+    duplicates = {}
+    for pair in file_pairs:
+        name = pair['name']
+        if name not in selected or name not in hashes:
+            continue
+        source = next((src for src in sources if hash_distance(hashes[src], hashes[name]) <= threshold), None)
+        if source:
+            duplicates[name] = source
+        else:
+            sources.append(name)
+    return duplicates
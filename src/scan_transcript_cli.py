@@ -0,0 +1,552 @@
+""" przetwarzanie katalogów ze skanami bez interfejsu graficznego (serwer, cron) """
+import os
+import sys
+import json
+import asyncio
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+from gemini_client import GeminiClientManager, parse_api_keys
+from gemini_engine import GeminiEngine, TRANSCRIPTION_MODEL
+from rate_control import RateController
+from image_prep import ImagePreprocessor, DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from response_cache import ResponseCache
+from context_cache import ContextCache, DEFAULT_CONTEXT_TTL, MIN_CONTEXT_TOKENS
+from batch_journal import BatchJournal
+from scan_files import list_file_pairs
+from usage_log import UsageLog
+from exporters import export_txt, export_docx, export_tei, collect_ner_records, write_ner_csv
+from pipeline import (transcribe_page, transcribe_ner_page, ner_page, box_page, tts_page, DuplicatePages,
+                      pack_small_pages, transcribe_pack, DEFAULT_PACK_SIZE, DEFAULT_PACK_MAX_PIXELS)
+from corpus import find_scan_folders, needs_transcription, CorpusQueue, run_corpus
+from cost_estimate import CostEstimator, BudgetGuard, transcription_tag
+from scan_hashes import build_hash_index, find_duplicates, DEFAULT_DUPLICATE_THRESHOLD
+from tiling import DEFAULT_TILE_MIN_PIXELS
+from model_routing import ModelRouter
+from cascade import cascade_page, DEFAULT_CASCADE_MODEL, DEFAULT_MARKER_DENSITY, DEFAULT_MIN_LINE_RATIO
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CONFIG_DIR = BASE_DIR / 'config'
+PROMPT_DIR = BASE_DIR / 'prompt'
+
+STAGES = ("transcribe", "ner", "box", "tts")
+EXPORTS = ("txt", "docx", "tei", "csv")
+EXPORT_EXTENSIONS = {"txt": ".txt", "docx": ".docx", "tei": ".xml", "csv": ".csv"}
+
+# kody wyjścia
+EXIT_OK = 0
+EXIT_PAGE_ERRORS = 1    # część stron zakończona błędem
+EXIT_CONFIG_ERROR = 2   # błędne argumenty, brak klucza API, promptu lub katalogu
+EXIT_BUDGET_REACHED = 3 # osiągnięto limit kosztu, pozostałe strony czekają na wznowienie
+EXIT_INTERRUPTED = 130  # przerwanie przez użytkownika (Ctrl+C)
+
+
+def load_config():
+    """ ustawienia z config/config.json (pusty słownik, jeśli plik nie istnieje) """
+    config_path = CONFIG_DIR / "config.json"
+    if not config_path.exists():
+        return {}
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_localization(lang):
+    """ teksty komunikatów w wybranym języku """
+    with open(CONFIG_DIR / "localization.json", 'r', encoding='utf-8') as f:
+        localization = json.load(f)
+    return localization.get(lang) or localization["PL"]
+
+
+def resolve_prompt(prompt):
+    """ ścieżka do pliku promptu: podana ścieżka lub nazwa pliku w katalogu prompt """
+    if not prompt:
+        return None
+    if os.path.exists(prompt):
+        return Path(prompt)
+    prompt_path = PROMPT_DIR / prompt
+    return prompt_path if prompt_path.exists() else None
+
+
+def create_engine(config, api_key):
+    """ silnik Gemini skonfigurowany tak samo jak w oknie aplikacji """
+    client_manager = GeminiClientManager(api_key, base_url=config.get("api_base_url") or None,
+                                         api_keys=parse_api_keys(config.get("api_keys"),
+                                                                 os.environ.get("GEMINI_API_KEYS")))
+    rate_controller = RateController(limits=config.get("rate_limits", {}),
+                                     max_concurrency=int(config.get("max_concurrency", 16)),
+                                     max_retries=int(config.get("max_retries", 5)),
+                                     timeouts=config.get("request_timeouts", {}),
+                                     fallbacks=config.get("model_fallbacks", {}),
+                                     no_downgrade=config.get("model_fallback_no_downgrade", False))
+    image_preprocessor = ImagePreprocessor(enabled=config.get("image_preprocess", True),
+                                           max_side=int(config.get("image_max_side", DEFAULT_MAX_SIDE)),
+                                           grayscale=config.get("image_grayscale", False),
+                                           quality=int(config.get("image_quality", DEFAULT_QUALITY)))
+    cache = ResponseCache(BASE_DIR / 'cache',
+                          max_bytes=int(config.get("response_cache_max_mb", 256)) * 1024 * 1024,
+                          enabled=config.get("response_cache", True))
+    context_cache = ContextCache(client_manager,
+                                 ttl=int(config.get("context_cache_ttl", DEFAULT_CONTEXT_TTL)),
+                                 min_tokens=int(config.get("context_cache_min_tokens", MIN_CONTEXT_TOKENS)),
+                                 enabled=config.get("context_cache", True))
+    return GeminiEngine(client_manager,
+                        rate_controller=rate_controller,
+                        image_preprocessor=image_preprocessor,
+                        response_cache=cache,
+                        context_cache=context_cache)
+
+
+def parse_list(value, allowed):
+    """ lista wartości rozdzielonych przecinkami (argparse) """
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    for item in items:
+        if item not in allowed:
+            raise argparse.ArgumentTypeError(f"'{item}' - allowed: {', '.join(allowed)}")
+    return items
+
+
+def build_parser():
+    """ argumenty wiersza poleceń """
+    parser = argparse.ArgumentParser(
+        description="Transcribe scans with Gemini without the graphical interface.")
+    parser.add_argument("folders", nargs="+",
+                        help="folders with scans (several folders are processed at the same time)")
+    parser.add_argument("-p", "--prompt",
+                        help="prompt file (path or file name in the prompt folder), "
+                             "default: default_prompt from config.json")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="process all subfolders with scans (corpus mode)")
+    parser.add_argument("-m", "--model",
+                        help="transcription model for all pages (default: model_routes from config.json, "
+                             f"pages matching no rule - {TRANSCRIPTION_MODEL})")
+    parser.add_argument("-c", "--concurrency", type=int, default=None,
+                        help="number of pages processed at the same time (default: batch_concurrency)")
+    parser.add_argument("-s", "--stages", default="transcribe",
+                        type=lambda value: parse_list(value, STAGES),
+                        help=f"comma separated stages: {', '.join(STAGES)} (default: transcribe)")
+    parser.add_argument("--combined", action="store_true", default=None,
+                        help="transcription and NER in one request (with --stages transcribe,ner, "
+                             "default: combined_ner from config.json)")
+    parser.add_argument("-e", "--export", default=[],
+                        type=lambda value: parse_list(value, EXPORTS),
+                        help=f"comma separated exports after processing: {', '.join(EXPORTS)}")
+    parser.add_argument("-o", "--output-dir",
+                        help="folder for exported files (default: the scans folder)")
+    parser.add_argument("-b", "--budget", type=float, default=None,
+                        help="cost limit of the run in USD, no new pages are started after it is reached "
+                             "(default: batch_budget from config.json, 0 - no limit)")
+    parser.add_argument("-d", "--dedupe", action="store_true",
+                        help="copy the transcription of an already transcribed scan to its duplicates "
+                             "(re-shoots, colour and grayscale versions) instead of calling the model")
+    parser.add_argument("--tile-min-pixels", type=int, default=None,
+                        help="scans with at least this many pixels are transcribed in overlapping strips "
+                             "(default: tile_min_pixels from config.json, 0 - only pages selected in the application)")
+    parser.add_argument("--pack", action="store_true", default=None,
+                        help="send several small scans (pack_max_pixels from config.json) in one request "
+                             "(default: pack_images from config.json)")
+    parser.add_argument("--cascade", action="store_true", default=None,
+                        help="transcribe with a fast model first and repeat uncertain pages with the model "
+                             "chosen for the page (default: cascade from config.json)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="process pages again even if results are up to date")
+    parser.add_argument("--api-key", help="Gemini API key (default: GEMINI_API_KEY or config.json)")
+    parser.add_argument("--lang", help="language of messages: PL or EN (default: current_lang)")
+    return parser
+
+
+class CliRunner:
+    """ przetwarzanie katalogów: etapy dla każdej strony, eksport po zakończeniu katalogu """
+    def __init__(self, engine, t, prompt_text, router, stages, exports, concurrency,
+                 output_dir=None, force=False, combined=False, prompt_name="", budget=None,
+                 duplicate_threshold=None, tile_min_pixels=None, pack_size=0, pack_max_pixels=0, cascade=None):
+        self.engine = engine
+        self.t = t
+        self.prompt_text = prompt_text
+        # wybór modelu transkrypcji dla strony
+        self.router = router
+        self.prompt_name = prompt_name
+        self.stages = stages
+        self.exports = exports
+        self.concurrency = max(1, concurrency)
+        self.output_dir = output_dir
+        self.force = force
+        # transkrypcja z nazwami własnymi w jednym zapytaniu (tylko gdy wybrano oba etapy)
+        self.combined = combined and "ner" in stages
+        # oznaczenie wpisów tokens.log z transkrypcją (szacowanie kosztu kolejnych uruchomień)
+        self.tag = transcription_tag(prompt_name, self.combined)
+        self.budget = BudgetGuard(budget)
+        self.estimate = {"pages": 0, "input": 0, "output": 0, "cost": 0.0}
+        # wykrywanie powtórzonych skanów (None - wyłączone)
+        self.duplicate_threshold = duplicate_threshold
+        self.duplicates = {}
+        self.tile_min_pixels = tile_min_pixels
+        # małe skany po kilka w jednym zapytaniu (pack_size 0 - wyłączone, bez trybu łączonego z NER)
+        self.pack_size = 0 if self.combined else pack_size
+        self.pack_max_pixels = pack_max_pixels
+        # transkrypcja dwuetapowa: {model, marker_density, min_line_ratio} lub None
+        # (bez trybu łączonego z NER, strony nie są wtedy łączone w grupy)
+        self.cascade = None if self.combined else cascade
+        if self.cascade:
+            self.pack_size = 0
+        self.escalated = 0
+        self.usage_log = UsageLog()
+        self.journals = {}
+        self.done = 0
+        self.errors = 0
+
+
+    async def _process_page(self, folder, item):
+        """ wszystkie etapy dla jednej strony (lub grupy małych skanów) """
+        pair, transcribe = item
+        if isinstance(pair, list):
+            await self._process_pack(folder, pair)
+            return
+        journal = self.journals[folder]
+        duplicate_pages = self.duplicates.get(folder)
+        success = False
+        usage_callback = self.budget.track(self.usage_log.callback(folder))
+        transcribe_callback = self.budget.track(self.usage_log.callback(folder, self.tag))
+        try:
+            stats = None
+            if transcribe and duplicate_pages:
+                # powtórzony skan - kopia transkrypcji strony źródłowej (po jej zakończeniu)
+                stats = await duplicate_pages.copy(pair)
+                if stats is not None:
+                    journal.mark_done(pair['name'], **stats)
+                    transcribe = False
+            if transcribe:
+                journal.mark_in_flight(pair['name'])
+                try:
+                    model = await self.router.page_model(pair, self.prompt_name, self.engine.images)
+                    if self.combined:
+                        stats = await transcribe_ner_page(self.engine, pair, self.prompt_text, model=model,
+                                                          usage_callback=transcribe_callback,
+                                                          empty_message=self.t["msg_empty_response"],
+                                                          tile_min_pixels=self.tile_min_pixels)
+                    elif self.cascade:
+                        # strona, dla której wybrano model pierwszego etapu, jest ponawiana modelem domyślnym
+                        first_model = self.cascade["model"]
+                        stats = await cascade_page(self.engine, pair, self.prompt_text,
+                                                   model=model if model != first_model else self.router.default,
+                                                   first_model=first_model,
+                                                   usage_callback=transcribe_callback,
+                                                   empty_message=self.t["msg_empty_response"],
+                                                   tile_min_pixels=self.tile_min_pixels,
+                                                   max_marker_density=self.cascade["marker_density"],
+                                                   min_line_ratio=self.cascade["min_line_ratio"])
+                        if stats.get("escalated"):
+                            self.escalated += 1
+                    else:
+                        stats = await transcribe_page(self.engine, pair, self.prompt_text, model=model,
+                                                      usage_callback=transcribe_callback,
+                                                      empty_message=self.t["msg_empty_response"],
+                                                      tile_min_pixels=self.tile_min_pixels)
+                except Exception as e:
+                    journal.mark_failed(pair['name'], e)
+                    raise
+                journal.mark_done(pair['name'], **stats)
+            success = True
+            if duplicate_pages:
+                # duplikaty tej strony nie czekają na pozostałe etapy
+                duplicate_pages.source_done(pair['name'])
+
+            # po transkrypcji łączonej metadane NER są aktualne, ner_page nie wywołuje modelu
+            if "ner" in self.stages:
+                await ner_page(self.engine, pair, self.force and not (transcribe and self.combined),
+                               usage_callback)
+            if "box" in self.stages:
+                await box_page(self.engine, pair, self.force, usage_callback)
+            if "tts" in self.stages:
+                await tts_page(self.engine, pair, self.force, usage_callback)
+        except Exception as e:
+            self.errors += 1
+            print(f"{folder}: " + self.t["batch_worker_file_error"] + f" {pair['name']}: {e}",
+                  file=sys.stderr)
+            return
+        finally:
+            if duplicate_pages:
+                duplicate_pages.source_done(pair['name'], success)
+
+        self.done += 1
+        if stats and stats.get("copied_from"):
+            print(f"{folder}: {pair['name']} = {stats['copied_from']}")
+        elif stats and stats.get("escalated"):
+            print(f"{folder}: {pair['name']} OK ({self.t['batch_status_escalated']}: {stats['escalated']})")
+        elif stats and stats.get("fallback"):
+            print(f"{folder}: {pair['name']} OK ({self.t['batch_status_fallback']}: {stats['fallback']})")
+        else:
+            print(f"{folder}: {pair['name']} OK")
+
+
+    async def _process_pack(self, folder, pairs):
+        """ transkrypcja kilku małych skanów w jednym zapytaniu, pozostałe etapy dla każdej strony osobno """
+        journal = self.journals[folder]
+        duplicate_pages = self.duplicates.get(folder)
+        transcribe_callback = self.budget.track(self.usage_log.callback(folder, self.tag))
+        results = {}
+        try:
+            for pair in pairs:
+                journal.mark_in_flight(pair['name'])
+            try:
+                # strony grupy mają ten sam model (patrz _pack_items)
+                model = await self.router.page_model(pairs[0], self.prompt_name, self.engine.images)
+                results = await transcribe_pack(self.engine, pairs, self.prompt_text, model=model,
+                                                usage_callback=transcribe_callback,
+                                                empty_message=self.t["msg_empty_response"])
+            except Exception as e:
+                results = {pair['name']: e for pair in pairs}
+
+            for pair in pairs:
+                result = results[pair['name']]
+                if isinstance(result, Exception):
+                    journal.mark_failed(pair['name'], result)
+                    self.errors += 1
+                    print(f"{folder}: " + self.t["batch_worker_file_error"] + f" {pair['name']}: {result}",
+                          file=sys.stderr)
+                else:
+                    journal.mark_done(pair['name'], **result)
+        finally:
+            if duplicate_pages:
+                for pair in pairs:
+                    duplicate_pages.source_done(pair['name'], isinstance(results.get(pair['name']), dict))
+
+        # etapy NER, BOX i TTS oraz komunikat dla stron z zapisaną transkrypcją
+        for pair in pairs:
+            if isinstance(results[pair['name']], dict):
+                await self._process_page(folder, (pair, False))
+
+
+    async def _pack_items(self, folder, items):
+        """ strony do transkrypcji z małymi skanami połączonymi w grupy: (lista stron, True) """
+        duplicates = self.duplicates[folder].duplicates if folder in self.duplicates else {}
+        candidates = [pair for pair, transcribe in items if transcribe and pair['name'] not in duplicates]
+        # w jednym zapytaniu tylko strony, dla których wybrano ten sam model
+        models = await asyncio.gather(*(self.router.page_model(pair, self.prompt_name, self.engine.images)
+                                        for pair in candidates))
+        models = {pair['name']: model for pair, model in zip(candidates, models)}
+        units = await asyncio.to_thread(pack_small_pages, candidates, self.pack_max_pixels, self.pack_size,
+                                        lambda pair: models[pair['name']])
+        packs = {}
+        for unit in units:
+            if len(unit) > 1:
+                packs.update({pair['name']: unit for pair in unit})
+
+        packed_items = []
+        for pair, transcribe in items:
+            unit = packs.get(pair['name']) if transcribe else None
+            if unit is None:
+                packed_items.append((pair, transcribe))
+            elif unit[0] is pair:
+                packed_items.append((unit, True))
+        return packed_items
+
+
+    def _folder_items(self, folder, file_pairs):
+        """ strony katalogu do przetworzenia: (strona, czy wykonać transkrypcję) """
+        journal = BatchJournal(folder)
+        self.journals[folder] = journal
+        other_stages = set(self.stages) - {"transcribe"}
+
+        items = []
+        for pair in file_pairs:
+            transcribe = "transcribe" in self.stages and needs_transcription(pair, journal, self.force)
+            # etapy NER, BOX i TTS wymagają istniejącej transkrypcji
+            if transcribe or (other_stages and os.path.exists(pair['txt'])):
+                items.append((pair, transcribe))
+
+        journal.queue([pair['name'] for pair, transcribe in items if transcribe])
+
+        # prognoza kosztu transkrypcji
+        to_transcribe = [pair for pair, transcribe in items if transcribe]
+        pages_by_model = {}
+        for pair in to_transcribe:
+            # w trybie dwuetapowym prognoza pierwszego etapu (bez stron transkrybowanych ponownie)
+            model = self.cascade["model"] if self.cascade else self.router.known_model(pair, self.prompt_name)
+            pages_by_model.setdefault(model, []).append(pair)
+        images = self.engine.images
+        for model, pairs in pages_by_model.items():
+            estimator = CostEstimator(folder, file_pairs, model, self.prompt_text, self.tag,
+                                      images.max_side if images.enabled else None)
+            for key, value in estimator.estimate(pairs).items():
+                self.estimate[key] += value
+        return items
+
+
+    async def _folder_done(self, folder):
+        """ eksport po zakończeniu wszystkich stron katalogu """
+        await self.export_folder(folder, list_file_pairs(folder))
+
+
+    async def run(self, folders):
+        """ wspólna kolejka stron wszystkich katalogów, strony pobierane kolejno z każdego
+            katalogu, z jednym limitem równoległych stron dla całego korpusu
+        """
+        queue = CorpusQueue()
+        for folder in folders:
+            file_pairs = list_file_pairs(folder)
+            if not file_pairs:
+                print(f"{folder}: " + self.t["scan_files_missing"], file=sys.stderr)
+                continue
+
+            items = self._folder_items(folder, file_pairs)
+            names = [pair['name'] for pair, transcribe in items if transcribe]
+            if names and self.duplicate_threshold is not None:
+                hashes = await build_hash_index(folder, file_pairs, self.engine.images)
+                duplicates = find_duplicates(file_pairs, hashes, names, self.duplicate_threshold)
+                self.duplicates[folder] = DuplicatePages(file_pairs, duplicates, names)
+            if names and self.pack_size > 1:
+                items = await self._pack_items(folder, items)
+            if items:
+                queue.add(folder, items)
+            else:
+                # nic do przetworzenia, tylko eksport
+                await self.export_folder(folder, file_pairs)
+
+        if self.estimate["pages"]:
+            print(self.t["batch_estimate"] + f" ({self.estimate['pages']}): ~{self.estimate['input']:,} / "
+                  + f"~{self.estimate['output']:,} " + self.t["batch_tokens"] + f", ~${self.estimate['cost']:.4f}")
+
+        # po osiągnięciu limitu kosztu kolejne strony nie są zlecane (pozostają w dzienniku serii)
+        await run_corpus(queue, self._process_page, self.concurrency,
+                         should_stop=lambda: self.budget.exceeded, on_folder_done=self._folder_done)
+
+
+    async def export_folder(self, folder, file_pairs):
+        """ eksport transkrypcji katalogu do wybranych formatów """
+        output_dir = self.output_dir or folder
+        base_name = os.path.basename(os.path.abspath(folder))
+
+        for export in self.exports:
+            target_path = os.path.join(output_dir, base_name + EXPORT_EXTENSIONS[export])
+            try:
+                if export == "txt":
+                    export_txt(file_pairs, target_path)
+                elif export == "docx":
+                    export_docx(file_pairs, target_path)
+                elif export == "tei":
+                    export_tei(file_pairs, target_path)
+                elif export == "csv":
+                    records, unique_names, errors = collect_ner_records(file_pairs)
+                    for name, e in errors:
+                        print(self.t["msg_csv_error"] + f" {name}: {e}", file=sys.stderr)
+                    if not records:
+                        print(f"{folder}: " + self.t["msg_csv_info_text"])
+                        continue
+                    nominative_map = await self.engine.nominative_forms(
+                        list(unique_names), usage_callback=self.usage_log.callback(folder))
+                    write_ner_csv(nominative_map, records, target_path,
+                                  [self.t["csv_column_orgname"],
+                                   self.t["csv_column_nominative"],
+                                   self.t["csv_column_category"],
+                                   self.t["csv_column_file"]])
+                print(f"{folder}: {export.upper()} -> {target_path}")
+            except Exception as e:
+                self.errors += 1
+                print(f"{folder}: " + self.t["msg_export_error_text"] + f" ({export}): {e}", file=sys.stderr)
+
+
+def main(argv=None):
+    """ uruchomienie przetwarzania, zwraca kod wyjścia """
+    args = build_parser().parse_args(argv)
+
+    load_dotenv()
+    try:
+        config = load_config()
+    except Exception as e:
+        print(f"config.json: {e}", file=sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    t = load_localization(args.lang or config.get("current_lang", "PL"))
+
+    api_key = args.api_key or os.environ.get("GEMINI_API_KEY") or config.get("api_key")
+    if not api_key:
+        # sama pula kluczy bez klucza głównego
+        api_key = next((key for _, key in parse_api_keys(config.get("api_keys"),
+                                                          os.environ.get("GEMINI_API_KEYS"))), None)
+    if not api_key:
+        print(t["apikey_config_error2"], file=sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    prompt_text = prompt_name = ""
+    if "transcribe" in args.stages:
+        prompt_path = resolve_prompt(args.prompt or config.get("default_prompt"))
+        if prompt_path is None:
+            print(t["msg_prompt_file_missing"] + f": {args.prompt or ''}", file=sys.stderr)
+            return EXIT_CONFIG_ERROR
+        with open(prompt_path, 'r', encoding='utf-8') as f:
+            prompt_text = f.read()
+        prompt_name = os.path.basename(prompt_path)
+
+    folders = [os.path.abspath(folder) for folder in args.folders]
+    missing = [folder for folder in folders if not os.path.isdir(folder)]
+    if missing or (args.output_dir and not os.path.isdir(args.output_dir)):
+        for folder in missing + ([args.output_dir] if args.output_dir and args.output_dir not in missing else []):
+            print(t["msg_folder_scan_error"] + f": {folder}", file=sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    if args.recursive:
+        # tryb korpusu: wszystkie podkatalogi ze skanami
+        corpus_folders = []
+        for folder in folders:
+            corpus_folders.extend(find_scan_folders(folder))
+        # katalogi podane wielokrotnie (np. katalog i jego podkatalog) przetwarzane są raz
+        folders = list(dict.fromkeys(corpus_folders))
+
+    concurrency = args.concurrency or int(config.get("batch_concurrency", 4))
+    engine = create_engine(config, api_key)
+    # model podany w wierszu poleceń zastępuje reguły wyboru modelu z config.json
+    router = ModelRouter([], args.model) if args.model else ModelRouter(config.get("model_routes"))
+    runner = CliRunner(engine, t, prompt_text, router, args.stages, args.export, concurrency,
+                       output_dir=args.output_dir, force=args.force,
+                       combined=args.combined if args.combined is not None else config.get("combined_ner", False),
+                       prompt_name=prompt_name,
+                       budget=args.budget if args.budget is not None else float(config.get("batch_budget", 0.0)),
+                       duplicate_threshold=int(config.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD))
+                       if args.dedupe else None,
+                       tile_min_pixels=args.tile_min_pixels if args.tile_min_pixels is not None
+                       else int(config.get("tile_min_pixels", DEFAULT_TILE_MIN_PIXELS)),
+                       pack_size=int(config.get("pack_size", DEFAULT_PACK_SIZE))
+                       if (args.pack if args.pack is not None else config.get("pack_images", False)) else 0,
+                       pack_max_pixels=int(config.get("pack_max_pixels", DEFAULT_PACK_MAX_PIXELS)),
+                       cascade={
+                           "model": config.get("cascade_model", DEFAULT_CASCADE_MODEL),
+                           "marker_density": float(config.get("cascade_marker_density", DEFAULT_MARKER_DENSITY)),
+                           "min_line_ratio": float(config.get("cascade_min_line_ratio", DEFAULT_MIN_LINE_RATIO))
+                       } if (args.cascade if args.cascade is not None else config.get("cascade", False)) else None)
+
+    future = asyncio.run_coroutine_threadsafe(runner.run(folders), engine.loop)
+    try:
+        future.result()
+    except KeyboardInterrupt:
+        # strony w trakcie pozostają w dzienniku serii i zostaną wznowione przy kolejnym uruchomieniu
+        future.cancel()
+        print(t["msg_interrupted"], file=sys.stderr)
+        return EXIT_INTERRUPTED
+    finally:
+        try:
+            engine.run(engine.context.invalidate(), timeout=5)
+        except Exception as e:
+            print(e, file=sys.stderr)
+        try:
+            engine.run(engine.client_manager.aclose(), timeout=5)
+        except Exception as e:
+            print(e, file=sys.stderr)
+        engine.shutdown()
+        engine.client_manager.close()
+
+    if runner.budget.exceeded and any(journal.pending() for journal in runner.journals.values()):
+        print(t["msg_budget_reached"] + f" (${runner.budget.spent:.4f} / ${runner.budget.limit:g}). "
+              + t["batch_final_msg1"] + f": {runner.done}. " + t["batch_final_msg2"] + f": {runner.errors}.",
+              file=sys.stderr)
+        return EXIT_BUDGET_REACHED
+
+    if runner.cascade:
+        print(t["cascade_escalated"] + f": {runner.escalated}")
+    print(t["msg_finished"] + t["batch_final_msg1"] + f": {runner.done}. "
+          + t["batch_final_msg2"] + f": {runner.errors}.")
+    return EXIT_PAGE_ERRORS if runner.errors else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
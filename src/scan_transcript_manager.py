@@ -1,15 +1,12 @@
 """ przeglądarka skanów i transkrypcji """
 import os
 import re
+import asyncio
 import json
-import csv
-import threading
-import hashlib
 import difflib
-import wave
-from datetime import datetime
+import time
+from collections import Counter
 from pathlib import Path
-import xml.sax.saxutils as saxutils
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk, ImageOps, ImageEnhance
@@ -17,12 +14,30 @@ import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from ttkbootstrap.widgets.scrolled import ScrolledFrame
 from ttkbootstrap.widgets.tableview import Tableview
-from docx import Document
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from just_playback import Playback
-from pydub import AudioSegment
+from gemini_client import GeminiClientManager, parse_api_keys
+from gemini_engine import GeminiEngine, TRANSCRIPTION_MODEL
+from rate_control import RateController, LatencyTracker, set_request_priority, PRIORITY_BATCH, is_offline_error
+from image_prep import ImagePreprocessor, DEFAULT_MAX_SIDE, DEFAULT_QUALITY
+from response_cache import ResponseCache
+from context_cache import ContextCache, DEFAULT_CONTEXT_TTL, MIN_CONTEXT_TOKENS
+from batch_api import BatchApiRunner, POLL_INTERVAL, load_job, remove_job
+from batch_journal import BatchJournal, QUEUED, IN_FLIGHT, FAILED
+from scan_files import list_file_pairs, calculate_checksum, metadata_path, save_metadata, load_metadata
+from usage_log import UsageLog, HEDGE_TAG
+from exporters import export_txt, export_docx, export_tei, collect_ner_records, write_ner_csv
+from pipeline import (transcribe_page, transcribe_ner_page, synthesize_audio, copy_transcription,
+                      DuplicatePages, page_tile_layout, set_page_tiling, pack_small_pages, transcribe_pack,
+                      DEFAULT_PACK_SIZE, DEFAULT_PACK_MAX_PIXELS)
+from tiling import DEFAULT_TILE_MIN_PIXELS
+from model_routing import ModelRouter
+from cascade import cascade_page, DEFAULT_CASCADE_MODEL, DEFAULT_MARKER_DENSITY, DEFAULT_MIN_LINE_RATIO
+from corpus import scan_corpus, CorpusQueue, run_corpus
+from cost_estimate import CostEstimator, BudgetGuard, transcription_tag
+from scan_hashes import build_hash_index, find_duplicates, DEFAULT_DUPLICATE_THRESHOLD
+from offline_queue import (OfflineQueue, run_entry, OFFLINE_QUEUE_FILE, DEFAULT_FLUSH_RATE,
+                           DEFAULT_PROBE_INTERVAL, OP_TRANSCRIPTION, OP_NER, OP_BOX, OP_VERIFY, OP_TTS)
 
 
 # ------------------------------- CLASS ----------------------------------------
@@ -93,6 +108,7 @@ class ManuscriptEditor:
         self.load_lang()
 
         self.api_key = ""
+        self.api_keys = []    # pula dodatkowych kluczy API [(nazwa, klucz)], zapytania rozkładane między klucze
         self.default_prompt = ""
         self.prompt_text = ""
         self.prompt_filename_var = tk.StringVar(value="Brak (wybierz plik)")
@@ -102,6 +118,42 @@ class ManuscriptEditor:
         self.config_file = "config.json"
         self.font_family = "Consolas"
         self.font_size = 12
+        self.batch_concurrency = 4 # liczba równoległych zapytań w trybie seryjnym
+        self.combined_ner = False  # transkrypcja i NER w jednym zapytaniu
+        self.batch_budget = 0.0    # limit kosztu serii w USD (0 - bez limitu)
+        self.duplicate_threshold = DEFAULT_DUPLICATE_THRESHOLD # próg podobieństwa duplikatów skanów
+        self.tile_min_pixels = DEFAULT_TILE_MIN_PIXELS # skany transkrybowane w częściach (0 - tylko wybrane)
+        self.pack_images = False  # małe skany serii wysyłane po kilka w jednym zapytaniu
+        self.pack_size = DEFAULT_PACK_SIZE
+        self.pack_max_pixels = DEFAULT_PACK_MAX_PIXELS
+        self.model_router = ModelRouter()  # wybór modelu transkrypcji dla strony
+        self.cascade = False  # seria: najpierw szybki model, niepewne strony ponownie
+        self.cascade_model = DEFAULT_CASCADE_MODEL
+        self.cascade_marker_density = DEFAULT_MARKER_DENSITY
+        self.cascade_min_line_ratio = DEFAULT_MIN_LINE_RATIO
+        self.rate_limits = {}      # limity RPM/TPM dla modeli (nadpisują domyślne)
+        self.max_concurrency = 16  # górny limit wszystkich równoległych zapytań do API
+        self.max_retries = 5       # liczba ponowień po błędach 429/503
+        self.request_timeouts = {}  # limity czasu odpowiedzi według rodzaju operacji (nadpisują domyślne)
+        self.model_fallbacks = {}  # łańcuchy modeli zastępczych według rodzaju operacji (domyślnie brak)
+        self.model_fallback_no_downgrade = False  # bez modeli zastępczych niższej klasy
+        self.hedge_requests = False    # zapytanie zapasowe przy opóźnionej transkrypcji strony w edytorze
+        self.hedge_percentile = 0.9    # percentyl czasu do pierwszego fragmentu ostatnich zapytań
+        self.hedge_initial_delay = 30.0
+        self.hedge_min_delay = 3.0
+        self.image_preprocess = True            # przygotowanie obrazów przed wysłaniem
+        self.image_max_side = DEFAULT_MAX_SIDE  # dłuższy bok obrazu wysyłanego do modelu
+        self.image_grayscale = False            # konwersja do skali szarości
+        self.image_quality = DEFAULT_QUALITY    # jakość JPEG po ponownym kodowaniu
+        self.response_cache = True     # pamięć podręczna odpowiedzi modeli
+        self.response_cache_max_mb = 256
+        self.context_cache = True      # pamięć kontekstu API dla długich promptów
+        self.context_cache_ttl = DEFAULT_CONTEXT_TTL
+        self.context_cache_min_tokens = MIN_CONTEXT_TOKENS
+        self.api_base_url = None       # alternatywny adres API (np. lokalny serwer testowy)
+        self.batch_api_poll_interval = POLL_INTERVAL  # co ile sekund sprawdzać stan zadania Batch API
+        self.offline_flush_rate = DEFAULT_FLUSH_RATE  # operacje z kolejki offline wykonywane w ciągu minuty
+        self.offline_probe_interval = DEFAULT_PROBE_INTERVAL  # co ile sekund sprawdzać połączenie
 
         self.load_config()
         self.t = self.localization[self.current_lang]
@@ -111,13 +163,41 @@ class ManuscriptEditor:
         self.root.title(self.t["title"])
         self.root.geometry("1600x900")
 
-        self.MODEL_PRICES = {
-            "gemini-3-pro-preview": (2.0, 12.0),
-            "gemini-3-flash-preview": (0.5, 3.0),
-            "gemini-3-pro-image-preview": (2.0, 12.0),
-            "gemini-flash-latest": (0.3, 2.5),
-            "gemini-2.5-flash-preview-tts": (0.5, 10.0)
-        }
+        # wspólny klient Gemini i silnik zapytań asyncio dla wszystkich wywołań API
+        self.client_manager = GeminiClientManager(self.api_key, base_url=self.api_base_url, api_keys=self.api_keys)
+        self.rate_controller = RateController(limits=self.rate_limits,
+                                              max_concurrency=self.max_concurrency,
+                                              max_retries=self.max_retries,
+                                              timeouts=self.request_timeouts,
+                                              fallbacks=self.model_fallbacks,
+                                              no_downgrade=self.model_fallback_no_downgrade)
+        self.image_preprocessor = ImagePreprocessor(enabled=self.image_preprocess,
+                                                    max_side=self.image_max_side,
+                                                    grayscale=self.image_grayscale,
+                                                    quality=self.image_quality)
+        self.cache = ResponseCache(Path('..') / 'cache',
+                                   max_bytes=self.response_cache_max_mb * 1024 * 1024,
+                                   enabled=self.response_cache)
+        self.prompt_context = ContextCache(self.client_manager,
+                                           ttl=self.context_cache_ttl,
+                                           min_tokens=self.context_cache_min_tokens,
+                                           enabled=self.context_cache)
+        self.engine = GeminiEngine(self.client_manager,
+                                   dispatcher=self._dispatch,
+                                   usage_callback=self._log_api_usage,
+                                   rate_controller=self.rate_controller,
+                                   image_preprocessor=self.image_preprocessor,
+                                   response_cache=self.cache,
+                                   context_cache=self.prompt_context,
+                                   latency_tracker=LatencyTracker(percentile=self.hedge_percentile,
+                                                                  initial_delay=self.hedge_initial_delay,
+                                                                  min_delay=self.hedge_min_delay))
+        self.batch_api = BatchApiRunner(self.engine, poll_interval=self.batch_api_poll_interval)
+        # operacje AI na stronach zlecone bez połączenia z siecią (wykonywane po jego powrocie)
+        self.offline_queue = OfflineQueue(str(Path('..') / OFFLINE_QUEUE_FILE),
+                                          flush_rate=self.offline_flush_rate,
+                                          probe_interval=self.offline_probe_interval)
+        self.offline_job = None
 
         self.file_pairs = []
         self.current_index = 0
@@ -132,10 +212,17 @@ class ManuscriptEditor:
 
         self.active_filter = "normal"
 
-        self.is_transcribing = False
+        self.is_transcribing = False  # transkrypcja strony w edytorze (blokada edytora)
         self.btn_ai = None
+        self.batch_running = False    # seria lub korpus przetwarzane w tle
+        self.batch_pages = set()      # skany przetwarzanej serii (ścieżki)
+        self.batch_hashes = {}        # skróty obrazów katalogu (wykrywanie duplikatów)
+        self.batch_similar = {}       # strona -> wcześniejsza strona o tym samym skanie
         self.stop_batch_flag = False
+        self.batch_tasks = set()      # zadania stron serii lub korpusu w trakcie przetwarzania
         self.batch_checkbox_widgets = []
+        self.page_jobs = set()        # operacje AI na stronie w edytorze (można je przerwać)
+        self.tts_job = None
 
         self.playback = Playback()
 
@@ -144,6 +231,11 @@ class ManuscriptEditor:
         self.batch_log_label = None
         self.batch_vars = None
         self.batch_progress = None
+        self.batch_journal = None
+        self.batch_live = {}  # statystyki stron przetwarzanych w serii (tokeny, TTFT)
+
+        # zapis zużycia tokenów do tokens.log (wywołania z wielu zadań serii)
+        self.usage_log = UsageLog()
 
         self.last_entities = [] # zapamiętana lista nazw własnych dla bieżącej strony
 
@@ -252,6 +344,14 @@ class ManuscriptEditor:
                                        cursor="hand2", padding=0)
         self.btn_folder_change.pack(side=RIGHT)
 
+        # przetwarzanie korpusu (wszystkie podkatalogi ze skanami)
+        self.btn_corpus = ttk.Button(self.folder_status_frame,
+                                     text=self.t["btn_corpus"],
+                                     command=self.open_corpus_dialog,
+                                     bootstyle="link-secondary",
+                                     cursor="hand2", padding=0)
+        self.btn_corpus.pack(side=RIGHT, padx=5)
+
         # ramka na tekst
         self.editor_frame = ttk.Labelframe(self.right_frame,
                                            text=self.t["frame_trans"],
@@ -337,6 +437,13 @@ class ManuscriptEditor:
                                      bootstyle="success-outline", width=4, padding=2)
         self.btn_verify.pack(side=LEFT, padx=2)
 
+        # transkrypcja bieżącej strony w częściach (duże skany)
+        self.tile_var = tk.BooleanVar(value=False)
+        self.btn_tile = ttk.Checkbutton(ai_tools, text="TILE", variable=self.tile_var,
+                                        command=self.toggle_page_tiling,
+                                        bootstyle="success-outline-toolbutton", padding=2)
+        self.btn_tile.pack(side=LEFT, padx=2)
+
         # prawa strona wiersza 2: lektor (TTS)
         tts_tools = ttk.Frame(self.header_row2)
         tts_tools.pack(side=RIGHT)
@@ -482,6 +589,12 @@ class ManuscriptEditor:
                                         bootstyle="link-success", cursor="hand2", padding=0)
         self.btn_new_prompt.pack(side=RIGHT, padx=5)
 
+        # liczba operacji czekających w kolejce offline
+        self.offline_var = tk.StringVar()
+        self.offline_label = ttk.Label(self.prompt_status_frame, textvariable=self.offline_var,
+                                       bootstyle="warning")
+        self.offline_label.pack(side=RIGHT, padx=5)
+
         # skróty klawiszowe
         self.root.bind("<Control-s>", lambda e: self.save_current_text())
         self.root.bind("<Alt-Left>", lambda e: self.prev_file())
@@ -489,10 +602,16 @@ class ManuscriptEditor:
         self.root.bind("<Control-q>", lambda e: self.on_close())
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
-        # pasek postępu (domyślnie ukryty)
-        self.progress_bar = ttk.Progressbar(self.right_frame,
+        # pasek postępu z przyciskiem przerwania operacji (domyślnie ukryty)
+        self.progress_frame = ttk.Frame(self.right_frame)
+        self.progress_bar = ttk.Progressbar(self.progress_frame,
                                             mode='indeterminate',
                                             bootstyle="success-striped")
+        self.progress_bar.pack(side=LEFT, fill=X, expand=True)
+        self.btn_cancel_ai = ttk.Button(self.progress_frame, text=self.t["btn_cancel_ai"],
+                                        command=self.cancel_page_jobs,
+                                        bootstyle="danger-outline", padding=(6, 0))
+        self.btn_cancel_ai.pack(side=LEFT, padx=(5, 0))
 
         # konfiguracja tagu aktywnej linii w edytorze transkrypcji
         self.text_area.tag_configure("active_line", background="#e8e8e8", foreground="black")
@@ -510,15 +629,18 @@ class ManuscriptEditor:
         self.btn_box_tooltip = ToolTip(self.btn_box, self.t["tt_btn_box"])
         self.btn_cls_tooltip = ToolTip(self.btn_cls, self.t["tt_btn_cls"])
         self.btn_leg_tooltip = ToolTip(self.btn_leg, self.t["tt_btn_leg"])
+        self.btn_cancel_ai_tooltip = ToolTip(self.btn_cancel_ai, self.t["tt_btn_cancel_ai"])
         self.btn_csv_tooltip = ToolTip(self.btn_csv, self.t["tt_btn_csv"])
         self.btn_log_tooltip = ToolTip(self.btn_log, self.t["tt_btn_log"])
         self.btn_verify_tooltip = ToolTip(self.btn_verify, self.t["tt_btn_verify"])
+        self.btn_tile_tooltip = ToolTip(self.btn_tile, self.t["tt_btn_tile"])
         self.btn_speak_tooltip = ToolTip(self.btn_speak, self.t["tt_btn_speak"])
         self.btn_stop_tooltip = ToolTip(self.btn_stop, self.t["tt_btn_stop"])
         self.btn_pause_tooltip = ToolTip(self.btn_pause, self.t["tt_btn_pause"])
 
         self.btn_ai_tooltip = ToolTip(self.btn_ai, self.t["tt_btn_ai"])
         self.btn_seria_tooltip = ToolTip(self.btn_seria, self.t["tt_btn_seria"])
+        self.btn_corpus_tooltip = ToolTip(self.btn_corpus, self.t["tt_btn_corpus"])
         self.btn_txt_tooltip = ToolTip(self.btn_txt, self.t["tt_btn_txt"])
         self.btn_docx_tooltip = ToolTip(self.btn_docx, self.t["tt_btn_docx"])
         self.btn_tei_tooltip = ToolTip(self.btn_tei, self.t["tt_btn_tei"])
@@ -535,6 +657,9 @@ class ManuscriptEditor:
 
         self.select_folder()
 
+        # operacje zapisane w kolejce offline w poprzedniej sesji
+        self._start_offline_flush()
+
 
     def create_new_prompt(self):
         """ nowy plik promptu z szablonem """
@@ -589,6 +714,127 @@ class ManuscriptEditor:
             messagebox.showerror(self.t["msg_error_title"], self.t["msg_prompt_create_error"] + f": {e}")
 
 
+    def _show_progress(self):
+        """ wyświetlenie paska postępu z przyciskiem przerwania operacji AI na stronie """
+        self.progress_frame.pack(fill=X, pady=(0, 10), before=self.editor_frame)
+        self.progress_bar.start(10)
+
+
+    def _hide_progress(self):
+        """ ukrycie paska postępu, gdy nie trwa już żadna operacja AI na stronie """
+        if any(not future.done() for future in self.page_jobs):
+            return
+        self.progress_bar.stop()
+        self.progress_frame.pack_forget()
+
+
+    def _submit_page_job(self, coro, **callbacks):
+        """ zlecenie operacji AI na stronie w edytorze (transkrypcja, FIX, NER, BOX, TTS),
+            którą można przerwać przyciskiem przy pasku postępu
+        """
+        future = self.engine.submit(coro, **callbacks)
+        self.page_jobs.add(future)
+        future.add_done_callback(self.page_jobs.discard)
+        return future
+
+
+    def cancel_page_jobs(self):
+        """ przerwanie operacji AI na stronie wraz z bieżącymi zapytaniami do API """
+        for future in list(self.page_jobs):
+            future.cancel()
+
+
+    def _queue_offline(self, operation, pair, **inputs):
+        """ zapis operacji AI na stronie w kolejce offline (brak połączenia z siecią), wykonywanej
+            automatycznie po powrocie połączenia; tekst strony w edytorze jest najpierw zapisywany
+        """
+        if (self.file_pairs and self.file_pairs[self.current_index]['img'] == pair['img']
+                and not self.is_transcribing):
+            self.save_current_text(True)
+        first = not len(self.offline_queue)
+        self.offline_queue.offline = True
+        self.offline_queue.add(operation, pair, **inputs)
+        print(self.t["msg_offline_queued"] + f": {operation}, {pair['name']}")
+        if first:
+            messagebox.showinfo(self.t["lbl_offline_queue"], self.t["msg_offline_queued_info"], parent=self.root)
+        self._start_offline_flush()
+
+
+    def _offline_pending(self, operation, pair, **inputs):
+        """ True, jeśli połączenie nie wróciło od ostatniego błędu sieci - operacja trafia
+            od razu do kolejki offline
+        """
+        if not self.offline_queue.offline:
+            return False
+        self._queue_offline(operation, pair, **inputs)
+        return True
+
+
+    def _page_job_error(self, error, message, operation, pair, **inputs):
+        """ błąd operacji AI na stronie: przy braku połączenia operacja trafia do kolejki offline """
+        if is_offline_error(error):
+            self._queue_offline(operation, pair, **inputs)
+        else:
+            print(message + f": {error}")
+
+
+    def _update_offline_label(self):
+        """ liczba operacji czekających w kolejce offline (pusta etykieta, gdy kolejka jest pusta) """
+        count = len(self.offline_queue)
+        self.offline_var.set(self.t["lbl_offline_queue"] + f": {count}" if count else "")
+
+
+    def _start_offline_flush(self):
+        """ opróżnianie kolejki offline w silniku Gemini (jeśli kolejka nie jest pusta i zadanie nie trwa) """
+        self._update_offline_label()
+        if not len(self.offline_queue) or (self.offline_job is not None and not self.offline_job.done()):
+            return
+        on_done = lambda entry, result: self.engine.dispatch(self._offline_entry_done, entry, result)
+        self.offline_job = self.engine.submit(
+            self.offline_queue.process(self._run_offline_entry, on_done, self.api_base_url),
+            on_success=lambda _: self._start_offline_flush(),
+            on_error=lambda e: print(self.t["msg_offline_error"] + f": {e}"))
+
+
+    async def _run_offline_entry(self, entry):
+        """ wykonanie operacji z kolejki offline w tle (zużycie zapisywane w tokens.log katalogu strony) """
+        set_request_priority(PRIORITY_BATCH)
+        pair = {"img": entry["img"], "txt": entry["txt"], "name": entry["name"]}
+        model = TRANSCRIPTION_MODEL
+        if entry["operation"] == OP_TRANSCRIPTION:
+            model = await self.model_router.page_model(pair, entry.get("prompt_name", ""), self.engine.images)
+        return await run_entry(self.engine, entry, self.usage_log.callback(os.path.dirname(entry["img"])),
+                               model, self.tile_min_pixels)
+
+
+    def _offline_entry_done(self, entry, result):
+        """ operacja z kolejki offline zakończona (wynik zapisany na dysku strony); strona
+            wyświetlana w edytorze jest odświeżana
+        """
+        self._update_offline_label()
+        operation = entry["operation"]
+        if isinstance(result, Exception):
+            print(self.t["msg_offline_failed"] + f" ({operation}, {entry['name']}): {result}")
+            return
+        print(self.t["msg_offline_done"] + f" ({operation}, {entry['name']})")
+
+        if not self.file_pairs or self.file_pairs[self.current_index]['img'] != entry['img']:
+            return
+        if operation == OP_TRANSCRIPTION:
+            self._batch_page_done(entry)
+            return
+        # wyniki dotyczą tekstu z chwili zlecenia
+        if operation == OP_TTS or self.text_area.get(1.0, tk.END).strip() != entry["text"]:
+            return
+        if operation == OP_NER and result:
+            self.last_entities = result
+            self._apply_ner_categories(result)
+        elif operation == OP_BOX and result is not None:
+            self._draw_boxes_only(result)
+        elif operation == OP_VERIFY and result:
+            self._apply_diff(entry["text"], result)
+
+
     def start_verification(self):
         """ uruchomienie procesu weryfikacji transkrypcji przez AI """
         if not self.file_pairs or self.is_transcribing:
@@ -599,7 +845,7 @@ class ManuscriptEditor:
 
         # aktualny tekst transkrypcji
         current_text = self.text_area.get(1.0, tk.END).strip()
-        current_checksum = self._calculate_checksum(current_text)
+        current_checksum = calculate_checksum(current_text)
 
         json_path = self._get_ner_json_path()
 
@@ -623,79 +869,43 @@ class ManuscriptEditor:
             return
 
         # w innym przypadku- trzeba wywołać AI w celu anlizy
+        pair = self.file_pairs[self.current_index]
+        if self._offline_pending(OP_VERIFY, pair, text=current_text):
+            return
+
          # wyszarzenie przycisku FIX
         self.btn_verify.config(state="disabled", text="...")
         # progress bar
-        self.progress_bar.pack(fill=X, pady=(0, 10), before=self.editor_frame)
-        self.progress_bar.start(10)
-
-        img_path = self.file_pairs[self.current_index]['img']
-
-        threading.Thread(target=self._verify_worker, args=(img_path, current_text), daemon=True).start()
+        self._show_progress()
 
+        img_path = pair['img']
 
-    def _verify_worker(self, img_path, original_text):
-        try:
-            client = genai.Client(api_key=self.api_key)
-            with open(img_path, 'rb') as f:
-                image_bytes = f.read()
-
-            prompt = """
-Otrzymasz skan dokumentu oraz jego wstępną transkrypcję.
-
-Twoim zadaniem jest zweryfikować tekst z obrazem i poprawić wszelkie błędy:
-1. Popraw literówki i błędnie odczytane słowa.
-2. Uzupełnij pominięte słowa.
-3. Zachowaj oryginalny układ wierszy.
-4. Nie dodawaj własnych komentarzy, zwróć TYLKO poprawiony tekst.
-
-Pamiętaj o zasadach oznaczania niepewności:
-- Jeśli fragment (słowo lub litera) jest całkowicie nieczytelny (plama, zniszczenie), oznacz go jako: [nieczytelne].
-- Jeśli odczyt jest wątpliwy, ale masz przypuszczenie, zapisz je i dodaj znak zapytania w nawiasie, np.: [słowo?] lub słow[o?].
-- Jeśli w tekście występuje skreślenie, oznacz je jako: [skreślenie].
-"""
-
-            model = "gemini-3-pro-preview" # model do weryfikacji
-
-            generate_content_config = types.GenerateContentConfig(
-                temperature=0,
-                thinkingConfig=types.ThinkingConfig(thinking_level=types.ThinkingLevel.LOW),
-                media_resolution=types.MediaResolution.MEDIA_RESOLUTION_HIGH,
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-            )
+        self._submit_page_job(self.engine.verify_transcription(img_path, current_text),
+                                  on_success=lambda fixed_text: self._verify_done(fix_path, current_text, fixed_text),
+                                  on_error=lambda e: self._page_job_error(e, "Błąd weryfikacji", OP_VERIFY, pair,
+                                                                          text=current_text),
+                                  on_finally=self._verify_finished)
 
-            response = client.models.generate_content(
-                model=model,
-                contents=[
-                    types.Part.from_text(text=prompt + "\nTranskrypcja: " + original_text),
-                    types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
-                ],
-                config=generate_content_config
-            )
 
-            if response.usage_metadata:
-                self.root.after(0, lambda: self._log_api_usage(model, response.usage_metadata))
-
-            if response.text:
-                fixed_text = response.text.strip()
-                # zapis do pliku tekstowego z rozszerzeniem *.fix
-                fix_path = os.path.splitext(self.file_pairs[self.current_index]['txt'])[0] + ".fix"
-                with open(fix_path, 'w', encoding='utf-8') as f:
-                    f.write(fixed_text)
-
-                self.root.after(0, lambda: self._apply_diff(original_text, fixed_text))
+    def _verify_done(self, fix_path, original_text, fixed_text):
+        """ zapis poprawionej transkrypcji do pliku *.fix i podświetlenie różnic """
+        if not fixed_text:
+            return
 
+        try:
+            with open(fix_path, 'w', encoding='utf-8') as f:
+                f.write(fixed_text)
         except Exception as e:
-            self.root.after(0, self._verify_finished)
             print("Błąd weryfikacji" + f": {e}")
-        finally:
-            self.root.after(0, self._verify_finished)
+
+        # podświetlenie tylko jeśli użytkownik nie przeszedł do innego skanu
+        if fix_path == os.path.splitext(self.file_pairs[self.current_index]['txt'])[0] + ".fix":
+            self._apply_diff(original_text, fixed_text)
 
 
     def _verify_finished(self):
         """ aktualizacja GUI po zakończeniu pracy wątku obsługującego próbę poprawienia transkrypcji  """
-        self.progress_bar.stop()
-        self.progress_bar.pack_forget()
+        self._hide_progress()
         self.btn_verify.config(state="normal", text="FIX")
 
 
@@ -741,54 +951,7 @@ Pamiętaj o zasadach oznaczania niepewności:
             return
 
         try:
-            tei_content = []
-
-            # prosty nagłówek TEI
-            tei_content.append('<?xml version="1.0" encoding="UTF-8"?>')
-            tei_content.append('<TEI xmlns="http://www.tei-c.org/ns/1.0">')
-            tei_content.append('  <teiHeader>')
-            tei_content.append('    <fileDesc>')
-            tei_content.append('      <titleStmt><title>Eksport z ScansAndTranscriptions</title></titleStmt>')
-            tei_content.append('      <publicationStmt><p>Wygenerowano automatycznie</p></publicationStmt>')
-            tei_content.append('      <sourceDesc><p>Transkrypcje skanów</p></sourceDesc>')
-            tei_content.append('    </fileDesc>')
-            tei_content.append('  </teiHeader>')
-            tei_content.append('  <text>')
-            tei_content.append('    <body>')
-
-            for pair in self.file_pairs:
-                if not os.path.exists(pair['txt']):
-                    continue
-
-                # wczytanie tekstu i metadanych NER
-                with open(pair['txt'], 'r', encoding='utf-8') as f:
-                    raw_text = f.read()
-
-                entities = {}
-                json_path = os.path.splitext(pair['txt'])[0] + ".json"
-                if os.path.exists(json_path):
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        entities = json.load(f).get("entities", {})
-
-                # przygotowanie tekstu: sklejanie wierszy i słów
-                processed_text = self._prepare_text_for_tei(raw_text)
-
-                # tagowanie nazw własnych
-                tagged_text = self._tag_entities_tei(processed_text, entities)
-
-                # dodanie strony jako akapitu lub sekcji
-                tei_content.append(f'      <div type="page" n="{pair["name"]}">')
-                for paragraph in tagged_text.split('\n\n'):
-                    if paragraph.strip():
-                        tei_content.append(f'        <p>{paragraph.strip()}</p>')
-                tei_content.append('      </div>')
-
-            tei_content.append('    </body>')
-            tei_content.append('  </text>')
-            tei_content.append('</TEI>')
-
-            with open(target_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(tei_content))
+            export_tei(self.file_pairs, target_path)
 
             messagebox.showinfo(self.t["msg_csv_ok_title"],
                                 self.t["msg_xml_info_text"] + f":\n{os.path.basename(target_path)}")
@@ -798,47 +961,6 @@ Pamiętaj o zasadach oznaczania niepewności:
                                  self.t["msg_xml_error_text"] + f": {e}")
 
 
-    def _prepare_text_for_tei(self, text):
-        """ łączenie podzielonych słów i wierszy w logiczne akapity """
-        lines = text.splitlines()
-        joined_text = ""
-        for line in lines:
-            line = line.strip()
-            if not line:
-                joined_text += "\n\n" # nowy akapit
-            elif joined_text.endswith("-"):
-                joined_text = joined_text[:-1] + line
-            else:
-                joined_text += (" " if joined_text and not joined_text.endswith("\n\n") else "") + line
-        return joined_text
-
-
-    def _tag_entities_tei(self, text, entities):
-        """ otaczanie nazw własnych tagami TEI (persName, placeName, orgName) """
-        tag_map = {
-            "PERS": "persName",
-            "LOC": "placeName",
-            "ORG": "orgName"
-        }
-
-        escaped_text = saxutils.escape(text)
-
-        all_names = []
-        for cat, names in entities.items():
-            if cat in tag_map:
-                for name in names:
-                    all_names.append((name, tag_map[cat]))
-
-        all_names.sort(key=lambda x: len(x[0]), reverse=True)
-
-        for name, tag in all_names:
-            escaped_name = saxutils.escape(name)
-            pattern = re.compile(rf'\b{re.escape(escaped_name)}\b', re.IGNORECASE)
-            escaped_text = pattern.sub(f'<{tag}>{escaped_name}</{tag}>', escaped_text)
-
-        return escaped_text
-
-
     def change_app_language(self, event):
         """ zmiana języka interfejsu użytkownika """
         tmp = self.lang_sel.get()
@@ -867,6 +989,7 @@ Pamiętaj o zasadach oznaczania niepewności:
         self.btn_save.config(text=self.t["btn_save"])
         self.lbl_folder_status.config(text=self.t["folder_path"])
         self.btn_folder_change.config(text=self.t["btn_folder_change"])
+        self.btn_corpus.config(text=self.t["btn_corpus"])
         self.btn_seria.config(text=self.t["btn_batch"])
         self.btn_prompt_change.config(text=self.t["btn_prompt"])
         self.btn_edit_prompt.config(text=self.t["btn_edit_prompt"])
@@ -889,6 +1012,7 @@ Pamiętaj o zasadach oznaczania niepewności:
 
         self.btn_ai_tooltip.update_text(self.t["tt_btn_ai"])
         self.btn_seria_tooltip.update_text(self.t["tt_btn_seria"])
+        self.btn_corpus_tooltip.update_text(self.t["tt_btn_corpus"])
         self.btn_txt_tooltip.update_text(self.t["tt_btn_txt"])
         self.btn_docx_tooltip.update_text(self.t["tt_btn_docx"])
         self.btn_save_tooltip.update_text(self.t["tt_btn_save"])
@@ -925,52 +1049,67 @@ Pamiętaj o zasadach oznaczania niepewności:
             {"text": self.t["table_model"], "stretch": True},
             {"text": self.t["table_input"], "stretch": False},
             {"text": self.t["table_output"], "stretch": False},
-            {"text": self.t["table_cost"], "stretch": False}
+            {"text": self.t["table_cost"], "stretch": False},
+            {"text": self.t["table_cached"], "stretch": False},
+            {"text": self.t["table_prompt"], "stretch": True},
+            {"text": self.t["table_key"], "stretch": False}
         ]
 
         row_data = []
         total_cost = 0.0
+        key_costs = {}
 
         with open(log_path, "r", encoding="utf-8") as f:
             for line in f:
                 parts = line.strip().split(";")
-                if len(parts) == 5:
-                    row_data.append(tuple(parts))
+                # starsze wpisy nie mają kolumn z liczbą tokenów z pamięci kontekstu, promptem i kluczem API
+                if len(parts) >= 5:
+                    cached = parts[5] if len(parts) > 5 else "0"
+                    prompt = parts[6] if len(parts) > 6 else ""
+                    key = parts[7] if len(parts) > 7 else ""
+                    row_data.append(tuple(parts[:5]) + (cached, prompt, key))
                     total_cost += float(parts[4])
+                    if key:
+                        key_costs[key] = key_costs.get(key, 0.0) + float(parts[4])
 
         tv = Tableview(log_win, coldata=columns, rowdata=row_data, paginated=True,
                        searchable=True, bootstyle="info")
         tv.pack(fill=BOTH, expand=True, padx=10, pady=10)
 
-        footer = ttk.Label(log_win, text=self.t["total_cost"] + f": ${total_cost:.4f}",
+        footer_text = self.t["total_cost"] + f": ${total_cost:.4f}"
+        # koszt w podziale na klucze API (przy korzystaniu z puli kluczy)
+        if len(key_costs) > 1:
+            footer_text += " (" + ", ".join(f"{key}: ${cost:.4f}" for key, cost in sorted(key_costs.items())) + ")"
+        footer = ttk.Label(log_win, text=footer_text,
                            font=("Segoe UI", 10, "bold"))
         footer.pack(pady=10)
 
 
-    def _log_api_usage(self, model_name, usage_metadata):
-        """ obliczanie kosztu użycia API i zapis w logu w bieżącym folderze ze skanami"""
+    def _log_api_usage(self, model_name, usage_metadata, batch=False, tag="", key=None):
+        """ obliczanie kosztu użycia API i zapis w logu w bieżącym folderze ze skanami
+            (batch - wynik zadania Batch API, rozliczany po niższej cenie, tag - prompt
+            transkrypcji serii, key - nazwa klucza API z puli)
+        """
         if not self.file_pairs or not usage_metadata:
             return
 
         folder = os.path.dirname(self.file_pairs[0]['img'])
-        log_path = os.path.join(folder, "tokens.log")
-
-        in_tokens = usage_metadata.prompt_token_count
-        out_tokens = usage_metadata.candidates_token_count
-
-        prices = self.MODEL_PRICES.get(model_name, (0.0, 0.0))
-        cost = (in_tokens / 1_000_000 * prices[0]) + (out_tokens / 1_000_000 * prices[1])
-
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_line = f"{now};{model_name};{in_tokens};{out_tokens};{cost:.6f}\n"
 
         try:
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(log_line)
+            self.usage_log.record(folder, model_name, usage_metadata, batch, tag, key)
         except Exception as e:
             print(self.t["msg_log_error"] + f": {e}")
 
 
+    def _batch_usage_callback(self, tag, budget=None):
+        """ zapis zużycia stron serii z nazwą promptu (podstawa szacowania kolejnych serii),
+            z doliczaniem kosztu do limitu serii
+        """
+        def _record(model_name, usage_metadata, batch=False, key=None):
+            self._log_api_usage(model_name, usage_metadata, batch, tag, key)
+        return budget.track(_record) if budget else _record
+
+
     def export_ner_to_csv(self):
         """ eksport NER do CSV z mianownikiem i kontekstem z całego katalogu """
         if not self.file_pairs:
@@ -985,93 +1124,37 @@ Pamiętaj o zasadach oznaczania niepewności:
         if not target_path:
             return
 
-        all_data_to_process = []
-        unique_names = set()
-
-        for pair in self.file_pairs:
-            json_path = os.path.splitext(pair['txt'])[0] + ".json"
-            txt_path = pair['txt']
-
-            if os.path.exists(json_path) and os.path.exists(txt_path):
-                try:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        entities = json.load(f).get("entities", {})
-
-                    for cat, names in entities.items():
-                        for name in names:
-                            all_data_to_process.append({
-                                'orig': name,
-                                'cat': cat,
-                                'file': os.path.basename(pair['img']),
-                            })
-                            unique_names.add(name)
-                except Exception as e:
-                    print(self.t["msg_csv_error"] + f" {pair['name']}: {e}")
+        all_data_to_process, unique_names, errors = collect_ner_records(self.file_pairs)
+        for name, e in errors:
+            print(self.t["msg_csv_error"] + f" {name}: {e}")
 
         if not all_data_to_process:
             messagebox.showinfo(self.t["msg_csv_info_title"], self.t["msg_csv_info_text"])
             return
 
         self.btn_ai.config(state="disabled")
-        threading.Thread(target=self._ner_export_worker,
-                         args=(list(unique_names), all_data_to_process, target_path),
-                         daemon=True).start()
+        self.engine.submit(self.engine.nominative_forms(list(unique_names)),
+                           on_success=lambda nominative_map: self._write_ner_csv(nominative_map,
+                                                                                 all_data_to_process,
+                                                                                 target_path),
+                           on_error=lambda e: messagebox.showerror(self.t["msg_csv_error_text"], str(e)),
+                           on_finally=lambda: self.btn_ai.config(state="normal", text="Gemini"))
 
 
-    def _ner_export_worker(self, names_list, full_records, target_path):
-        """ wątek AI: mianownik + zapis 5 kolumn do CSV """
+    def _write_ner_csv(self, nominative_map, full_records, target_path):
+        """ zapis 4 kolumn do CSV: nazwa oryginalna, mianownik, kategoria, plik """
         try:
-            nominative_map = {}
-            client = genai.Client(api_key=self.api_key)
-
-            # przetwarzanie paczek nazw przez Gemini
-            for i in range(0, len(names_list), 50):
-                batch = names_list[i:i+50]
-                prompt = (
-                    "Dla podanej listy nazw własnych z dokumentów historycznych, "
-                    "podaj ich formę w mianowniku, nie zmieniaj rodzaju nazw (męski, żeński, nijaki). "
-                    "Zwróć WYŁĄCZNIE czysty JSON: {\"oryginał\": \"mianownik\", ...}. "
-                    f"Lista: {', '.join(batch)}"
-                )
-
-                config = types.GenerateContentConfig(
-                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-                )
-
-                model="gemini-flash-latest" # lub gemini-3-flash-preview
-
-                response = client.models.generate_content(
-                    model=model,
-                    contents=prompt,
-                    config=config
-                )
-
-                if response.usage_metadata:
-                    self._log_api_usage(model, response.usage_metadata)
-
-                if response.text:
-                    json_str = response.text.replace("```json", "").replace("```", "").strip()
-                    nominative_map.update(json.loads(json_str))
-
-            # zapis do CSV (separator średnik)
-            with open(target_path, 'w', encoding='utf-8', newline='') as csvfile:
-                writer = csv.writer(csvfile, delimiter=';')
-                writer.writerow([self.t["csv_column_orgname"],
-                                 self.t["csv_column_nominative"],
-                                 self.t["csv_column_category"],
-                                 self.t["csv_column_file"]])
-
-                for rec in full_records:
-                    base_name = nominative_map.get(rec['orig'], rec['orig'])
-                    writer.writerow([rec['orig'], base_name, rec['cat'], rec['file']])
-
-            self.root.after(0, lambda: messagebox.showinfo(self.t["msg_csv_ok_title"],
-                                                           self.t["msg_csv_ok_text"] + f":\n{target_path}"))
+            write_ner_csv(nominative_map, full_records, target_path,
+                          [self.t["csv_column_orgname"],
+                           self.t["csv_column_nominative"],
+                           self.t["csv_column_category"],
+                           self.t["csv_column_file"]])
+
+            messagebox.showinfo(self.t["msg_csv_ok_title"],
+                                self.t["msg_csv_ok_text"] + f":\n{target_path}")
 
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror(self.t["msg_csv_error_text"], str(e)))
-        finally:
-            self.root.after(0, lambda: self.btn_ai.config(state="normal", text="Gemini"))
+            messagebox.showerror(self.t["msg_csv_error_text"], str(e))
 
 
     def update_active_line_highlight(self, event=None):
@@ -1147,17 +1230,12 @@ Pamiętaj o zasadach oznaczania niepewności:
         self.btn_box.config(state="disabled")
 
 
-    def _calculate_checksum(self, text):
-        """ suma kontrolna SHA-256 dla tekstu transkrypcji """
-        return hashlib.sha256(text.encode('utf-8')).hexdigest()
-
-
     def _get_ner_json_path(self):
         """ ścieżka do pliku .json z metadanymi dla aktualnego skanu """
         if not self.file_pairs:
             return None
         txt_path = self.file_pairs[self.current_index]['txt']
-        return os.path.splitext(txt_path)[0] + ".json"
+        return metadata_path(txt_path)
 
 
     def clear_search(self):
@@ -1204,22 +1282,6 @@ Pamiętaj o zasadach oznaczania niepewności:
             self.root.after(500, lambda: self.search_entry.config(bootstyle="default"))
 
 
-    def _parse_coordinates_response(self, text):
-        """ wyodrębnia nazwy i współrzędne [y1, x1, y2, x2] z odpowiedzi modelu """
-        results = []
-        # wyszukiwanie wzorca: nazwa, nazwa_kategorii [ymin, xmin, ymax, xmax]
-        pattern = r"(.*?)\s*,(.*?)\s*\[(\d+),\s*(\d+),\s*(\d+),\s*(\d+)\]"
-        matches = re.findall(pattern, text)
-
-        for m in matches:
-            results.append({
-                'name': m[0].strip(),
-                'category': m[1].strip(),
-                'coords': [int(x) for x in m[2:]]
-            })
-        return results
-
-
     def _on_text_modified(self, event):
         """
         automatyczne usuwanie podświetlenia nazw własnych i ramek ze skanu
@@ -1238,7 +1300,7 @@ Pamiętaj o zasadach oznaczania niepewności:
         if not text or self.is_transcribing:
             return
 
-        current_checksum = self._calculate_checksum(text)
+        current_checksum = calculate_checksum(text)
         json_path = self._get_ner_json_path()
 
         # próba wczytania metadanych z json
@@ -1262,128 +1324,60 @@ Pamiętaj o zasadach oznaczania niepewności:
                 print(self.t["msg_ner_metadata_error"] + f": {e}")
 
         # wywołanie AI jeżeli brak pliku json z metadanymi
+        pair = self.file_pairs[self.current_index]
+        if self._offline_pending(OP_NER, pair, text=text):
+            return
+
         # wyszarzenie przycisku NER , włączenie paska pastępu
         self.btn_ner.config(state="disabled")
-        self.progress_bar.pack(fill=X, pady=(0, 10), before=self.editor_frame)
-        self.progress_bar.start(10)
-
-        # suma kontrolna przekazywana do wątku, w celu zapisu w json po analizie AI
-        thread = threading.Thread(target=self._ner_worker,
-                                  args=(text, current_checksum), daemon=True)
-        thread.start()
-
-
-    def _ner_worker(self, text, checksum):
-        """ dodatkowa analiza tekstu przez Gemini w celu uzyskania listy nazw własnych:
-            osoby, miejsca, instytucje """
-        try:
-            client = genai.Client(api_key=self.api_key)
-
-            prompt = """
-Jesteś ekspertem w dziedzinie historii i paleografii XVIII, XIX oraz XX wieku. Twoim zadaniem
-jest ekstrakcja nazw własnych z transkrypcji dokumentów historycznych.
-
-Zasady klasyfikacji:
-1. PERS (Osoby): Wyodrębnij nazwy osób, mogą to być pełne imiona i nazwiska, ale także zapisy
-   samych nazwisk lub imion, zapisy inicjałów np. A. T., zapisy nazw stosowane w średniowieczu
-   np. Jan z Dąbrówki, uwzględnij także nazwy narodów lub plemion. DOŁĄCZ do nazwy towarzyszące im
-   tytuły szlacheckie (np. hr., margrabia), stopnie wojskowe (np. kpt., gen.),
-   funkcje urzędowe (np. rządzca, wójt) oraz zwroty grzecznościowe (np. JW Pan, Ob.),
-   jeśli występują bezpośrednio przy nazwisku.
-2. LOC (Geografia): Wyodrębnij nazwy miast, wsi, krajów, państw, folwarków, majątków ziemskich, rzek,
-   jezior, guberni oraz konkretne nazwy ulic i placów.
-3. ORG (Organizacje): Wyodrębnij nazwy urzędów, instytucji, pułków wojskowych, parafii, komitetów, stowarzyszeń,
-   fabryk i towarzystw (np. "Towarzystwo Kredytowe Ziemskie").
-
-Instrukcje techniczne:
-- Rekonstrukcja: Jeśli nazwa jest podzielona między wiersze (np. "Krak-" i "ów"),
-  połącz ją w jedno słowo bez dywizu ("Kraków").
-- Normalizacja: Zwróć nazwy w takiej formie (deklinacji), w jakiej występują w tekście, ale usuń
-  znaki podziału wiersza.
-- Czystość: Ignoruj nazwy pospolite, chyba że są częścią nazwy własnej.
-
-Zwróć wynik WYŁĄCZNIE jako JSON w formacie:
-{
-  "PERS": ["nazwa1", ...],
-  "LOC": ["nazwa1", ...],
-  "ORG": ["nazwa1", ...]
-}
-"""
-
-            config = types.GenerateContentConfig(
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-            )
+        self._show_progress()
 
-            model = "gemini-3-pro-preview" # lub gemini-3-flash-preview
+        print('NER: generowanie wyników')
 
-            print('NER: generowanie wyników')
+        # suma kontrolna i ścieżka metadanych zapamiętane w celu zapisu w json po analizie AI
+        self._submit_page_job(self.engine.extract_entities(text),
+                                  on_success=lambda entities: self._ner_done(entities, json_path, current_checksum),
+                                  on_error=lambda e: self._page_job_error(e, self.t["msg_ner_error"], OP_NER, pair,
+                                                                          text=text),
+                                  on_finally=self._ner_finished)
 
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt + "\nTekst: " + text,
-                config=config
-            )
 
-            if response.usage_metadata:
-                self._log_api_usage(model, response.usage_metadata)
+    def _ner_done(self, entities_dict, json_path, checksum):
+        """ zapis listy nazw własnych (osoby, miejsca, instytucje) i podświetlenie ich w tekście """
+        if not entities_dict:
+            return
 
-            if response.text:
-                print("NER: wyniki przygotowane")
-                json_str = response.text.replace("```json", "").replace("```", "").strip()
-                entities_dict = json.loads(json_str)
-                self.last_entities = entities_dict
+        print("NER: wyniki przygotowane")
 
-                # zapis metdanych NER do pliku *.json z usunięciem ewentualnych współrzędnych ramek
-                # nowe nazwy własne oznaczają konjieczność wyszukania nowych ramek na skanie
-                self._save_ner_cache(entities=entities_dict, coordinates=[], checksum=checksum)
+        # zapis metdanych NER do pliku *.json z usunięciem ewentualnych współrzędnych ramek
+        # nowe nazwy własne oznaczają konjieczność wyszukania nowych ramek na skanie
+        self._save_ner_cache(entities=entities_dict, coordinates=[], checksum=checksum,
+                             json_path=json_path)
 
-                self.root.after(0, self._apply_ner_categories, entities_dict)
-        except Exception as e:
-            print(self.t["msg_ner_error"] + f": {e}")
-            self.root.after(0, self._ner_finished)
-        finally:
-            self.root.after(0, self._ner_finished)
+        if json_path == self._get_ner_json_path():
+            self.last_entities = entities_dict
+            self._apply_ner_categories(entities_dict)
 
 
     def _ner_finished(self):
         """ aktualizacja GUI po zakończeniu pracy wątku """
-        self.progress_bar.stop()
-        self.progress_bar.pack_forget()
+        self._hide_progress()
         self.btn_ner.config(state="normal")
 
 
-    def _save_ner_cache(self, entities=None, coordinates=None, checksum=None, tts_checksum=None):
-        """ zapis wyników NER, współrzędnych i sum kontrolnych do pliku .json """
-        json_path = self._get_ner_json_path()
+    def _save_ner_cache(self, entities=None, coordinates=None, checksum=None, tts_checksum=None,
+                        json_path=None):
+        """ zapis wyników NER, współrzędnych i sum kontrolnych do pliku .json
+            (domyślnie dla bieżącego skanu)
+        """
+        if json_path is None:
+            json_path = self._get_ner_json_path()
         if not json_path:
             return
 
-        # jeśli plik istnieje jest wczytywany, aby nie stracić danych
-        cache_data = {}
-        if os.path.exists(json_path):
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-            except Exception as e:
-                print(e)
-
-        # aktualizacja pól, które zostały przekazane
-        if checksum:
-            cache_data["checksum"] = checksum
-        if entities:
-            cache_data["entities"] = entities
-        if coordinates is not None:
-            # usuwanie jeżeli przekazano pustą listę (czyli odświeżono NER)
-            if coordinates == []:
-                cache_data.pop("coordinates", None)
-            else:
-                cache_data["coordinates"] = coordinates
-        if tts_checksum:
-            cache_data["tts_checksum"] = tts_checksum
-
         try:
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=4)
+            save_metadata(json_path, entities=entities, coordinates=coordinates, checksum=checksum,
+                          tts_checksum=tts_checksum)
         except Exception as e:
             print(self.t["msg_ner_json_error"] + f": {e}")
 
@@ -1474,7 +1468,7 @@ Zwróć wynik WYŁĄCZNIE jako JSON w formacie:
             return
 
         text = self.text_area.get(1.0, tk.END).strip()
-        current_checksum = self._calculate_checksum(text)
+        current_checksum = calculate_checksum(text)
         json_path = self._get_ner_json_path()
 
         # odczytywanie metadanych z pliku json
@@ -1492,97 +1486,40 @@ Zwróć wynik WYŁĄCZNIE jako JSON w formacie:
                 print(e)
 
         # brak metadanych - wywołanie AI
+        pair = self.file_pairs[self.current_index]
+        entities = self.last_entities
+        if self._offline_pending(OP_BOX, pair, text=text, entities=entities):
+            return
+
         # wyszarzenie przycisku BOX
         self.btn_box.config(state="disabled", text="..." )
         # progress bar
-        self.progress_bar.pack(fill=X, pady=(0, 10), before=self.editor_frame)
-        self.progress_bar.start(10)
+        self._show_progress()
 
-        threading.Thread(target=self._box_worker, args=(current_checksum,), daemon=True).start()
+        img_path = pair['img']
 
+        self._submit_page_job(self.engine.locate_entities(img_path, self.last_entities),
+                                  on_success=lambda coords: self._box_done(coords, json_path, current_checksum),
+                                  on_error=lambda e: self._page_job_error(e, self.t["msg_box_error"], OP_BOX, pair,
+                                                                          text=text, entities=entities),
+                                  on_finally=self._box_finished)
 
-    def _box_worker(self, checksum):
-        try:
-            client = genai.Client(api_key=self.api_key)
-            current_pair = self.file_pairs[self.current_index]
-            with open(current_pair['img'], 'rb') as f:
-                image_bytes = f.read()
-
-            entities_to_find = []
-            for cat, names in self.last_entities.items():
-                for name in names:
-                    entities_to_find.append((name, cat))
-
-            entities_str = ""
-            for entity in entities_to_find:
-                entity_name, entity_cat = entity
-                entities_str += f"{entity_name},{entity_cat}\n"
-
-            prompt = f"""
-Na załączonym obrazie znajdź lokalizację następujących nazw,
-(podanych w formie listy par: nazwa_do_wyszukania, kategoria_nazwy, każda para w osobnym wierszu np.
-Felicjan Słomkowski, PERS
-Gniezno, LOC):
-
-{entities_str}.
-
-Uwzględnij tylko i wyłącznie nazwy z listy, inne zignoruj.
-Dla każdej nazwy podaj współrzędne ramki w formacie:
-
-nazwa, nazwa_kategorii [ymin, xmin, ymax, xmax]
-
-na przykład:
-Krakowa, LOC [ymin, xmin, ymax, xmax]
-Henryk Walezy, PERS [ymin, xmin, ymax, xmax]
-...
-
-Wszystkie współrzędne w skali 0-1000.
-Zwróć tylko listę tych danych bez żadnych dodatkowych komentarzy.
-"""
-
-            config = types.GenerateContentConfig(
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
-                image_config=types.ImageConfig(
-                    image_size="1K",
-                ),
-                response_modalities=[
-                    "TEXT"
-                ]
-            )
-
-            model = "gemini-3-pro-image-preview"
-
-            response = client.models.generate_content(
-                model=model,
-                contents=[
-                    types.Part.from_text(text=prompt),
-                    types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
-                ],
-                config=config
-            )
-
-            if response.usage_metadata:
-                self._log_api_usage(model, response.usage_metadata)
 
-            if response.text:
-                coordinates_data = self._parse_coordinates_response(response.text)
+    def _box_done(self, coordinates_data, json_path, checksum):
+        """ zapis współrzędnych ramek do pliku JSON z metadanymi i rysowanie ramek """
+        if coordinates_data is None:
+            return
 
-                # zapis współrzędnych ramek do pliku JSON z metadanymi
-                self._save_ner_cache(entities=None, coordinates=coordinates_data, checksum=checksum)
+        self._save_ner_cache(entities=None, coordinates=coordinates_data, checksum=checksum,
+                             json_path=json_path)
 
-                self.root.after(0, self._draw_boxes_only, coordinates_data)
-
-        except Exception as e:
-            print(self.t["msg_box_error"] + f": {e}")
-            self.root.after(0, self._box_finished)
-        finally:
-            self.root.after(0, self._box_finished)
+        if json_path == self._get_ner_json_path():
+            self._draw_boxes_only(coordinates_data)
 
 
     def _box_finished(self):
         """ aktualizacja GUI po zakończeniu pracy wątku obsługującego wyszukiwanie nazw na skanie  """
-        self.progress_bar.stop()
-        self.progress_bar.pack_forget()
+        self._hide_progress()
         self.btn_box.config(state="normal", text="BOX")
 
 
@@ -1847,130 +1784,55 @@ Zwróć tylko listę tych danych bez żadnych dodatkowych komentarzy.
         self.btn_pause.config(state="disabled", text="||")
         self.btn_stop.config(state="normal")
 
-        threading.Thread(target=self._tts_worker, args=(text_to_read,), daemon=True).start()
-
-
-    def wave_file(self, filename, pcm, channels=1, rate=24000, sample_width=2):
-        """ zapis pliku WAV """
-        with wave.open(filename, "wb") as wf:
-            wf.setnchannels(channels)     # pylint: disable=E1101
-            wf.setsampwidth(sample_width) # pylint: disable=E1101
-            wf.setframerate(rate)         # pylint: disable=E1101
-            wf.writeframes(pcm)           # pylint: disable=E1101
-
-
-    def convert_wav_to_mp3(self, input_file, output_file):
-        """ konwersja WAV na MP3 """
-        audio = AudioSegment.from_raw(
-            input_file,
-            sample_width=2,
-            frame_rate=24000,
-            channels=1
-        )
-
-        audio.export(output_file, format="mp3", bitrate="128k")
+        self.tts_job = self._submit_page_job(self._tts_job(text_to_read, mp3_path, self._get_ner_json_path()),
+                                             on_success=self._tts_play,
+                                             on_error=lambda e: self._tts_error(e, pair, text_to_read, mp3_path),
+                                             on_finally=self._tts_finished,
+                                             on_cancel=self.stop_reading)
 
 
     def _show_tts_progress(self):
         """ Bezpieczne wyświetlenie paska postępu dla TTS """
-        self.progress_bar.pack(fill=X, pady=(0, 10), before=self.editor_frame)
-        self.progress_bar.start(10)
+        self._show_progress()
 
 
-    def _tts_worker(self, text):
-        """ kod wykonywany w wątku - tworzenie audio i start odtwarzania,
-            jeżeli aktualny plik audio jest w pliku, odtwarzanie z pliku bez
-            nowego generowania
+    async def _tts_job(self, text, mp3_path, json_path):
+        """ tworzenie audio w silniku Gemini, jeżeli aktualny plik audio jest na dysku,
+            odtwarzanie z pliku bez nowego generowania
         """
-        try:
-            current_checksum = self._calculate_checksum(text)
+        def on_generate():
+            self.engine.dispatch(self._show_tts_progress)
+            print(self.t["msg_gen_mp3"])
 
-            # ścieżki
-            pair = self.file_pairs[self.current_index]
-            mp3_path = os.path.splitext(pair['img'])[0] + ".mp3"
-            json_path = self._get_ner_json_path()
+        # generowanie pliku tylko jeśli to konieczne
+        mp3_path, generated = await synthesize_audio(self.engine, text, mp3_path, json_path,
+                                                     on_generate=on_generate)
+        if generated:
+            print("TTS: wygenerowano")
 
-            needs_generation = True
+        return mp3_path
 
-            # sprawdzanie czy plik MP3 istnieje i czy suma kontrolna się zgadza
-            if os.path.exists(mp3_path) and os.path.exists(json_path):
-                try:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                        if cache_data.get("tts_checksum") == current_checksum:
-                            needs_generation = False
 
-                except Exception as e:
-                    print(self.t["msg_tts_cache_error"] + f": {e}")
-
-            # generowanie pliku tylko jeśli to konieczne
-            if needs_generation:
-                self.root.after(0, self._show_tts_progress)
-                print(self.t["msg_gen_mp3"])
-
-                wav_path = os.path.splitext(pair['img'])[0] + ".wav"
-
-                client = genai.Client()
-                model="gemini-2.5-flash-preview-tts"
-                #model="gemini-2.5-pro-preview-tts"
-
-                prompt = """Przeczytaj uważnie podany dalej tekst. Odczytuj dokładnie,
-oddając oryginalne brzmienie także słów archaicznych.
-Tekst:
-"""
-
-                response = client.models.generate_content(
-                    model=model,
-                    contents=prompt + text,
-                    config=types.GenerateContentConfig(
-                        response_modalities=["AUDIO"],
-                        speech_config=types.SpeechConfig(
-                            voice_config=types.VoiceConfig(
-                                prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                                voice_name='Enceladus',
-                                )
-                            )
-                        ),
-                        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-                    )
-                )
-
-                print("TTS: wygenerowano")
-
-                data = response.candidates[0].content.parts[0].inline_data.data
-
-                self.wave_file(wav_path, data)
-                self.convert_wav_to_mp3(wav_path, mp3_path)
-                os.remove(wav_path)
-
-                # zapis kosztów w logu
-                if response.usage_metadata:
-                    self.root.after(0, lambda: self._log_api_usage(model, response.usage_metadata))
-
-                # zapis nową sumę kontrolną audio w JSON
-                self._save_ner_cache(tts_checksum=current_checksum)
-
-            # odtwarzanie
-            if self.is_reading_audio:
-                self.playback.load_file(mp3_path)
-                self.playback.play()
+    def _tts_play(self, mp3_path):
+        """ start odtwarzania po przygotowaniu pliku audio """
+        if self.is_reading_audio:
+            self.playback.load_file(mp3_path)
+            self.playback.play()
 
-                # odblokowanie pauzy po rozpoczęciu odtwarzania
-                self.root.after(0, lambda: self.btn_pause.config(state="normal"))
-                self.root.after(100, self._check_audio_status)
+            # odblokowanie pauzy po rozpoczęciu odtwarzania
+            self.btn_pause.config(state="normal")
+            self.root.after(100, self._check_audio_status)
 
-        except Exception as e:
-            print(self.t["msg_tts_error"] + f": {e}")
-            self.root.after(0, self.stop_reading)
-        finally:
-            # ukrywanie paska postępu
-            self.root.after(0, self._tts_finished)
+
+    def _tts_error(self, error, pair, text, mp3_path):
+        """ obsługa błędu generowania audio (bez połączenia - zapis w kolejce offline) """
+        self.stop_reading()
+        self._page_job_error(error, self.t["msg_tts_error"], OP_TTS, pair, text=text, mp3_path=mp3_path)
 
 
     def _tts_finished(self):
         """ aktualizacja GUI po zakończeniu pracy wątku TTS """
-        self.progress_bar.stop()
-        self.progress_bar.pack_forget()
+        self._hide_progress()
         self.btn_ner.config(state="normal")
         self.btn_speak.config(state="normal")
 
@@ -1987,6 +1849,10 @@ Tekst:
 
     def stop_reading(self):
         """ pełne zatrzymanie i reset interfejsu """
+        # przerwanie generowania audio
+        if self.tts_job is not None:
+            self.tts_job.cancel()
+            self.tts_job = None
         try:
             self.playback.stop()
         except Exception as e:
@@ -2047,10 +1913,68 @@ Tekst:
                     # domyślny prompt
                     self.default_prompt = config.get("default_prompt",
                                                      "prompt_handwritten_pol_xx_century.txt")
+                    # liczba równoległych zapytań dla serii
+                    self.batch_concurrency = int(config.get("batch_concurrency", 4))
+                    # transkrypcja i nazwy własne w jednym zapytaniu
+                    self.combined_ner = config.get("combined_ner", False)
+                    # limit kosztu serii
+                    self.batch_budget = float(config.get("batch_budget", 0.0))
+                    # wykrywanie powtórzonych skanów w serii
+                    self.duplicate_threshold = int(config.get("duplicate_threshold",
+                                                              DEFAULT_DUPLICATE_THRESHOLD))
+                    # transkrypcja dużych skanów w częściach
+                    self.tile_min_pixels = int(config.get("tile_min_pixels", DEFAULT_TILE_MIN_PIXELS))
+                    # małe skany serii po kilka w jednym zapytaniu
+                    self.pack_images = config.get("pack_images", False)
+                    self.pack_size = int(config.get("pack_size", DEFAULT_PACK_SIZE))
+                    self.pack_max_pixels = int(config.get("pack_max_pixels", DEFAULT_PACK_MAX_PIXELS))
+                    # reguły wyboru modelu transkrypcji (prompt, katalog, rodzaj pisma)
+                    self.model_router = ModelRouter(config.get("model_routes"))
+                    # transkrypcja dwuetapowa (szybki model, niepewne strony ponownie)
+                    self.cascade = config.get("cascade", False)
+                    self.cascade_model = config.get("cascade_model", DEFAULT_CASCADE_MODEL)
+                    self.cascade_marker_density = float(config.get("cascade_marker_density",
+                                                                   DEFAULT_MARKER_DENSITY))
+                    self.cascade_min_line_ratio = float(config.get("cascade_min_line_ratio",
+                                                                   DEFAULT_MIN_LINE_RATIO))
+                    # limity zapytań i ponawianie
+                    self.rate_limits = config.get("rate_limits", {})
+                    self.max_concurrency = int(config.get("max_concurrency", 16))
+                    self.max_retries = int(config.get("max_retries", 5))
+                    self.request_timeouts = config.get("request_timeouts", {})
+                    self.model_fallbacks = config.get("model_fallbacks", {})
+                    self.model_fallback_no_downgrade = config.get("model_fallback_no_downgrade", False)
+                    # zapytanie zapasowe przy opóźnionej odpowiedzi (transkrypcja w edytorze)
+                    self.hedge_requests = config.get("hedge_requests", False)
+                    self.hedge_percentile = float(config.get("hedge_percentile", 0.9))
+                    self.hedge_initial_delay = float(config.get("hedge_initial_delay", 30.0))
+                    self.hedge_min_delay = float(config.get("hedge_min_delay", 3.0))
+                    # przygotowanie obrazów przed wysłaniem do modelu
+                    self.image_preprocess = config.get("image_preprocess", True)
+                    self.image_max_side = int(config.get("image_max_side", DEFAULT_MAX_SIDE))
+                    self.image_grayscale = config.get("image_grayscale", False)
+                    self.image_quality = int(config.get("image_quality", DEFAULT_QUALITY))
+                    # pamięć podręczna odpowiedzi modeli
+                    self.response_cache = config.get("response_cache", True)
+                    self.response_cache_max_mb = int(config.get("response_cache_max_mb", 256))
+                    # pamięć kontekstu API (cached content) dla promptów
+                    self.context_cache = config.get("context_cache", True)
+                    self.context_cache_ttl = int(config.get("context_cache_ttl", DEFAULT_CONTEXT_TTL))
+                    self.context_cache_min_tokens = int(config.get("context_cache_min_tokens",
+                                                                   MIN_CONTEXT_TOKENS))
+                    # adres API i tryb Batch API
+                    self.api_base_url = config.get("api_base_url") or None
+                    self.batch_api_poll_interval = int(config.get("batch_api_poll_interval", POLL_INTERVAL))
+                    # kolejka operacji zleconych bez połączenia z siecią
+                    self.offline_flush_rate = int(config.get("offline_flush_rate", DEFAULT_FLUSH_RATE))
+                    self.offline_probe_interval = int(config.get("offline_probe_interval",
+                                                                 DEFAULT_PROBE_INTERVAL))
 
                     # opcjonalny api key w pliku config
                     if not self.api_key:
                         self.api_key = config.get("api_key", "")
+                    # opcjonalna pula kluczy (kilka projektów Gemini)
+                    self.api_keys = config.get("api_keys", [])
             except Exception as e:
                 print(self.t["msg_config_file_error"] + f": {e}")
 
@@ -2064,11 +1988,21 @@ Tekst:
                 config["font_size"] = self.font_size
                 config["current_lang"] = self.current_lang
                 config["default_prompt"] = self.default_prompt
+                config["batch_concurrency"] = self.batch_concurrency
+                config["combined_ner"] = self.combined_ner
+                config["batch_budget"] = self.batch_budget
+                config["pack_images"] = self.pack_images
+                config["cascade"] = self.cascade
         else:
             config = {
                 "font_size": self.font_size,
                 "current_lang": self.current_lang,
                 "default_prompt": self.default_prompt,
+                "batch_concurrency": self.batch_concurrency,
+                "combined_ner": self.combined_ner,
+                "batch_budget": self.batch_budget,
+                "pack_images": self.pack_images,
+                "cascade": self.cascade,
                 "api_key": ""
             }
 
@@ -2112,6 +2046,11 @@ Tekst:
         if not self.api_key:
             self.api_key = os.environ.get("GEMINI_API_KEY")
 
+        # pula kluczy z config.json i zmiennej GEMINI_API_KEYS (klucze rozdzielone przecinkami)
+        self.api_keys = parse_api_keys(self.api_keys, os.environ.get("GEMINI_API_KEYS"))
+        if not self.api_key and self.api_keys:
+            self.api_key = self.api_keys[0][1]
+
         if self.default_prompt:
             self.prompt_filename_var.set(self.default_prompt)
         else:
@@ -2135,7 +2074,7 @@ Tekst:
 
     def select_folder(self):
         """ wybór folderu """
-        if self.is_transcribing:
+        if self.is_transcribing or self.batch_running:
             return
 
         initial_dir = os.getcwd() # domyślnie bieżący katalog
@@ -2159,18 +2098,7 @@ Tekst:
     def load_file_list(self, folder):
         """ ładowanie listy plików skanów ze wskazanego folderu"""
         try:
-            all_files = os.listdir(folder)
-            images = [f for f in all_files if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            images.sort()
-
-            self.file_pairs = []
-            for img in images:
-                base = os.path.splitext(img)[0]
-                self.file_pairs.append({
-                    'img': os.path.join(folder, img),
-                    'txt': os.path.join(folder, base + ".txt"),
-                    'name': base
-                })
+            self.file_pairs = list_file_pairs(folder)
 
             if not self.file_pairs:
                 messagebox.showinfo("Info", self.t["scan_files_missing"], parent=self.root)
@@ -2229,6 +2157,16 @@ Tekst:
         except Exception as e:
             print(e)
 
+        # transkrypcja w częściach: wybór zapisany w metadanych strony lub rozmiar skanu
+        try:
+            tiles = load_metadata(metadata_path(pair['txt'])).get("tiles")
+        except Exception as e:
+            print(e)
+            tiles = None
+        if tiles is None and self.original_image is not None and self.tile_min_pixels:
+            tiles = self.original_image.width * self.original_image.height >= self.tile_min_pixels
+        self.tile_var.set(bool(tiles))
+
         # tekst
         self.text_area.delete(1.0, tk.END)
         if os.path.exists(pair['txt']):
@@ -2278,8 +2216,10 @@ Tekst:
     def load_prompt_content(self, filepath):
         """ wczytuje treść promptu z pliku """
         try:
+            old_prompt = self.prompt_text
             with open(filepath, 'r', encoding='utf-8') as f:
                 self.prompt_text = f.read()
+            self._prompt_changed(old_prompt)
 
             filename = os.path.basename(filepath)
             self.prompt_filename_var.set(f"{filename}")
@@ -2348,6 +2288,9 @@ Tekst:
         content = self.text_area.get(1.0, tk.END).strip()
         if content:
             content += "\n"
+        elif pair['img'] in self.batch_pages:
+            # pusty edytor nie nadpisuje transkrypcji zapisywanej przez serię w tle
+            return
 
         try:
             with open(pair['txt'], 'w', encoding='utf-8') as f:
@@ -2451,20 +2394,7 @@ Tekst:
             return
 
         try:
-            merged_content = []
-
-            for pair in self.file_pairs:
-                txt_path = pair['txt']
-                if os.path.exists(txt_path):
-                    with open(txt_path, 'r', encoding='utf-8') as f:
-                        text_content = f.read().strip()
-                        if text_content:
-                            merged_content.append(text_content)
-
-            final_text = "\n\n".join(merged_content)
-
-            with open(target_path, 'w', encoding='utf-8') as f:
-                f.write(final_text)
+            export_txt(self.file_pairs, target_path)
 
             messagebox.showinfo(self.t["msg_csv_ok_title"],
                                 self.t["msg_export_txt_text"] + f":\n{os.path.basename(target_path)}",
@@ -2491,31 +2421,7 @@ Tekst:
             return
 
         try:
-            doc = Document()
-
-            for pair in self.file_pairs:
-                if os.path.exists(pair['txt']):
-                    all_lines = []
-                    with open(pair['txt'], 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                        all_lines.extend([line.strip() for line in lines])
-
-                    full_text = ""
-                    for line in all_lines:
-                        if not line:
-                            full_text += '\n\n'
-
-                        if full_text == "":
-                            full_text = line
-                        else:
-                            if full_text.endswith("-"):
-                                full_text = full_text[:-1] + line
-                            else:
-                                full_text += " " + line
-
-                    doc.add_paragraph(full_text)
-
-            doc.save(path)
+            export_docx(self.file_pairs, path)
 
             messagebox.showinfo(self.t["msg_csv_ok_title"],
                                 self.t["msg_export_docx_text"] + f":\n{os.path.basename(path)}",
@@ -2532,9 +2438,27 @@ Tekst:
         except Exception as e:
             print(e)
 
+        # wpisy pamięci kontekstu nie są już potrzebne (przechowywanie w API jest płatne)
+        try:
+            self.engine.run(self.prompt_context.invalidate(), timeout=5)
+        except Exception as e:
+            print(e)
+
+        try:
+            self.engine.run(self.client_manager.aclose(), timeout=5)
+        except Exception as e:
+            print(e)
+
+        self.engine.shutdown()
+        self.client_manager.close()
         self.root.destroy()
 
 
+    def _dispatch(self, callback, *args):
+        """ jedyny punkt przekazywania wyników z silnika Gemini do wątku GUI """
+        self.root.after(0, callback, *args)
+
+
     def show_magnifier(self, event):
         """ utworzenie okna lupy po naciśnięciu prawego przycisku myszy """
         if not self.original_image:
@@ -2604,8 +2528,10 @@ Tekst:
 
 
     def open_batch_dialog(self):
-        """ otwiera okno dialogowe do przetwarzania seryjnego """
-        if self.is_transcribing:
+        """ otwiera okno dialogowe do przetwarzania seryjnego (okno niemodalne - w trakcie serii
+            można pracować w edytorze, zapytania z edytora mają pierwszeństwo przed serią)
+        """
+        if self.is_transcribing or self.batch_running:
             messagebox.showwarning(self.t["msg_warning"],
                                    self.t["msg_batch_warning_text"], parent=self.root)
             return
@@ -2620,7 +2546,15 @@ Tekst:
         batch_win.title(self.t["batch_win_title"])
         batch_win.geometry("800x700")
         batch_win.transient(self.root)
-        batch_win.grab_set()
+
+        # stan okna dla zadań serii (zadania działają w wątku silnika i nie odwołują się do Tk)
+        window_state = {"open": True}
+
+        def on_destroy(event):
+            if event.widget is batch_win:
+                window_state["open"] = False
+
+        batch_win.bind("<Destroy>", on_destroy, add="+")
 
         # nagłówek
         ttk.Label(batch_win, text=self.t["batch_label_text"], font=("Segoe UI", 12, "bold")).pack(pady=10)
@@ -2634,21 +2568,14 @@ Tekst:
         self.batch_vars = [] # pary (indeks_pliku, zmienna_boolean)
         self.batch_checkbox_widgets = []
 
-        for idx, pair in enumerate(self.file_pairs):
-            txt_path = pair['txt']
+        # dziennik serii dla bieżącego katalogu (stan poprzednich, także przerwanych, serii)
+        self.batch_journal = BatchJournal(os.path.dirname(self.file_pairs[0]['img']))
+        self.batch_hashes = {}
+        self.batch_similar = {}
 
+        for idx, pair in enumerate(self.file_pairs):
             # logika domyślnego zaznaczania
-            should_select = False
-            status_text = ""
-
-            if not os.path.exists(txt_path):
-                should_select = True
-                status_text = self.t["batch_status_text1"]
-            elif os.path.getsize(txt_path) == 0:
-                should_select = True
-                status_text = self.t["batch_status_text2"]
-            else:
-                status_text = self.t["batch_status_text3"]
+            label, should_select = self._batch_page_label(pair)
 
             var = tk.BooleanVar(value=should_select)
             self.batch_vars.append((idx, var))
@@ -2657,7 +2584,7 @@ Tekst:
             row = ttk.Frame(list_frame)
             row.pack(fill=X, pady=2)
 
-            cb = ttk.Checkbutton(row, text=f"{pair['name']} {status_text}", variable=var, bootstyle="round-toggle")
+            cb = ttk.Checkbutton(row, text=label, variable=var, bootstyle="round-toggle")
             cb.pack(side=LEFT)
             self.batch_checkbox_widgets.append(cb)
 
@@ -2672,6 +2599,74 @@ Tekst:
         self.batch_progress = ttk.Progressbar(batch_win, mode='determinate', bootstyle="success-striped")
         self.batch_progress.pack(fill=X, side=BOTTOM, padx=10, pady=5)
 
+        # prognoza kosztu zaznaczonych stron i limit kosztu serii
+        estimate_frame = ttk.Frame(batch_win, padding=(10, 0))
+        estimate_frame.pack(fill=X, side=BOTTOM)
+        estimate_var = tk.StringVar()
+        ttk.Label(estimate_frame, textvariable=estimate_var, bootstyle="info",
+                  font=("Segoe UI", 9)).pack(side=LEFT)
+        budget_var = tk.StringVar(value=f"{self.batch_budget:g}")
+        ttk.Entry(estimate_frame, textvariable=budget_var, width=8).pack(side=RIGHT)
+        ttk.Label(estimate_frame, text=self.t["batch_budget"]).pack(side=RIGHT, padx=5)
+
+        # liczba równoległych zapytań
+        concurrency_var = tk.IntVar(value=self.batch_concurrency)
+        # tryb Batch API (jedno zadanie dla wszystkich stron, wynik po zakończeniu na serwerze)
+        batch_api_var = tk.BooleanVar(value=False)
+        # transkrypcja i nazwy własne w jednym zapytaniu
+        combined_var = tk.BooleanVar(value=self.combined_ner)
+        # małe skany po kilka w jednym zapytaniu
+        pack_var = tk.BooleanVar(value=self.pack_images)
+        # najpierw szybki model, strony z niepewnym odczytem ponownie dokładniejszym
+        cascade_var = tk.BooleanVar(value=self.cascade)
+        folder = os.path.dirname(self.file_pairs[0]['img'])
+        # szacowanie kosztu dla bieżącego promptu (osobno dla trybu łączonego z NER)
+        estimators = {}
+        max_side = self.image_max_side if self.image_preprocess else None
+
+        def current_estimate():
+            prompt_name = self.prompt_filename_var.get()
+            tag = transcription_tag(prompt_name, combined_var.get())
+            # strony pogrupowane według modelu wybranego przez reguły (bez analizy obrazów)
+            pages_by_model = {}
+            for idx, var in self.batch_vars:
+                if var.get():
+                    pair = self.file_pairs[idx]
+                    # w trybie dwuetapowym prognoza pierwszego etapu (bez stron transkrybowanych ponownie)
+                    if cascade_var.get() and not combined_var.get() and not batch_api_var.get():
+                        model = self.cascade_model
+                    else:
+                        model = self.model_router.known_model(pair, prompt_name)
+                    pages_by_model.setdefault(model, []).append(pair)
+
+            estimate = {"pages": 0, "input": 0, "output": 0, "cost": 0.0}
+            history_pages = 0
+            for model, pairs in pages_by_model.items():
+                if (tag, model) not in estimators:
+                    estimators[(tag, model)] = CostEstimator(folder, self.file_pairs, model,
+                                                             self.prompt_text, tag, max_side)
+                estimator = estimators[(tag, model)]
+                history_pages += estimator.history_pages
+                for key, value in estimator.estimate(pairs, batch=batch_api_var.get()).items():
+                    estimate[key] += value
+            return history_pages, estimate
+
+        def update_estimate(*_):
+            history_pages, estimate = current_estimate()
+            text = (self.t["batch_estimate"] + f" ({estimate['pages']}): ~{estimate['input']:,} / "
+                    + f"~{estimate['output']:,} " + self.t["batch_tokens"] + f", ~${estimate['cost']:.4f} ")
+            if history_pages:
+                text += self.t["batch_estimate_history"] + f" {history_pages})"
+            else:
+                text += self.t["batch_estimate_no_history"]
+            estimate_var.set(text)
+
+        def read_budget():
+            try:
+                return max(0.0, float(budget_var.get().replace(',', '.') or 0))
+            except ValueError:
+                return self.batch_budget
+
         # funkcje przycisków
         def select_all():
             for _, v in self.batch_vars:
@@ -2681,24 +2676,123 @@ Tekst:
             for _, v in self.batch_vars:
                 v.set(False)
 
+        def select_names(names):
+            names = set(names)
+            for idx, v in self.batch_vars:
+                v.set(self.file_pairs[idx]['name'] in names)
+
         def start_batch():
             selected_indices = [idx for idx, var in self.batch_vars if var.get()]
             if not selected_indices:
                 messagebox.showwarning("Info", self.t["batch_no_files_selected"], parent=batch_win)
                 return
 
+            try:
+                concurrency = max(1, min(16, int(concurrency_var.get())))
+            except (tk.TclError, ValueError):
+                concurrency = self.batch_concurrency
+
+            # prognoza przekraczająca limit kosztu (np. seria z niewłaściwym promptem)
+            budget = read_budget()
+            _, estimate = current_estimate()
+            if budget and estimate["cost"] > budget and not batch_api_var.get():
+                if not messagebox.askyesno(self.t["msg_warning"],
+                                           self.t["batch_estimate_over_budget"]
+                                           + f" ~${estimate['cost']:.4f} > ${budget:g}",
+                                           parent=batch_win):
+                    return
+
+            # powtórzone skany: kopia transkrypcji zamiast zapytania do modelu
+            batch_names = [self.file_pairs[idx]['name'] for idx in selected_indices]
+            duplicates = find_duplicates(self.file_pairs, self.batch_hashes, batch_names,
+                                         self.duplicate_threshold)
+            if duplicates:
+                listing = "\n".join(f"{name} = {source}" for name, source in list(duplicates.items())[:15])
+                if len(duplicates) > 15:
+                    listing += "\n..."
+                if not messagebox.askyesno(self.t["batch_duplicates_title"],
+                                           self.t["batch_duplicates_text"] + f" ({len(duplicates)}):\n\n"
+                                           + listing, parent=batch_win):
+                    duplicates = {}
+
+            if (concurrency != self.batch_concurrency or combined_var.get() != self.combined_ner
+                    or budget != self.batch_budget or pack_var.get() != self.pack_images
+                    or cascade_var.get() != self.cascade):
+                self.batch_concurrency = concurrency
+                self.combined_ner = combined_var.get()
+                self.batch_budget = budget
+                self.pack_images = pack_var.get()
+                self.cascade = cascade_var.get()
+                self.save_config()
+
             # blokada i włączenie przycisków
-            btn_start.config(state="disabled")
+            for btn in (btn_start, btn_resume, btn_retry):
+                btn.config(state="disabled")
             btn_cancel_batch.config(state="normal")
 
-            # uruchomienie wątku
-            self.is_transcribing = True
+            # zapis kolejki w dzienniku serii; treść i nazwa promptu są ustalone na czas całej serii
+            # (zmiana promptu w edytorze w trakcie serii nie dotyczy stron serii)
+            prompt_text, prompt_name = self.prompt_text, self.prompt_filename_var.get()
+            self.batch_journal.queue([self.file_pairs[idx]['name'] for idx in selected_indices],
+                                     prompt=prompt_name)
+
+            # uruchomienie zadania w silniku Gemini
+            self.batch_running = True
+            self.batch_pages = {self.file_pairs[idx]['img'] for idx in selected_indices}
             self.stop_batch_flag = False
 
-            thread = threading.Thread(target=self._batch_worker,
-                                      args=(selected_indices, batch_win, btn_start, btn_cancel_batch))
-            thread.daemon = True
-            thread.start()
+            if batch_api_var.get():
+                pairs = []
+                pairs_by_name = {pair['name']: pair for pair in self.file_pairs}
+                for idx in selected_indices:
+                    pair = self.file_pairs[idx]
+                    source = duplicates.get(pair['name'])
+                    # w trybie Batch API kopiowane są tylko transkrypcje istniejące przed serią
+                    stats = None
+                    if source and source not in batch_names:
+                        stats = copy_transcription(pair, pairs_by_name[source])
+                    if stats:
+                        self.batch_journal.mark_done(pair['name'], **stats)
+                    else:
+                        pairs.append(pair)
+                if not pairs:
+                    total = len(selected_indices)
+                    self._batch_finished(batch_win, batch_buttons, total, total, 0, False)
+                    return
+                self.engine.submit(self._batch_api_job(folder, pairs, batch_win, batch_buttons, window_state,
+                                                       prompt_text=prompt_text, prompt_name=prompt_name))
+            else:
+                self.engine.submit(self._batch_job(selected_indices, batch_win, batch_buttons, concurrency,
+                                                   prompt_text, prompt_name, window_state,
+                                                   combined=self.combined_ner,
+                                                   budget=BudgetGuard(self.batch_budget),
+                                                   duplicates=duplicates, pack=self.pack_images,
+                                                   cascade=self.cascade))
+            self._refresh_batch_list_ui()
+
+        def resume_batch():
+            # zadanie Batch API wysłane wcześniej - wznowienie oczekiwania na wynik
+            record = load_job(folder)
+            if record:
+                for btn in (btn_start, btn_resume, btn_retry):
+                    btn.config(state="disabled")
+                btn_cancel_batch.config(state="normal")
+                self.batch_running = True
+                self.batch_pages = {pair['img'] for pair in self.file_pairs if pair['name'] in record["pages"]}
+                self.stop_batch_flag = False
+                self.engine.submit(self._batch_api_job(folder, None, batch_win, batch_buttons, window_state,
+                                                       record=record))
+                self._refresh_batch_list_ui()
+                return
+
+            # wznowienie: strony z kolejki i przerwane w trakcie poprzedniej serii
+            select_names(self.batch_journal.pending())
+            start_batch()
+
+        def retry_failed():
+            # ponowienie stron zakończonych błędem
+            select_names(self.batch_journal.failed())
+            start_batch()
 
         ttk.Button(btn_panel, text=self.t["batch_select_all"], command=select_all,
                    bootstyle="outline-secondary").pack(side=LEFT, padx=5)
@@ -2714,90 +2808,609 @@ Tekst:
                                bootstyle="outline-danger", state="disabled")
         btn_cancel_batch.pack(side=RIGHT, padx=5)
 
+        btn_retry = ttk.Button(btn_panel, text=self.t["btn_batch_retry_failed"], command=retry_failed,
+                               bootstyle="outline-warning",
+                               state="normal" if self.batch_journal.failed() else "disabled")
+        btn_retry.pack(side=RIGHT, padx=5)
+
+        btn_resume = ttk.Button(btn_panel, text=self.t["btn_batch_resume"], command=resume_batch,
+                                bootstyle="outline-warning",
+                                state="normal" if self.batch_journal.pending() or load_job(folder)
+                                else "disabled")
+        btn_resume.pack(side=RIGHT, padx=5)
+
+        batch_buttons = {"start": btn_start, "cancel": btn_cancel_batch,
+                         "resume": btn_resume, "retry": btn_retry}
+
+        ttk.Spinbox(btn_panel, from_=1, to=16, width=3, textvariable=concurrency_var,
+                    state="readonly").pack(side=RIGHT, padx=(0, 10))
+        ttk.Label(btn_panel, text=self.t["batch_concurrency"]).pack(side=RIGHT, padx=5)
+        ttk.Checkbutton(btn_panel, text=self.t["batch_api_mode"], variable=batch_api_var,
+                        bootstyle="round-toggle").pack(side=RIGHT, padx=5)
+        ttk.Checkbutton(btn_panel, text=self.t["batch_combined_ner"], variable=combined_var,
+                        bootstyle="round-toggle").pack(side=RIGHT, padx=5)
+        ttk.Checkbutton(btn_panel, text=self.t["batch_pack"], variable=pack_var,
+                        bootstyle="round-toggle").pack(side=RIGHT, padx=5)
+        ttk.Checkbutton(btn_panel, text=self.t["batch_cascade"], variable=cascade_var,
+                        bootstyle="round-toggle").pack(side=RIGHT, padx=5)
+
+        # prognoza aktualizowana przy każdej zmianie zaznaczenia i trybu serii
+        for var in [var for _, var in self.batch_vars] + [batch_api_var, combined_var, cascade_var]:
+            var.trace_add("write", update_estimate)
+        update_estimate()
+
+        # skróty obrazów liczone w tle, duplikaty oznaczane na liście po ich obliczeniu
+        def hashes_ready(hashes):
+            self.batch_hashes = hashes
+            self.batch_similar = find_duplicates(self.file_pairs, hashes,
+                                                 [pair['name'] for pair in self.file_pairs],
+                                                 self.duplicate_threshold)
+            if batch_win.winfo_exists():
+                for idx in range(len(self.batch_checkbox_widgets)):
+                    self._refresh_batch_page(idx)
+
+        self.engine.submit(build_hash_index(folder, self.file_pairs, self.engine.images),
+                           on_success=hashes_ready,
+                           on_error=lambda e: print(f"{folder}: {e}"))
+
+
+    def _batch_page_status(self, pair):
+        """ stan strony w oknie serii na podstawie pliku txt i dziennika serii:
+            (opis stanu, czy zaznaczyć stronę do przetwarzania)
+        """
+        journal_status = self.batch_journal.status(pair['name']) if self.batch_journal else None
+        txt_path = pair['txt']
+
+        if journal_status == FAILED:
+            error = (self.batch_journal.error(pair['name']) or "")[:60]
+            return self.t["batch_status_failed"] + f" {error}", True
+        if journal_status == IN_FLIGHT and self.batch_journal.job(pair['name']):
+            # strona w zadaniu Batch API, wynik po zakończeniu zadania na serwerze
+            return self.t["batch_status_batch_api"], False
+        if journal_status in (QUEUED, IN_FLIGHT):
+            if not self.batch_running:
+                # strona pozostała w kolejce lub w trakcie po przerwaniu poprzedniej serii
+                return self.t["batch_status_interrupted"], True
+            if journal_status == IN_FLIGHT:
+                stats = self.batch_live.get(pair['name'])
+                if stats:
+                    # liczba tokenów z metadanych lub szacowana z długości tekstu
+                    tokens = stats.get("output_tokens") or stats.get("chars", 0) // 4
+                    status = self.t["batch_status_in_flight"] + f" {tokens} " + self.t["batch_tokens"]
+                    if stats.get("ttft") is not None:
+                        status += f", TTFT {stats['ttft']:.1f} s"
+                    return status, True
+                return self.t["batch_status_in_flight"], True
+            return self.t["batch_status_queued"], True
+
+        if not os.path.exists(txt_path):
+            return self.t["batch_status_text1"], True
+        if os.path.getsize(txt_path) == 0:
+            return self.t["batch_status_text2"], True
+        copied_from = self.batch_journal.copied_from(pair['name']) if self.batch_journal else None
+        if copied_from:
+            return self.t["batch_status_text3"] + f" ({self.t['batch_status_copied']} {copied_from})", False
+        ttft = self.batch_journal.ttft(pair['name']) if self.batch_journal else None
+        if ttft is not None:
+            return self.t["batch_status_text3"] + f" TTFT {ttft:.1f} s", False
+        return self.t["batch_status_text3"], False
+
+
+    def _batch_page_label(self, pair):
+        """ etykieta strony w oknie serii (nazwa, stan, powtórzony skan) i czy zaznaczyć stronę """
+        status, should_select = self._batch_page_status(pair)
+        label = f"{pair['name']} {status}"
+        source = self.batch_similar.get(pair['name'])
+        if source:
+            label += f" [{self.t['batch_status_duplicate']} {source}]"
+        return label, should_select
+
 
     def _refresh_batch_list_ui(self):
         """ aktualizacja checkboxów: odznaczanie tych, które mają już transkrypcję """
         for i, (idx, var) in enumerate(self.batch_vars):
             pair = self.file_pairs[idx]
-            txt_path = pair['txt']
+            label, should_select = self._batch_page_label(pair)
 
-            # aktualny stan pliku
-            exists = os.path.exists(txt_path)
-            is_not_empty = exists and os.path.getsize(txt_path) > 0
-
-            if is_not_empty:
+            if not should_select:
                 var.set(False)
-                status = self.t["batch_status_text3"]
-            else:
-                # jeśli plik nadal jest pusty/brakujący
-                status = self.t["batch_status_text1"] if not exists else self.t["batch_status_text2"]
 
             # aktualizacja etykiety checkboxa
             if i < len(self.batch_checkbox_widgets):
-                self.batch_checkbox_widgets[i].config(text=f"{pair['name']} {status}")
+                self.batch_checkbox_widgets[i].config(text=label)
+
+
+    def _refresh_batch_page(self, idx):
+        """ aktualizacja etykiety jednej strony w oknie serii (statystyki w trakcie strumieniowania) """
+        if self.batch_checkbox_widgets and idx < len(self.batch_checkbox_widgets):
+            label, _ = self._batch_page_label(self.file_pairs[idx])
+            try:
+                self.batch_checkbox_widgets[idx].config(text=label)
+            except tk.TclError:
+                # okno serii zostało zamknięte
+                pass
 
 
     def cancel_batch_processing(self):
-        """ ustawienie flagi przerwania przetwarzania seryjnego """
-        if self.is_transcribing:
+        """ przerwanie przetwarzania seryjnego: kolejne strony nie są zlecane, a strony w trakcie
+            przetwarzania są przerywane wraz z zapytaniami do API i wracają do kolejki
+        """
+        if self.batch_running:
             self.stop_batch_flag = True
+            self.engine.cancel_tasks(self.batch_tasks)
             self.batch_log_label.config(text=self.t["msg_stop_batch"])
 
 
-    def _batch_worker(self, selected_indices, window, btn_start, btn_cancel_batch):
-        """ wątek przetwarzający listę plików """
+    async def _batch_job(self, selected_indices, window, buttons, concurrency, prompt_text, prompt_name,
+                         window_state, combined=False, budget=None, duplicates=None, pack=False, cascade=False):
+        """ przetwarzanie listy plików, do 'concurrency' zapytań jednocześnie
+            (prompt_text, prompt_name - treść i nazwa promptu odczytane w wątku GUI przy
+            rozpoczęciu serii i używane dla wszystkich stron, window_state['open'] - okno
+            serii jest otwarte; okno i pozostałe elementy GUI są obsługiwane wyłącznie przez
+            dispatch; combined - transkrypcja i nazwy własne w jednym zapytaniu, budget - limit kosztu,
+            po jego osiągnięciu kolejne strony pozostają w kolejce do wznowienia, duplicates -
+            powtórzone skany, dla których kopiowana jest transkrypcja strony źródłowej,
+            pack - małe skany wysyłane po kilka w jednym zapytaniu, cascade - najpierw szybki
+            model, strony z niepewnym odczytem ponownie modelem wybranym dla strony)
+        """
+        # zapytania serii ustępują miejsca zapytaniom z edytora
+        set_request_priority(PRIORITY_BATCH)
+        budget = budget or BudgetGuard()
+        usage_callback = self._batch_usage_callback(transcription_tag(prompt_name, combined), budget)
         total = len(selected_indices)
-        errors = 0
+        progress = {"started": 0, "done": 0, "errors": 0}
+        semaphore = asyncio.Semaphore(concurrency)
+        journal = self.batch_journal
+        duplicate_pages = DuplicatePages(self.file_pairs, duplicates,
+                                         [self.file_pairs[idx]['name'] for idx in selected_indices])
 
-        for i, idx in enumerate(selected_indices):
+        async def process(idx):
+            pair = self.file_pairs[idx]
+            success = False
+            try:
+                # powtórzony skan - kopia transkrypcji strony źródłowej (po jej zakończeniu)
+                stats = await duplicate_pages.copy(pair)
+                if stats is not None:
+                    journal.mark_done(pair['name'], **stats)
+                    success = True
+                    progress["done"] += 1
+                    msg = (self.t["batch_process_text"] + f" [{progress['done']}/{total}]: {pair['name']} "
+                           + f"({self.t['batch_status_copied']} {stats['copied_from']})")
+                    self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+                    self.engine.dispatch(self._refresh_batch_list_ui)
+                    self.engine.dispatch(self._batch_page_done, pair)
+                    return
+                success = await transcribe(idx)
+            finally:
+                duplicate_pages.source_done(pair['name'], success)
+
+        async def transcribe(idx):
+            async with semaphore:
+                # po anulowaniu, zamknięciu okna lub osiągnięciu limitu kosztu kolejne pliki nie są już zlecane
+                if self.stop_batch_flag or budget.exceeded or not window_state["open"]:
+                    return False
+
+                pair = self.file_pairs[idx]
+                task = asyncio.current_task()
+                self.batch_tasks.add(task)
+                progress["started"] += 1
+                msg = self.t["batch_process_text"] + f" [{progress['started']}/{total}]: {pair['name']}..."
+                self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+                journal.mark_in_flight(pair['name'])
+                self.engine.dispatch(self._refresh_batch_list_ui)
 
-            if self.stop_batch_flag:
-                self.root.after(0, lambda: self.batch_log_label.config(text=self.t["msg_process_stopped"]))
-                break
+                try:
+                    model = await self.model_router.page_model(pair, prompt_name, self.engine.images)
+                    if combined:
+                        stats = await transcribe_ner_page(self.engine, pair, prompt_text, model=model,
+                                                          usage_callback=usage_callback,
+                                                          empty_message=self.t["msg_empty_response"],
+                                                          tile_min_pixels=self.tile_min_pixels)
+                    else:
+                        stats = await self._transcribe_batch_file(pair, idx, prompt_text, usage_callback, model,
+                                                                  cascade)
+                    journal.mark_done(pair['name'], **stats)
+                    success = True
+                except asyncio.CancelledError:
+                    if not self.stop_batch_flag:
+                        raise
+                    # seria przerwana przez użytkownika - strona wraca do kolejki
+                    journal.mark_interrupted(pair['name'])
+                    self.engine.dispatch(self._refresh_batch_list_ui)
+                    return False
+                except Exception as e:
+                    success = False
+                    progress["errors"] += 1
+                    journal.mark_failed(pair['name'], e)
+                    print(self.t["batch_worker_file_error"] + f" {pair['name']}: {e}")
+                finally:
+                    self.batch_tasks.discard(task)
+
+                progress["done"] += 1
+                msg = self.t["batch_process_text"] + f" [{progress['done']}/{total}]: {pair['name']}"
+                if success and stats.get("escalated"):
+                    msg += f" ({self.t['batch_status_escalated']})"
+                if success and stats.get("fallback"):
+                    msg += f" ({self.t['batch_status_fallback']}: {stats['fallback']})"
+                self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+                self.engine.dispatch(self._refresh_batch_list_ui)
+                self.engine.dispatch(self._batch_page_done, pair)
+                return success
+
+        async def process_pack(indices):
+            pairs = [self.file_pairs[idx] for idx in indices]
+            results = {}
+            try:
+                async with semaphore:
+                    if self.stop_batch_flag or budget.exceeded or not window_state["open"]:
+                        return
+
+                    task = asyncio.current_task()
+                    self.batch_tasks.add(task)
+                    progress["started"] += len(pairs)
+                    names = ", ".join(pair['name'] for pair in pairs)
+                    msg = self.t["batch_process_text"] + f" [{progress['started']}/{total}]: {names}..."
+                    self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+                    for pair in pairs:
+                        journal.mark_in_flight(pair['name'])
+                    self.engine.dispatch(self._refresh_batch_list_ui)
+
+                    try:
+                        results = await transcribe_pack(self.engine, pairs, prompt_text,
+                                                        model=models[pairs[0]['name']],
+                                                        usage_callback=usage_callback,
+                                                        empty_message=self.t["msg_empty_response"])
+                    except asyncio.CancelledError:
+                        if not self.stop_batch_flag:
+                            raise
+                        for pair in pairs:
+                            journal.mark_interrupted(pair['name'])
+                        self.engine.dispatch(self._refresh_batch_list_ui)
+                        return
+                    except Exception as e:
+                        results = {pair['name']: e for pair in pairs}
+                    finally:
+                        self.batch_tasks.discard(task)
+
+                    for pair in pairs:
+                        result = results[pair['name']]
+                        if isinstance(result, Exception):
+                            progress["errors"] += 1
+                            journal.mark_failed(pair['name'], result)
+                            print(self.t["batch_worker_file_error"] + f" {pair['name']}: {result}")
+                        else:
+                            journal.mark_done(pair['name'], **result)
+                        progress["done"] += 1
+                        self.engine.dispatch(self._batch_page_done, pair)
+
+                    msg = self.t["batch_process_text"] + f" [{progress['done']}/{total}]: {names}"
+                    self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+                    self.engine.dispatch(self._refresh_batch_list_ui)
+            finally:
+                for pair in pairs:
+                    duplicate_pages.source_done(pair['name'], isinstance(results.get(pair['name']), dict))
+
+        # małe skany (bez duplikatów) łączone po kilka w jednym zapytaniu, pozostałe pojedynczo
+        packs = {}
+        models = {}
+        # w trybie dwuetapowym każda strona jest oceniana osobno
+        if pack and not combined and not cascade:
+            index_by_name = {self.file_pairs[idx]['name']: idx for idx in selected_indices}
+            candidates = [self.file_pairs[idx] for idx in selected_indices
+                          if self.file_pairs[idx]['name'] not in (duplicates or {})]
+            # w jednym zapytaniu tylko strony, dla których wybrano ten sam model
+            for pair, model in zip(candidates, await asyncio.gather(
+                    *(self.model_router.page_model(pair, prompt_name, self.engine.images) for pair in candidates))):
+                models[pair['name']] = model
+            units = await asyncio.to_thread(pack_small_pages, candidates, self.pack_max_pixels, self.pack_size,
+                                            lambda pair: models[pair['name']])
+            for unit in units:
+                if len(unit) > 1:
+                    indices = [index_by_name[pair['name']] for pair in unit]
+                    packs.update({idx: indices for idx in indices})
+
+        await asyncio.gather(*(process_pack(packs[idx]) if idx in packs else process(idx)
+                               for idx in selected_indices if idx not in packs or packs[idx][0] == idx))
+
+        self.engine.dispatch(self._batch_finished, window, buttons,
+                             progress["done"], total, progress["errors"], self.stop_batch_flag,
+                             budget if budget.exceeded and journal.pending() else None)
+
+
+    def _batch_page_done(self, pair):
+        """ odświeżenie edytora, jeśli wyświetlana jest strona właśnie przetworzona w tle """
+        if self.file_pairs and not self.is_transcribing:
+            if self.file_pairs[self.current_index]['img'] == pair['img']:
+                self.load_pair(self.current_index)
+
+
+    def _batch_finished(self, window, buttons, done, total, errors, interrupted, budget=None):
+        """ aktualizacja GUI po zakończeniu przetwarzania seryjnego
+            (budget - limit kosztu, którego osiągnięcie wstrzymało serię)
+        """
+        current_in_batch = bool(self.file_pairs) and self.file_pairs[self.current_index]['img'] in self.batch_pages
+        self.batch_running = False
+        self.batch_pages = set()
+        self.stop_batch_flag = False
 
-            # czy okno nie zostało zamknięte
-            if not window.winfo_exists():
-                break
+        # zakończono
+        if window.winfo_exists():
+            status = self.t["msg_finished"] if not interrupted else self.t["msg_interrupted"]
+            if budget is not None:
+                status = self.t["msg_budget_reached"] + f" (${budget.spent:.4f} / ${budget.limit:g}). "
+            final_msg = status + self.t["batch_final_msg1"] + f": {done}/{total}. " + self.t["batch_final_msg2"] + f": {errors}."
+            self._update_batch_ui(final_msg, 100)
+            buttons["start"].config(state="normal")
+            buttons["cancel"].config(state="disabled")
+            if self.batch_journal.pending():
+                buttons["resume"].config(state="normal")
+            if self.batch_journal.failed():
+                buttons["retry"].config(state="normal")
+            self._refresh_batch_list_ui()
+            messagebox.showinfo(self.t["batch_final_msg_title"], final_msg, parent=window)
+
+        # odświeżanie widoku w głównym oknie (jeśli aktualnie wyświetlany plik był w serii)
+        if current_in_batch and not self.is_transcribing:
+            self.load_pair(self.current_index)
 
-            pair = self.file_pairs[idx]
-            img_path = pair['img']
-            txt_path = pair['txt']
 
-            # aktualizacja GUI
-            progress_pct = (i / total) * 100
-            msg = self.t["batch_process_text"] + f" [{i+1}/{total}]: {pair['name']}..."
+    async def _batch_api_job(self, folder, pairs, window, buttons, window_state, prompt_text=None, prompt_name=None,
+                             record=None):
+        """ seria w trybie Batch API: wysłanie zadania (lub wznowienie oczekiwania na zapisane
+            zadanie), sprawdzanie stanu i zapis wyników do plików txt (prompt_text, prompt_name,
+            window_state - patrz _batch_job)
+        """
+        set_request_priority(PRIORITY_BATCH)
+        journal = self.batch_journal
+        try:
+            if record is None:
+                self.engine.dispatch(self._update_batch_ui, self.t["batch_api_preparing"], 0)
+                # jedno zadanie - jeden model: model wybrany dla większości stron
+                models = Counter(self.model_router.known_model(pair, prompt_name) for pair in pairs)
+                record = await self.batch_api.submit(folder, pairs, prompt_text, prompt_name=prompt_name,
+                                                     model=models.most_common(1)[0][0])
+                for name in record["pages"]:
+                    journal.mark_in_flight(name, job=record["name"])
+                self.engine.dispatch(self._refresh_batch_list_ui)
+
+            total = len(record["pages"])
+
+            def on_state(state):
+                msg = self.t["batch_api_job"] + f" {record['name']}: {state}"
+                self.engine.dispatch(self._update_batch_ui, msg, 0)
+
+            job = await self.batch_api.wait(
+                record,
+                on_state=on_state,
+                should_stop=lambda: self.stop_batch_flag or not window_state["open"]
+            )
+            if job is None:
+                # zadanie pozostaje na serwerze, można wznowić oczekiwanie później
+                self.engine.dispatch(self._batch_finished, window, buttons, 0, total, 0, True)
+                self.engine.dispatch(self._update_batch_ui, self.t["batch_api_waiting_stopped"], 0)
+                return
+
+            usage_callback = self._batch_usage_callback(transcription_tag(record.get("prompt")))
+            done, errors = await self.batch_api.collect(folder, record, job, journal, usage_callback)
+            self.engine.dispatch(self._batch_finished, window, buttons, done + errors, total, errors, False)
+        except Exception as e:
+            print(self.t["batch_worker_file_error"] + f" {e}")
+            if record is None:
+                # zadanie nie zostało utworzone
+                remove_job(folder)
+                for pair in pairs:
+                    journal.mark_failed(pair['name'], e)
+                total = len(pairs)
+            else:
+                total = len(record["pages"])
+            self.engine.dispatch(self._batch_finished, window, buttons, 0, total, total, False)
+
+
+    async def _transcribe_batch_file(self, pair, idx, prompt_text, usage_callback=None, model=TRANSCRIPTION_MODEL,
+                                     cascade=False):
+        """ transkrypcja jednego pliku serii ze strumieniowaniem do pliku .partial,
+            zamienianego na plik txt po otrzymaniu pełnej odpowiedzi; zwraca statystyki strony
+            (cascade - najpierw szybki model, przy niepewnym odczycie ponownie modelem 'model')
+        """
+        last_refresh = [0.0]
+
+        def on_chunk(stats):
+            self.batch_live[pair['name']] = stats
+            # odświeżanie etykiety strony najwyżej dwa razy na sekundę
+            now = time.monotonic()
+            if now - last_refresh[0] >= 0.5:
+                last_refresh[0] = now
+                self.engine.dispatch(self._refresh_batch_page, idx)
 
-            self.root.after(0, lambda m=msg, v=progress_pct: self._update_batch_ui(m, v))
+        try:
+            if cascade:
+                # strona, dla której wybrano model pierwszego etapu, jest ponawiana modelem domyślnym
+                final_model = model if model != self.cascade_model else self.model_router.default
+                return await cascade_page(self.engine, pair, prompt_text, model=final_model,
+                                          first_model=self.cascade_model, on_chunk=on_chunk,
+                                          usage_callback=usage_callback,
+                                          empty_message=self.t["msg_empty_response"],
+                                          tile_min_pixels=self.tile_min_pixels,
+                                          max_marker_density=self.cascade_marker_density,
+                                          min_line_ratio=self.cascade_min_line_ratio)
+            return await transcribe_page(self.engine, pair, prompt_text, model=model, on_chunk=on_chunk,
+                                         usage_callback=usage_callback,
+                                         empty_message=self.t["msg_empty_response"],
+                                         tile_min_pixels=self.tile_min_pixels)
+        finally:
+            self.batch_live.pop(pair['name'], None)
+
+
+    def open_corpus_dialog(self):
+        """ okno przetwarzania korpusu: transkrypcja stron bez tekstu we wszystkich
+            podkatalogach wskazanego katalogu, ze wspólną kolejką i limitem zapytań
+        """
+        if self.is_transcribing or self.batch_running:
+            messagebox.showwarning(self.t["msg_warning"],
+                                   self.t["msg_batch_warning_text"], parent=self.root)
+            return
+
+        root_folder = filedialog.askdirectory(title=self.t["corpus_select_root"],
+                                              initialdir=os.getcwd(), parent=self.root)
+        if not root_folder:
+            return
 
+        corpus_win = tk.Toplevel(self.root)
+        corpus_win.title(self.t["corpus_win_title"])
+        corpus_win.geometry("700x260")
+        corpus_win.transient(self.root)
+
+        ttk.Label(corpus_win, text=root_folder, font=("Segoe UI", 10, "bold")).pack(pady=10, padx=10)
+        summary_label = ttk.Label(corpus_win, text=self.t["corpus_scanning"], bootstyle="secondary")
+        summary_label.pack(pady=(0, 10))
+
+        # panel przycisków sterujących
+        btn_panel = ttk.Frame(corpus_win, padding=10)
+        btn_panel.pack(fill=X, side=BOTTOM)
+
+        # logi postępu (wspólne z oknem serii)
+        self.batch_log_label = ttk.Label(corpus_win, text=self.t["batch_log_label"], bootstyle="inverse-secondary")
+        self.batch_log_label.pack(fill=X, side=BOTTOM, padx=10)
+
+        self.batch_progress = ttk.Progressbar(corpus_win, mode='determinate', bootstyle="success-striped")
+        self.batch_progress.pack(fill=X, side=BOTTOM, padx=10, pady=5)
+
+        concurrency_var = tk.IntVar(value=self.batch_concurrency)
+        corpus = {}
+        # stan okna dla zadania korpusu (zadanie działa w wątku silnika i nie odwołuje się do Tk)
+        window_state = {"open": True}
+
+        def on_destroy(event):
+            if event.widget is corpus_win:
+                window_state["open"] = False
+
+        corpus_win.bind("<Destroy>", on_destroy, add="+")
+
+        def show_summary(result):
+            corpus.update(result)
+            if not corpus_win.winfo_exists():
+                return
+            if not corpus:
+                summary_label.config(text=self.t["corpus_nothing_to_do"])
+                return
+            pages = sum(len(pairs) for _, pairs in corpus.values())
+            summary_label.config(text=self.t["corpus_summary"] + f": {len(corpus)}, "
+                                 + self.t["corpus_pages"] + f": {pages}")
+            btn_start.config(state="normal")
+
+        def scan_error(e):
+            if corpus_win.winfo_exists():
+                summary_label.config(text=self.t["msg_folder_scan_error"] + f": {e}")
+
+        def start_corpus():
             try:
-                # wywołanie API (ta sama metoda co przy pojedynczym pliku)
-                result_text = self._call_gemini_api(img_path)
+                concurrency = max(1, min(16, int(concurrency_var.get())))
+            except (tk.TclError, ValueError):
+                concurrency = self.batch_concurrency
+            if concurrency != self.batch_concurrency:
+                self.batch_concurrency = concurrency
+                self.save_config()
+
+            btn_start.config(state="disabled")
+            btn_cancel.config(state="normal")
+
+            self.batch_running = True
+            self.batch_pages = {pair['img'] for _, pairs in corpus.values() for pair in pairs}
+            self.stop_batch_flag = False
+            self.engine.submit(self._corpus_job(corpus, corpus_win, buttons, concurrency, self.prompt_text,
+                                                self.prompt_filename_var.get(), window_state))
+
+        btn_start = ttk.Button(btn_panel, text=self.t["btn_start"], command=start_corpus,
+                               bootstyle="danger", state="disabled")
+        btn_start.pack(side=RIGHT, padx=5)
+
+        btn_cancel = ttk.Button(btn_panel, text=self.t["btn_batch_cancel"],
+                                command=self.cancel_batch_processing,
+                                bootstyle="outline-danger", state="disabled")
+        btn_cancel.pack(side=RIGHT, padx=5)
+
+        buttons = {"start": btn_start, "cancel": btn_cancel}
 
-                # zapis do pliku
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(result_text + '\n')
+        ttk.Spinbox(btn_panel, from_=1, to=16, width=3, textvariable=concurrency_var,
+                    state="readonly").pack(side=RIGHT, padx=(0, 10))
+        ttk.Label(btn_panel, text=self.t["batch_concurrency"]).pack(side=RIGHT, padx=5)
 
+        # przeszukiwanie drzewa katalogów poza wątkiem GUI
+        self.engine.submit(asyncio.to_thread(scan_corpus, root_folder),
+                           on_success=show_summary, on_error=scan_error)
+
+
+    async def _corpus_job(self, corpus, window, buttons, concurrency, prompt_text, prompt_name, window_state):
+        """ transkrypcja stron korpusu: jedna kolejka dla wszystkich katalogów, strony
+            pobierane kolejno z każdego katalogu, zużycie tokenów zapisywane w tokens.log
+            katalogu strony z nazwą promptu; prompt_text, prompt_name - prompt ustalony przy
+            rozpoczęciu korpusu; window_state['open'] - okno korpusu jest otwarte
+            (okno i pozostałe elementy GUI są obsługiwane wyłącznie przez dispatch)
+        """
+        set_request_priority(PRIORITY_BATCH)
+        tag = transcription_tag(prompt_name)
+        queue = CorpusQueue()
+        for folder, (journal, pairs) in corpus.items():
+            journal.queue([pair['name'] for pair in pairs], prompt=prompt_name)
+            queue.add(folder, pairs)
+
+        total = len(queue)
+        progress = {"done": 0, "errors": 0}
+
+        async def process(folder, pair):
+            journal = corpus[folder][0]
+            journal.mark_in_flight(pair['name'])
+            task = asyncio.current_task()
+            self.batch_tasks.add(task)
+            try:
+                model = await self.model_router.page_model(pair, prompt_name, self.engine.images)
+                stats = await transcribe_page(self.engine, pair, prompt_text, model=model,
+                                              usage_callback=self.usage_log.callback(folder, tag),
+                                              empty_message=self.t["msg_empty_response"],
+                                              tile_min_pixels=self.tile_min_pixels)
+                journal.mark_done(pair['name'], **stats)
+            except asyncio.CancelledError:
+                if not self.stop_batch_flag:
+                    raise
+                # korpus przerwany przez użytkownika - strona wraca do kolejki katalogu
+                journal.mark_interrupted(pair['name'])
+                return
             except Exception as e:
-                errors += 1
-                print(self.t["batch_worker_file_error"] + f" {pair['name']}: {e}")
+                progress["errors"] += 1
+                journal.mark_failed(pair['name'], e)
+                print(self.t["batch_worker_file_error"] + f" {pair['img']}: {e}")
+            finally:
+                self.batch_tasks.discard(task)
 
-            self.root.after(0, self._refresh_batch_list_ui)
+            progress["done"] += 1
+            msg = (self.t["batch_process_text"] + f" [{progress['done']}/{total}]: "
+                   + f"{os.path.basename(folder)}/{pair['name']}")
+            self.engine.dispatch(self._update_batch_ui, msg, (progress["done"] / total) * 100)
+            self.engine.dispatch(self._batch_page_done, pair)
 
-        self.is_transcribing = False
+        await run_corpus(queue, process, concurrency,
+                         should_stop=lambda: self.stop_batch_flag or not window_state["open"])
+
+        self.engine.dispatch(self._corpus_finished, window, buttons,
+                             progress["done"], total, progress["errors"], self.stop_batch_flag)
+
+
+    def _corpus_finished(self, window, buttons, done, total, errors, interrupted):
+        """ aktualizacja GUI po zakończeniu przetwarzania korpusu """
+        self.batch_running = False
+        self.batch_pages = set()
         self.stop_batch_flag = False
 
-        # zakończono
         if window.winfo_exists():
-            status = self.t["msg_finished"] if not self.stop_batch_flag else self.t["msg_interrupted"]
-            final_msg = status + self.t["batch_final_msg1"] + f": {i}/{total}. " + self.t["batch_final_msg2"] + f": {errors}."
-            self.root.after(0, lambda: self._update_batch_ui(final_msg, 100))
-            self.root.after(0, lambda: btn_start.config(state="normal"))
-            self.root.after(0, lambda: btn_cancel_batch.config(state="disabled"))
-            self.root.after(0, self._refresh_batch_list_ui)
-            self.root.after(0, lambda: messagebox.showinfo(self.t["batch_final_msg_title"], final_msg, parent=window))
-
-            # odświeżanie widok w głównym oknie (jeśli aktualnie wyświetlany plik był zmieniony)
-            self.root.after(0, lambda: self.load_pair(self.current_index))
+            status = self.t["msg_finished"] if not interrupted else self.t["msg_interrupted"]
+            final_msg = status + self.t["batch_final_msg1"] + f": {done}/{total}. " + self.t["batch_final_msg2"] + f": {errors}."
+            self._update_batch_ui(final_msg, 100)
+            buttons["cancel"].config(state="disabled")
+            messagebox.showinfo(self.t["batch_final_msg_title"], final_msg, parent=window)
+
+        # bieżący katalog mógł być częścią korpusu
+        if self.file_pairs and not self.is_transcribing:
+            self.load_pair(self.current_index)
 
 
     def _update_batch_ui(self, message, progress_value):
@@ -2809,42 +3422,14 @@ Tekst:
             print(e)
 
 
-    def _call_gemini_api(self, image_path):
-        """ wspólna funkcja wołająca API, zwraca tekst transkrypcji """
-        client = genai.Client(api_key=self.api_key)
-
-        with open(image_path, 'rb') as f:
-            image_bytes = f.read()
-
-        model = "gemini-3-pro-preview"
-
-        contents = [
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=self.prompt_text),
-                    types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
-                ]
-            )
-        ]
-
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0,
-            thinkingConfig=types.ThinkingConfig(thinking_level=types.ThinkingLevel.LOW),
-            media_resolution=types.MediaResolution.MEDIA_RESOLUTION_HIGH,
-            automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-        )
-
-        response = client.models.generate_content(
-            model=model,
-            contents=contents,
-            config=generate_content_config
-        )
-
-        if response.usage_metadata:
-            self._log_api_usage(model, response.usage_metadata)
-
-        return response.text
+    def toggle_page_tiling(self):
+        """ wybór transkrypcji bieżącej strony w częściach (poziome pasy zachodzące na siebie) """
+        if not self.file_pairs:
+            return
+        try:
+            set_page_tiling(self.file_pairs[self.current_index], self.tile_var.get())
+        except Exception as e:
+            print(e)
 
 
     def start_ai_transcription(self):
@@ -2864,71 +3449,69 @@ Tekst:
                                  parent=self.root)
             return
 
+        # strona przetwarzana w tle zostanie zapisana przez serię
+        if self.file_pairs[self.current_index]['img'] in self.batch_pages:
+            messagebox.showwarning(self.t["msg_warning"], self.t["msg_page_in_batch"], parent=self.root)
+            return
+
+        # kopia danych wejściowych dla kolejki offline
+        current_pair = self.file_pairs[self.current_index]
+        inputs = {"prompt_text": self.prompt_text, "prompt_name": self.prompt_filename_var.get(),
+                  "combined": self.combined_ner}
+        if self._offline_pending(OP_TRANSCRIPTION, current_pair, **inputs):
+            return
+
         # blokada interfejsu
         self.is_transcribing = True
         self.btn_ai.config(state="disabled", text=self.t["btn_ai_process"])
+        # czyszczenie pola tekstowego przed startem strumienia
+        self.text_area.delete(1.0, tk.END)
         self.text_area.config(state="disabled") # bg="#222222" ?
-        self.progress_bar.pack(fill=X, pady=(0, 10), before=self.editor_frame)
-        self.progress_bar.start(10)
-
-        current_pair = self.file_pairs[self.current_index]
-        img_path = current_pair['img']
+        self._show_progress()
 
-        # uruchomienie wątku
-        thread = threading.Thread(target=self._single_worker, args=(img_path,))
-        thread.daemon = True
-        thread.start()
+        # uruchomienie zadania w silniku Gemini
+        self._submit_page_job(self._single_job(current_pair, inputs["prompt_text"], inputs["prompt_name"]),
+                              on_success=lambda entities: self._single_finished(True, "", entities),
+                              on_error=lambda e: self._single_failed(e, current_pair, inputs),
+                              on_cancel=self._single_cancelled)
 
 
-    def _single_worker(self, image_path):
-        """ wątek dla pojedynczego pliku z obsługą strumieniowania """
-        try:
-            client = genai.Client(api_key=self.api_key)
-
-            with open(image_path, 'rb') as f:
-                image_bytes = f.read()
-
-            model = "gemini-3-pro-preview"
-
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=self.prompt_text),
-                        types.Part.from_bytes(data=image_bytes, mime_type='image/jpeg')
-                    ]
-                )
-            ]
-
-            generate_content_config = types.GenerateContentConfig(
-                temperature=0,
-                thinkingConfig=types.ThinkingConfig(thinking_level=types.ThinkingLevel.LOW),
-                media_resolution=types.MediaResolution.MEDIA_RESOLUTION_HIGH,
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True)
-            )
-
-            # czyszczenie pola tekstowego przed startem strumienia (w wątku głównym)
-            self.root.after(0, lambda: self.text_area.delete(1.0, tk.END))
-
+    async def _single_job(self, pair, prompt_text, prompt_name):
+        """ transkrypcja pojedynczego pliku z obsługą strumieniowania; w trybie łączonym
+            transkrypcja i nazwy własne w jednym zapytaniu (bez strumieniowania), zwraca nazwy własne;
+            duże skany są transkrybowane w częściach (bez strumieniowania); prompt_text i prompt_name
+            są odczytywane w wątku GUI przed zleceniem zadania
+        """
+        image_path = pair['img']
+        model = await self.model_router.page_model(pair, prompt_name, self.engine.images)
+        entities = None
+        stats = {}
+        layout = await asyncio.to_thread(page_tile_layout, pair, self.tile_min_pixels)
+        if layout:
+            text = (await self.engine.transcribe_tiles(image_path, prompt_text, layout, model=model,
+                                                       stats=stats) or "").strip()
+            self.engine.dispatch(self._append_stream_text, text)
+            if self.combined_ner and text:
+                entities = await self.engine.extract_entities(text)
+        elif self.combined_ner:
+            text, entities = await self.engine.transcribe_with_entities(image_path, prompt_text,
+                                                                        model=model, stats=stats)
+            self.engine.dispatch(self._append_stream_text, (text or "").strip())
+        else:
             # iteracja po strumieniu odpowiedzi
-            loop_usage_metadata = None
-            for response in client.models.generate_content_stream(
-                model=model,
-                contents=contents,
-                config=generate_content_config
-            ):
-                if response.text:
-                    # przekazanie fragmentu tekstu do aktualizacji UI
-                    self.root.after(0, self._append_stream_text, response.text)
-                    if response.usage_metadata:
-                        loop_usage_metadata = response.usage_metadata
-
-            if loop_usage_metadata:
-                self.root.after(0, lambda: self._log_api_usage(model, loop_usage_metadata))
-
-            self.root.after(0, self._single_finished, True, "")
-        except Exception as e:
-            self.root.after(0, self._single_finished, False, str(e))
+            # zapytanie zapasowe, gdy pierwszy fragment się opóźnia (koszt zapisywany osobno w tokens.log)
+            hedge_callback = lambda model_name, usage, key=None: self._log_api_usage(model_name, usage,
+                                                                                     tag=HEDGE_TAG, key=key)
+            async for text in self.engine.stream_transcription(image_path, prompt_text, model=model,
+                                                               hedge=self.hedge_requests,
+                                                               hedge_usage_callback=hedge_callback,
+                                                               stats=stats):
+                # przekazanie fragmentu tekstu do aktualizacji UI
+                self.engine.dispatch(self._append_stream_text, text)
+
+        # model, który wykonał transkrypcję strony (przy przeciążeniu model zastępczy)
+        await asyncio.to_thread(save_metadata, metadata_path(pair['txt']), model=stats.get("model", model))
+        return entities
 
 
     def _append_stream_text(self, text):
@@ -2939,10 +3522,29 @@ Tekst:
         self.text_area.config(state="disabled") # blokada powraca na czas trwania procesu
 
 
-    def _single_finished(self, success, content):
+    def _single_cancelled(self):
+        """ transkrypcja przerwana przez użytkownika - w edytorze wraca zapisany tekst strony """
+        self._hide_progress()
+        self.is_transcribing = False
+        self.btn_ai.config(state="normal", text="Gemini")
+        self.text_area.config(state="normal")
+        self.load_pair(self.current_index)
+
+
+    def _single_failed(self, error, pair, inputs):
+        """ błąd transkrypcji strony w edytorze; bez połączenia z siecią w edytorze wraca
+            zapisany tekst strony, a transkrypcja trafia do kolejki offline
+        """
+        if not is_offline_error(error):
+            self._single_finished(False, str(error))
+            return
+        self._single_cancelled()
+        self._queue_offline(OP_TRANSCRIPTION, pair, **inputs)
+
+
+    def _single_finished(self, success, content, entities=None):
         """ aktualizacja GUI po zakończeniu pracy wątku """
-        self.progress_bar.stop()
-        self.progress_bar.pack_forget()
+        self._hide_progress()
         self.is_transcribing = False
         self.btn_ai.config(state="normal", text="Gemini")
         self.text_area.config(state="normal")
@@ -2950,17 +3552,32 @@ Tekst:
         if success:
             # zapisywanie finalnej wersji po zakończeniu strumieniowania
             self.save_current_text(True)
+            if entities:
+                # nazwy własne z odpowiedzi łączonej, suma kontrolna zapisanego tekstu
+                text = self.text_area.get(1.0, tk.END).strip()
+                self._ner_done(entities, self._get_ner_json_path(), calculate_checksum(text))
             messagebox.showinfo(self.t["msg_csv_ok_title"],
                                 self.t["msg_transcription_ok"],
                                 parent=self.root)
             self.root.focus_set()
         else:
+            # w edytorze wraca zapisany tekst strony (pusty lub niepełny tekst nie może nadpisać
+            # pliku przy przejściu do innej strony)
+            self.load_pair(self.current_index)
             messagebox.showerror(self.t["msg_transcription_error_title"],
                                  f"Info:\n{content}",
                                  parent=self.root)
             self.root.focus_set()
 
 
+    def _prompt_changed(self, old_prompt):
+        """ usunięcie wpisów pamięci kontekstu API z poprzednią treścią promptu
+            (nowa treść zostanie zapisana w pamięci przy pierwszym zapytaniu)
+        """
+        if old_prompt and old_prompt != self.prompt_text:
+            self.engine.submit(self.prompt_context.invalidate(old_prompt))
+
+
     def edit_current_prompt(self):
         """ Otwiera okno edycji aktualnego promptu """
         if not self.current_prompt_path or not os.path.exists(self.current_prompt_path):
@@ -2991,7 +3608,9 @@ Tekst:
             try:
                 with open(self.current_prompt_path, 'w', encoding='utf-8') as f:
                     f.write(new_content)
+                old_prompt = self.prompt_text
                 self.prompt_text = new_content
+                self._prompt_changed(old_prompt)
                 messagebox.showinfo(self.t["msg_save_prompt_title"],
                                     self.t["msg_save_prompt_text"],
                                     parent=edit_win)
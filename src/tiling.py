@@ -0,0 +1,89 @@
+""" transkrypcja dużych skanów (mapy, księgi, gazety) w częściach: podział skanu na zachodzące
+    na siebie poziome pasy i łączenie tekstu pasów z usunięciem wierszy powtórzonych na zakładkach
+"""
+import re
+import math
+import difflib
+
+
+# skany o tej liczbie pikseli i większe są dzielone automatycznie (0 - tylko wybrane strony)
+DEFAULT_TILE_MIN_PIXELS = 40_000_000
+# docelowa liczba pikseli jednego pasa
+DEFAULT_TILE_PIXELS = 12_000_000
+# zakładka między sąsiednimi pasami (część wysokości pasa)
+DEFAULT_OVERLAP = 0.12
+# maksymalna liczba wierszy porównywanych na granicy pasów
+MAX_OVERLAP_LINES = 12
+# minimalne podobieństwo wierszy uznawanych za powtórzenie (ten sam wiersz odczytany z dwóch
+# pasów może się nieznacznie różnić)
+LINE_SIMILARITY = 0.85
+
+
+def image_size(image_path):
+    """ (szerokość, wysokość) skanu, odczyt samego nagłówka pliku """
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def tile_layout(width, height, tile_pixels=DEFAULT_TILE_PIXELS, overlap=DEFAULT_OVERLAP, min_tiles=1):
+    """ zachodzące na siebie poziome pasy pokrywające skan: lista [lewo, góra, prawo, dół] """
+    count = max(min_tiles, math.ceil(width * height / tile_pixels))
+    if count <= 1:
+        return [[0, 0, width, height]]
+
+    # wysokość pasa tak, by 'count' pasów z zakładkami pokryło całą wysokość skanu
+    tile_height = height / (1 + (count - 1) * (1 - overlap))
+    step = tile_height * (1 - overlap)
+    layout = []
+    for index in range(count):
+        top = round(index * step)
+        bottom = height if index == count - 1 else min(height, round(index * step + tile_height))
+        layout.append([0, top, width, bottom])
+    return layout
+
+
+def _normalize(line):
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _similar(line_a, line_b):
+    a, b = _normalize(line_a), _normalize(line_b)
+    if not a or not b:
+        return a == b
+    # wiersz przecięty krawędzią pasa może być odczytany tylko w części
+    if len(a) > 10 and len(b) > 10 and (a in b or b in a):
+        return True
+    # wiersze różniące się liczbami (np. kolejne pozycje rejestru) nie są powtórzeniem
+    if re.findall(r"\d+", a) != re.findall(r"\d+", b):
+        return False
+    return difflib.SequenceMatcher(None, a, b).ratio() >= LINE_SIMILARITY
+
+
+def _overlap_length(previous, following):
+    """ liczba początkowych wierszy 'following' powtarzających końcowe wiersze 'previous' """
+    limit = min(MAX_OVERLAP_LINES, len(previous), len(following))
+    for count in range(limit, 0, -1):
+        if all(_similar(a, b) for a, b in zip(previous[-count:], following[:count])):
+            return count
+    return 0
+
+
+def merge_tile_texts(texts):
+    """ tekst strony z transkrypcji kolejnych pasów, bez wierszy odczytanych dwukrotnie
+        na zakładce (przy różnicy zostaje dłuższa wersja wiersza)
+    """
+    lines = []
+    for text in texts:
+        following = (text or "").strip().splitlines()
+        # puste wiersze na granicy pasów nie są porównywane
+        while lines and not lines[-1].strip():
+            lines.pop()
+        count = _overlap_length(lines, following)
+        for offset in range(count):
+            index = len(lines) - count + offset
+            if len(following[offset].strip()) > len(lines[index].strip()):
+                lines[index] = following[offset]
+        lines.extend(following[count:])
+    return "\n".join(lines).strip()
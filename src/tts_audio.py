@@ -0,0 +1,34 @@
+""" zapis audio generowanego przez model TTS """
+import os
+import wave
+
+
+def wave_file(filename, pcm, channels=1, rate=24000, sample_width=2):
+    """ zapis pliku WAV """
+    with wave.open(filename, "wb") as wf:
+        wf.setnchannels(channels)     # pylint: disable=E1101
+        wf.setsampwidth(sample_width) # pylint: disable=E1101
+        wf.setframerate(rate)         # pylint: disable=E1101
+        wf.writeframes(pcm)           # pylint: disable=E1101
+
+
+def convert_wav_to_mp3(input_file, output_file):
+    """ konwersja WAV na MP3 """
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_raw(
+        input_file,
+        sample_width=2,
+        frame_rate=24000,
+        channels=1
+    )
+
+    audio.export(output_file, format="mp3", bitrate="128k")
+
+
+def save_tts_audio(pcm, mp3_path):
+    """ zapis danych audio do pliku MP3 (przez tymczasowy WAV) """
+    wav_path = os.path.splitext(mp3_path)[0] + ".wav"
+    wave_file(wav_path, pcm)
+    convert_wav_to_mp3(wav_path, mp3_path)
+    os.remove(wav_path)
@@ -0,0 +1,74 @@
+""" zapis zużycia tokenów i kosztów wywołań API w pliku tokens.log katalogu skanów """
+import os
+import threading
+from datetime import datetime
+from batch_api import BATCH_PRICE_FACTOR
+
+
+USAGE_LOG_FILE = "tokens.log"
+
+# ceny (USD za 1 mln tokenów wejściowych, wyjściowych)
+MODEL_PRICES = {
+    "gemini-3-pro-preview": (2.0, 12.0),
+    "gemini-3-flash-preview": (0.5, 3.0),
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-3-pro-image-preview": (2.0, 12.0),
+    "gemini-flash-latest": (0.3, 2.5),
+    "gemini-2.5-flash-preview-tts": (0.5, 10.0)
+}
+
+# oznaczenie wpisów tokens.log z przerwanymi zapytaniami zapasowymi (koszt hedgingu)
+HEDGE_TAG = "hedge"
+
+# tokeny wejściowe odczytane z pamięci kontekstu są rozliczane po niższej cenie
+CACHED_PRICE_FACTOR = 0.1
+
+
+def usage_cost(model_name, in_tokens, out_tokens, batch=False, cached_tokens=0):
+    """ koszt wywołania w USD (batch - cena Batch API, cached_tokens - część tokenów
+        wejściowych odczytana z pamięci kontekstu)
+    """
+    prices = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    cached_tokens = min(cached_tokens, in_tokens)
+    in_cost = ((in_tokens - cached_tokens) + cached_tokens * CACHED_PRICE_FACTOR) / 1_000_000 * prices[0]
+    cost = in_cost + (out_tokens / 1_000_000 * prices[1])
+    if batch:
+        cost *= BATCH_PRICE_FACTOR
+    return cost
+
+
+class UsageLog:
+    """ dopisywanie wierszy 'data;model;tokeny_we;tokeny_wy;koszt;tokeny_z_pamięci;prompt;klucz'
+        do tokens.log, bezpieczne przy wywołaniach z wielu wątków (prompt - nazwa promptu transkrypcji
+        serii, podstawa szacowania kosztu kolejnych serii, klucz - nazwa klucza API z puli)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+
+
+    def record(self, folder, model_name, usage_metadata, batch=False, tag="", key=None):
+        """ zapis zużycia jednego wywołania w katalogu 'folder' """
+        if not usage_metadata:
+            return
+
+        in_tokens = usage_metadata.prompt_token_count or 0
+        out_tokens = usage_metadata.candidates_token_count or 0
+        cached_tokens = usage_metadata.cached_content_token_count or 0
+        cost = usage_cost(model_name, in_tokens, out_tokens, batch, cached_tokens)
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        log_line = f"{now};{model_name};{in_tokens};{out_tokens};{cost:.6f};{cached_tokens};{tag};{key or ''}\n"
+
+        with self._lock:
+            with open(os.path.join(folder, USAGE_LOG_FILE), "a", encoding="utf-8") as f:
+                f.write(log_line)
+
+
+    def callback(self, folder, tag=""):
+        """ funkcja zapisu zużycia dla silnika (usage_callback) dla wskazanego katalogu """
+        def _record(model_name, usage_metadata, batch=False, key=None):
+            try:
+                self.record(folder, model_name, usage_metadata, batch, tag, key)
+            except Exception as e:
+                print(f"Błąd zapisu {USAGE_LOG_FILE}: {e}")
+        return _record
@@ -0,0 +1,5 @@
+""" moduły aplikacji są importowane z katalogu src (jak przy uruchamianiu programu) """
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
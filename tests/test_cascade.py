@@ -0,0 +1,51 @@
+""" transkrypcja dwuetapowa: stan plików strony po błędzie drugiego etapu """
+import asyncio
+import os
+import pytest
+import cascade
+from scan_files import save_metadata, metadata_path
+
+
+def fake_transcribe(texts):
+    """ transkrypcja zapisująca plik txt strony (texts: model -> tekst lub wyjątek) """
+    async def transcribe_page(engine, pair, prompt_text, model=None, **kwargs):
+        result = texts[model]
+        if isinstance(result, Exception):
+            raise result
+        with open(pair['txt'], 'w', encoding='utf-8') as f:
+            f.write(result)
+        save_metadata(metadata_path(pair['txt']), model=model)
+        return {}
+    return transcribe_page
+
+
+def run_cascade(tmp_path, monkeypatch, texts):
+    monkeypatch.setattr(cascade, "transcribe_page", fake_transcribe(texts))
+    pair = {"img": str(tmp_path / "a.jpg"), "txt": str(tmp_path / "a.txt"), "name": "a"}
+    return pair, asyncio.run(cascade.cascade_page(None, pair, "prompt", model="pro", first_model="flash",
+                                                  min_line_ratio=0))
+
+
+def test_failed_escalation_leaves_no_first_pass_text(tmp_path, monkeypatch):
+    with pytest.raises(RuntimeError):
+        run_cascade(tmp_path, monkeypatch, {"flash": "ala [nieczytelne] ma [kota?]", "pro": RuntimeError("503")})
+    assert not os.path.exists(tmp_path / "a.txt")
+    assert not os.path.exists(tmp_path / "a.json")
+
+
+def test_failed_escalation_restores_previous_text(tmp_path, monkeypatch):
+    (tmp_path / "a.txt").write_text("poprzedni tekst", encoding='utf-8')
+    with pytest.raises(RuntimeError):
+        run_cascade(tmp_path, monkeypatch, {"flash": "ala [nieczytelne] ma [kota?]", "pro": RuntimeError("503")})
+    assert (tmp_path / "a.txt").read_text(encoding='utf-8') == "poprzedni tekst"
+
+
+def test_escalated_and_confident_pages(tmp_path, monkeypatch):
+    pair, stats = run_cascade(tmp_path, monkeypatch, {"flash": "ala [nieczytelne] ma [kota?]", "pro": "ala ma kota"})
+    assert stats["escalated"] == "markers"
+    assert (tmp_path / "a.txt").read_text(encoding='utf-8') == "ala ma kota"
+
+    (tmp_path / "a.txt").unlink()
+    pair, stats = run_cascade(tmp_path, monkeypatch, {"flash": "ala ma kota", "pro": RuntimeError("503")})
+    assert stats["escalated"] is None
+    assert (tmp_path / "a.txt").read_text(encoding='utf-8') == "ala ma kota"
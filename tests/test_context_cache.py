@@ -0,0 +1,105 @@
+""" pamięć kontekstu API: długi prompt jest zapisywany jako cached content i używany w zapytaniach """
+from types import SimpleNamespace
+from google.genai import types, errors
+from context_cache import ContextCache
+from gemini_engine import GeminiEngine
+
+
+class FakeAio:
+    """ klient asynchroniczny zapisujący wywołania cached content i generate_content """
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+        self.requests = []
+        self.caches = SimpleNamespace(create=self._create, delete=self._delete)
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    async def _create(self, model, config):
+        self.created.append((model, config))
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    async def _delete(self, name):
+        self.deleted.append(name)
+
+    async def _generate(self, model, contents, config):
+        self.requests.append((model, contents, config))
+        return SimpleNamespace(text="ok", usage_metadata=None)
+
+
+class FakeClientManager:
+    def __init__(self):
+        self.client = SimpleNamespace(aio=FakeAio())
+        self.key_names = ["*test"]
+        self.primary_key_name = "*test"
+
+    def get_client(self, name=None):
+        return self.client
+
+
+def make_engine(min_tokens=1024):
+    manager = FakeClientManager()
+    context = ContextCache(manager, min_tokens=min_tokens)
+    return GeminiEngine(manager, context_cache=context), manager.client.aio
+
+
+def generate(engine, prompt_text):
+    parts = [types.Part.from_text(text="tekst strony")]
+    return engine.run(engine.generate_with_prompt("gemini-3-flash-preview", prompt_text, parts,
+                                                  types.GenerateContentConfig()), timeout=10)
+
+
+def test_long_prompt_uses_cached_content():
+    engine, aio = make_engine()
+    try:
+        prompt = "Przepisz tekst ze skanu. " * 800
+        generate(engine, prompt)
+        generate(engine, prompt)
+
+        # jeden wpis dla promptu, kolejne zapytania wysyłają tylko tekst strony
+        assert len(aio.created) == 1
+        assert [config.cached_content for _, _, config in aio.requests] == ["cachedContents/1"] * 2
+        for _, contents, _ in aio.requests:
+            assert [part.text for part in contents[0].parts] == ["tekst strony"]
+
+        # zmiana promptu usuwa wpis także po stronie API
+        engine.run(engine.context.invalidate(prompt), timeout=10)
+        assert aio.deleted == ["cachedContents/1"]
+    finally:
+        engine.shutdown()
+
+
+def test_short_prompt_is_sent_in_request():
+    engine, aio = make_engine()
+    try:
+        generate(engine, "Krótki prompt.")
+        assert aio.created == []
+        _, contents, config = aio.requests[0]
+        assert config.cached_content is None
+        assert contents[0].parts[0].text == "Krótki prompt."
+    finally:
+        engine.shutdown()
+
+
+def test_expired_entry_falls_back_to_full_prompt():
+    engine, aio = make_engine(min_tokens=10)
+    try:
+        prompt = "Przepisz tekst ze skanu. " * 20
+        calls = []
+
+        async def generate_content(model, contents, config):
+            calls.append(config.cached_content)
+            if config.cached_content:
+                raise_not_found()
+            return SimpleNamespace(text="ok", usage_metadata=None)
+        aio.models.generate_content = generate_content
+
+        assert generate(engine, prompt).text == "ok"
+        assert calls == ["cachedContents/1", None]
+    finally:
+        engine.shutdown()
+
+
+def raise_not_found():
+    """ błąd API dla wpisu, który wygasł lub został usunięty """
+    raise errors.ClientError(404, {"error": {"code": 404, "message": "CachedContent not found",
+                                             "status": "NOT_FOUND"}})
@@ -0,0 +1,43 @@
+""" łańcuchy modeli zastępczych i ponawianie zapytań """
+import httpx
+from rate_control import RateController, RequestTimeout, is_offline_error
+
+CHAIN = {"transcription": ["gemini-3-pro-preview", "gemini-2.5-pro", "gemini-3-flash-preview"]}
+
+
+def test_configured_chain_is_used_as_is():
+    rate = RateController(fallbacks=CHAIN)
+    assert rate.model_chain("gemini-3-pro-preview", "transcription") == CHAIN["transcription"]
+    # łańcuch zaczyna się od modelu wybranego dla zapytania
+    assert rate.model_chain("gemini-2.5-pro", "transcription") == ["gemini-2.5-pro", "gemini-3-flash-preview"]
+    assert rate.model_chain("gemini-3-pro-preview", "ner") == ["gemini-3-pro-preview"]
+
+
+def test_no_downgrade_skips_lower_class(capsys):
+    rate = RateController(fallbacks=CHAIN, no_downgrade=True)
+    assert rate.model_chain("gemini-3-pro-preview", "transcription") == ["gemini-3-pro-preview", "gemini-2.5-pro"]
+    assert "gemini-3-flash-preview" in capsys.readouterr().out
+    # model bez oznaczenia klasy zachowuje cały łańcuch
+    rate = RateController(fallbacks={"ner": ["custom-model", "gemini-3-flash-preview"]}, no_downgrade=True)
+    assert rate.model_chain("custom-model", "ner") == ["custom-model", "gemini-3-flash-preview"]
+
+
+def test_failover_after_one_retry():
+    rate = RateController(fallbacks=CHAIN)
+    error = RequestTimeout("gemini-3-pro-preview", 5)
+    assert rate.retry_delay("gemini-3-pro-preview", error, 0, failover=True) is not None
+    assert rate.retry_delay("gemini-3-pro-preview", error, 1, failover=True) is None
+
+
+def test_connect_error_is_retried_once():
+    rate = RateController()
+    error = httpx.ConnectError("brak sieci")
+    assert rate.retry_delay("gemini-3-flash-preview", error, 0) is not None
+    assert rate.retry_delay("gemini-3-flash-preview", error, 1) is None
+
+
+def test_offline_errors():
+    assert is_offline_error(httpx.ConnectError("brak sieci"))
+    assert is_offline_error(httpx.ReadError("zerwane połączenie"))
+    assert not is_offline_error(httpx.ReadTimeout("brak odpowiedzi"))
+    assert not is_offline_error(RequestTimeout("gemini-3-flash-preview", 5))